@@ -0,0 +1,202 @@
+"""Memory-mapped intermediate store for annual degree day grids.
+
+Each model, scenario, and metric gets one raw `.npy` stack of shape (n_years, height, width) indexed by year, plus a small JSON sidecar with the years, the years written so far, and the raster profile of the grid. Years that were never written hold nodata, so readers check the written years instead of treating them as missing data. Workers write their year into the stack in place and downstream stages read zero-copy slices, so intermediate products skip GeoTIFF compression entirely. GeoTIFFs are only written by `publish_geotiffs` at the final publication step.
+
+Example usage (publish every store as GeoTIFFs in `reprojected_dir`):
+    python array_store.py
+"""
+
+import fcntl
+import json
+import os
+
+import numpy as np
+
+from config import store_dir, reprojected_dir, model_years, daymet_years
+import instrument
+from reproject import (
+    make_reprojected_filename,
+    serialize_profile,
+    deserialize_profile,
+    write_raster_to_disk,
+)
+
+
+def store_paths(model, scenario, metric):
+    """Get the paths of the array stack and its JSON sidecar for a group. Updates of the sidecar are serialized with a lock file next to it (`<stem>.lock`).
+
+    Args:
+        model (str): model name or "daymet"
+        scenario (str): scenario name or "historical" for Daymet
+        metric (str): degree day metric
+
+    Returns:
+        tuple: (stack_fp, meta_fp)
+    """
+    stem = f"{model}_{scenario}_{metric}"
+    return store_dir / f"{stem}.npy", store_dir / f"{stem}.json"
+
+
+def create_store(model, scenario, metric, raster_profile, overwrite=False):
+    """Create the array stack for a group, filled with nodata, covering every year of the model or Daymet record.
+
+    The store must be created before workers write to it. An existing store is left as is unless `overwrite` is set, so runs over a subset of years can fill in the same store.
+
+    Args:
+        model (str): model name or "daymet"
+        scenario (str): scenario name or "historical" for Daymet
+        metric (str): degree day metric
+        raster_profile (dict): raster profile of the grid stored, e.g. the EPSG:3338 profile from `reproject.build_warp_index`
+        overwrite (bool): recreate the store if it already exists
+
+    Returns:
+        None
+    """
+    stack_fp, meta_fp = store_paths(model, scenario, metric)
+    if meta_fp.exists() and not overwrite:
+        return
+
+    years = daymet_years if model == "daymet" else model_years
+    shape = (len(years), raster_profile["height"], raster_profile["width"])
+    stack = np.lib.format.open_memmap(
+        stack_fp, mode="w+", dtype=np.float32, shape=shape
+    )
+    stack[:] = raster_profile["nodata"]
+    stack.flush()
+
+    # the sidecar is written last so its existence means the stack is ready
+    with open(meta_fp, "w") as f:
+        json.dump(
+            {
+                "years": years,
+                "written_years": [],
+                "profile": serialize_profile(raster_profile),
+            },
+            f,
+        )
+
+
+def read_meta(model, scenario, metric):
+    """Read the JSON sidecar for a group."""
+    with open(store_paths(model, scenario, metric)[1]) as f:
+        return json.load(f)
+
+
+def record_written_year(model, scenario, metric, year):
+    """Add a year to the written years of the JSON sidecar for a group. Workers update the sidecar under an exclusive lock and replace it atomically, so concurrent writers never lose a year and readers never see a partial sidecar."""
+    meta_fp = store_paths(model, scenario, metric)[1]
+    with open(meta_fp.with_suffix(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        meta = read_meta(model, scenario, metric)
+        meta["written_years"] = sorted(set(meta.get("written_years", [])) | {year})
+        tmp_fp = meta_fp.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_fp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_fp, meta_fp)
+
+
+def check_written_years(meta, years, group):
+    """Raise a ValueError if any of `years` was never written to a store.
+
+    Args:
+        meta (dict): JSON sidecar of the store, from `read_meta` or `open_store`
+        years (iterable): years that must have been written
+        group (tuple): (model, scenario, metric) of the store, for the error message
+
+    Returns:
+        None
+    """
+    missing = sorted(set(years) - set(meta.get("written_years", [])))
+    if missing:
+        raise ValueError(
+            f"{len(missing)} years of the {' '.join(group)} store were never written: {missing}"
+        )
+
+
+def open_store(model, scenario, metric, mode="r"):
+    """Memory map the array stack for a group.
+
+    Args:
+        model (str): model name or "daymet"
+        scenario (str): scenario name or "historical" for Daymet
+        metric (str): degree day metric
+        mode (str): "r" for read-only or "r+" to write
+
+    Returns:
+        tuple: (stack, meta) where stack is a memory mapped (n_years, height, width) array
+    """
+    meta = read_meta(model, scenario, metric)
+    stack = np.load(store_paths(model, scenario, metric)[0], mmap_mode=mode)
+    return stack, meta
+
+
+@instrument.traced(tag_args=("model", "scenario", "metric", "year"))
+def write_year(model, scenario, metric, year, raster_data):
+    """Write one year of data into the array stack for a group.
+
+    Args:
+        model (str): model name or "daymet"
+        scenario (str): scenario name or "historical" for Daymet
+        metric (str): degree day metric
+        year (int): year of the data
+        raster_data (ndarray): 2d array on the stored grid
+
+    Returns:
+        None
+    """
+    # worker processes on the same node can write different years at the same time,
+    # the memory map is shared through the page cache
+    stack, meta = open_store(model, scenario, metric, mode="r+")
+    stack[meta["years"].index(year)] = raster_data
+    stack.flush()
+    # recorded only once the data is flushed, so a written year is always complete
+    record_written_year(model, scenario, metric, year)
+
+
+def read_year(model, scenario, metric, year):
+    """Get a zero-copy, read-only view of one year of data for a group."""
+    stack, meta = open_store(model, scenario, metric)
+    return stack[meta["years"].index(year)]
+
+
+def list_stores():
+    """List the (model, scenario, metric) groups that have a store."""
+    groups = []
+    for meta_fp in sorted(store_dir.glob("*.json")):
+        model, scenario, *metric_parts = meta_fp.stem.split("_")
+        groups.append((model, scenario, "_".join(metric_parts)))
+    return groups
+
+
+def publish_geotiffs(model, scenario, metric, name_prefix="ncar_12km"):
+    """Write every written year in the store for a group as a GeoTIFF in `reprojected_dir`, using the same file names as `reproject.reproject_raster`. Years that were never written are skipped.
+
+    Args:
+        model (str): model name or "daymet"
+        scenario (str): scenario name or "historical" for Daymet
+        metric (str): degree day metric
+        name_prefix (str): prefix for the output file names
+
+    Returns:
+        out_files (list): paths of the GeoTIFFs written
+    """
+    stack, meta = open_store(model, scenario, metric)
+    raster_profile = deserialize_profile(meta["profile"])
+
+    out_files = []
+    written_years = set(meta.get("written_years", []))
+    for year, raster_data in zip(meta["years"], stack):
+        if year not in written_years:
+            continue
+        out_file = reprojected_dir / make_reprojected_filename(
+            f"{model}_{scenario}_{metric}_{year}.tif", name_prefix
+        )
+        write_raster_to_disk(out_file, raster_profile, raster_data)
+        out_files.append(out_file)
+    return out_files
+
+
+if __name__ == "__main__":
+    for group in list_stores():
+        out_files = publish_geotiffs(*group)
+        print(f"{' '.join(group)}: {len(out_files)} GeoTIFFs written")
@@ -0,0 +1,105 @@
+"""Benchmark the peak memory (RSS) of preparing and summarizing a single input file with the different `prep_dataset.prep_ds` loading modes.
+
+Each file and mode is run in a fresh Python process so the peak RSS reported by the operating system belongs to that run alone. This tells us how many files we can process concurrently per node. The tracemalloc peak of the Python and numpy allocations of the run is reported too. `benchmark_suite.py` reuses `benchmark_file` for its loading mode stages, so both report the same measurement.
+
+Example usage:
+    python benchmark.py /atlas_scratch/Base_Data/AK_NCAR_12km/met/CCSM4/rcp45/CCSM4_rcp45_BCSD_met_2065.nc4
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# loading modes to compare, as keyword arguments to `prep_dataset.prep_ds`
+prep_modes = {
+    "default": {},
+    "lean": {"lean": True},
+    "lean_chunked": {"lean": True, "time_chunk": 32},
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB.
+
+    On Linux this is VmHWM from /proc/self/status. ru_maxrss is carried over from the parent through fork and exec, so a child started from a large process (e.g. `benchmark_suite.py`) would report the parent's peak. ru_maxrss (in KB on Linux) is used where /proc is not available.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(fp, mode):
+    """Prepare and summarize one file with one loading mode and print the results as JSON. Meant to be run in a fresh process."""
+    import prep_dataset
+    import compute_degree_days
+
+    baseline_mb = peak_rss_mb()
+    tracemalloc.start()
+    tic = time.perf_counter()
+    ds, _ = prep_dataset.prep_ds(fp, **prep_modes[mode])
+    compute_degree_days.compute_all_metrics(ds)
+    wall_time = time.perf_counter() - tic
+    peak_traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {
+        "file": str(fp),
+        "mode": mode,
+        "wall_time_s": round(wall_time, 3),
+        "peak_traced_mb": round(peak_traced / 1024**2, 1),
+        "baseline_rss_mb": round(baseline_mb, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(json.dumps(result))
+
+
+def benchmark_file(fp, modes):
+    """Run each loading mode for a file in its own process and collect the results.
+
+    Args:
+        fp (str): input netCDF file
+        modes (list): loading modes, keys of `prep_modes`
+
+    Returns:
+        list: result dict of each mode, as printed by `run_child`
+    """
+    results = []
+    for mode in modes:
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", mode, str(fp)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="+", help="input netCDF files")
+    parser.add_argument(
+        "--modes", nargs="+", default=list(prep_modes), choices=list(prep_modes)
+    )
+    parser.add_argument("--child", choices=list(prep_modes), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.files[0], args.child)
+        sys.exit(0)
+
+    print(f"{'file':<40} {'mode':<14} {'wall (s)':>9} {'peak traced (MB)':>17} {'peak RSS (MB)':>14} {'above baseline (MB)':>20}")
+    for fp in args.files:
+        for r in benchmark_file(fp, args.modes):
+            print(
+                f"{fp.split('/')[-1]:<40} {r['mode']:<14} {r['wall_time_s']:>9.2f} {r['peak_traced_mb']:>17.1f} {r['peak_rss_mb']:>14.1f} {r['peak_rss_mb'] - r['baseline_rss_mb']:>20.1f}"
+            )
@@ -0,0 +1,339 @@
+"""Benchmark the degree day hot paths on synthetic data, so regressions can be measured without the source data on Atlas.
+
+Synthetic daily tmin / tmax files are generated on the NCAR 12km WRF grid (209 x 299 pixels, with about three quarters of the domain NaN like the real ocean mask) with the same structure as the source files: (time, y, x) temperatures in degrees C, 2d latitude / longitude, and a pcp variable. The daily values follow a seasonal cycle with a north-south gradient and noise, so every degree day threshold is crossed somewhere in the domain.
+
+Each stage is timed on its own (summarize_year_dd vs compute_all_metrics, reproject_raster vs the warp index, climatologies) along with the end-to-end per-file path used by `run.py`. Wall time is the best of `--repeat` runs and peak memory is the tracemalloc peak of the Python and numpy allocations made by the stage (allocations inside GDAL and HDF5 are not traced). The peak RSS of the whole process is recorded too.
+
+The `prep_ds` loading modes are measured with `benchmark.benchmark_file`, i.e. preparing and summarizing a file in a fresh process per mode, so these stages also report the peak RSS above the baseline of that process and match what `benchmark.py` reports. The RSS of this process is shared by every stage, so it cannot tell the loading modes apart. Results are appended to a JSON history file and compared with the previous entry.
+
+All inputs and outputs go to a temporary directory, `DATA_DIR` and `OUTPUT_DIR` are pointed there before `config` is imported.
+
+Example usage:
+    python benchmark_suite.py --years 3 --repeat 3 --history benchmark_history.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from benchmark import benchmark_file, peak_rss_mb, prep_modes
+
+# `config` can only be imported once DATA_DIR and OUTPUT_DIR point at the synthetic data,
+# so put the repository root on sys.path for the shared grid registry here
+sys.path.append(str(Path(__file__).parent.parent))
+import grids
+
+# dimensions of the source WRF grid
+wrf_ny, wrf_nx = grids.grids["wrf_12km"]["shape"]
+
+synthetic_model = "CCSM4"
+synthetic_scenario = "rcp45"
+
+
+def make_land_mask(ny=wrf_ny, nx=wrf_nx):
+    """Make an elliptical land mask covering about a quarter of the grid, similar to the share of valid pixels in the source data."""
+    yy, xx = np.mgrid[0:ny, 0:nx]
+    return ((yy - ny * 0.55) / (ny * 0.3)) ** 2 + ((xx - nx * 0.45) / (nx * 0.3)) ** 2 < 1
+
+
+def make_synthetic_file(fp, year, time_offset_hours=0, seed=0):
+    """Write one year of synthetic daily data with the structure of a source file.
+
+    Args:
+        fp (pathlib.Path): output netCDF file
+        year (int): year of the data
+        time_offset_hours (int): hour of the daily time stamps, 12 for Daymet and 0 for the models
+        seed (int): random seed, combined with the year
+
+    Returns:
+        None
+    """
+    from pyproj import Transformer
+
+    time = pd.date_range(f"{year}-01-01", f"{year}-12-31", freq="D") + pd.Timedelta(
+        hours=time_offset_hours
+    )
+    rng = np.random.default_rng(seed + year)
+
+    # seasonal cycle peaking in mid July, colder to the north
+    doy = time.dayofyear.values.astype(np.float32)
+    seasonal = -np.cos(2 * np.pi * (doy - 15) / 365).astype(np.float32) * 18
+    gradient = np.linspace(-14, 6, wrf_ny, dtype=np.float32)[::-1, None]
+    tavg = seasonal[:, None, None] + gradient[None] - 2
+    tavg = tavg + rng.normal(0, 4, (len(time), wrf_ny, wrf_nx)).astype(np.float32)
+    tmin = tavg - 5
+    tmax = tavg + 5
+    pcp = rng.gamma(0.5, 2, (len(time), wrf_ny, wrf_nx)).astype(np.float32)
+
+    ocean = ~make_land_mask()
+    for arr in (tmin, tmax, pcp):
+        arr[:, ocean] = np.nan
+
+    # latitude and longitude of the WRF grid cell centers
+    grid = grids.wrf_grid(wrf_ny, wrf_nx)
+    transformer = Transformer.from_crs(
+        grids.get_crs("wrf_12km"), "EPSG:4326", always_xy=True
+    )
+    lon, lat = transformer.transform(*np.meshgrid(grid["x"], grid["y"]))
+
+    dims = ("time", "y", "x")
+    ds = xr.Dataset(
+        {
+            "tmin": (dims, tmin, {"units": "degC", "long_name": "daily minimum temperature"}),
+            "tmax": (dims, tmax, {"units": "degC", "long_name": "daily maximum temperature"}),
+            "pcp": (dims, pcp, {"units": "mm", "long_name": "daily precipitation"}),
+        },
+        coords={
+            "time": time,
+            "latitude": (("y", "x"), lat, {"units": "degrees_north"}),
+            "longitude": (("y", "x"), lon, {"units": "degrees_east"}),
+        },
+    )
+    fp.parent.mkdir(exist_ok=True, parents=True)
+    ds.to_netcdf(fp)
+
+
+def make_synthetic_data(data_dir, years):
+    """Write synthetic Daymet and model source files for some years.
+
+    Args:
+        data_dir (pathlib.Path): directory laid out like `config.DATA_DIR`
+        years (list): years to write
+
+    Returns:
+        input_files (list): list of (src_file, model, scenario, year) tuples like `run.list_input_files`
+    """
+    input_files = []
+    for year in years:
+        fp = data_dir / "daymet" / f"daymet_met_{year}.nc"
+        make_synthetic_file(fp, year, time_offset_hours=12, seed=1)
+        input_files.append((fp, "daymet", "historical", year))
+
+        fp = (
+            data_dir
+            / synthetic_model
+            / synthetic_scenario
+            / f"{synthetic_model}_{synthetic_scenario}_BCSD_met_{year}.nc4"
+        )
+        make_synthetic_file(fp, year, seed=2)
+        input_files.append((fp, synthetic_model, synthetic_scenario, year))
+    return input_files
+
+
+def measure(func, repeat=1):
+    """Time a function and trace its peak memory.
+
+    Args:
+        func (callable): function without arguments
+        repeat (int): number of runs
+
+    Returns:
+        dict: best "wall_time_s" over the runs and the largest "peak_traced_mb"
+    """
+    wall_times = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        tic = time.perf_counter()
+        func()
+        wall_times.append(time.perf_counter() - tic)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {
+        "wall_time_s": round(min(wall_times), 4),
+        "peak_traced_mb": round(peak / 1024**2, 1),
+    }
+
+
+def run_suite(input_files, repeat=1):
+    """Run every benchmark stage. `config` must point at the synthetic data before this is called.
+
+    Args:
+        input_files (list): list of (src_file, model, scenario, year) tuples from `make_synthetic_data`
+        repeat (int): number of runs per stage
+
+    Returns:
+        results (dict): measurements keyed by stage name
+    """
+    import compute_climos
+    import compute_degree_days
+    import prep_dataset
+    import reproject
+    import run
+    from config import metrics, reprojected_dir, aux_dir
+
+    src_file = input_files[0][0]
+    years = sorted({year for *_, year in input_files})
+    results = {}
+
+    # each loading mode runs prep_ds and compute_all_metrics in a fresh process, like benchmark.py
+    runs = [benchmark_file(src_file, list(prep_modes)) for _ in range(repeat)]
+    for i, mode in enumerate(prep_modes):
+        mode_runs = [run_results[i] for run_results in runs]
+        results[f"prep_and_summarize_{mode}"] = {
+            "wall_time_s": min(r["wall_time_s"] for r in mode_runs),
+            "peak_traced_mb": max(r["peak_traced_mb"] for r in mode_runs),
+            "peak_rss_above_baseline_mb": round(
+                max(r["peak_rss_mb"] - r["baseline_rss_mb"] for r in mode_runs), 1
+            ),
+        }
+
+    ds, wrf_profile = prep_dataset.prep_ds(src_file, lean=True)
+    thresholds = [compute_degree_days.metric_thresholds[metric] for metric in metrics]
+    # summarize_year_dd is dask delayed, one call and compute per metric
+    results["summarize_year_dd"] = measure(
+        lambda: [
+            compute_degree_days.summarize_year_dd(ds, *t).compute() for t in thresholds
+        ],
+        repeat,
+    )
+    results["compute_all_metrics"] = measure(
+        lambda: compute_degree_days.compute_all_metrics(ds), repeat
+    )
+
+    # reproject_raster reads a WRF grid GeoTIFF, like the original pipeline
+    degree_days, _ = compute_degree_days.compute_all_metrics(ds)
+    wrf_tif = aux_dir / f"{synthetic_model}_{synthetic_scenario}_{metrics[0]}_{years[0]}.tif"
+    reproject.write_raster_to_disk(wrf_tif, wrf_profile, np.flipud(degree_days[0]))
+    results["reproject_raster"] = measure(
+        lambda: reproject.reproject_raster(wrf_tif, "benchmark"), repeat
+    )
+    results["build_warp_index"] = measure(
+        lambda: reproject.build_warp_index(wrf_profile), repeat
+    )
+    warp_index, out_profile = reproject.build_warp_index(wrf_profile)
+    results["apply_warp_index"] = measure(
+        lambda: reproject.apply_warp_index(
+            np.flipud(degree_days[0]), warp_index, out_profile["nodata"]
+        ),
+        repeat,
+    )
+    for fp in reprojected_dir.glob("benchmark_*.tif"):
+        fp.unlink()
+
+    # the end-to-end per-file path, which also writes the GeoTIFFs the climatologies read
+    per_file = [
+        measure(lambda: run.process_file(*input_file, metrics), repeat)
+        for input_file in input_files
+    ]
+    results["end_to_end_per_file"] = {
+        "wall_time_s": round(float(np.mean([r["wall_time_s"] for r in per_file])), 4),
+        "peak_traced_mb": max(r["peak_traced_mb"] for r in per_file),
+    }
+
+    results["climos"] = measure(
+        lambda: compute_climos.write_streamed_climos(
+            compute_climos.stream_climo_accumulators(years[0], years[-1]),
+            years[0],
+            years[-1],
+        ),
+        repeat,
+    )
+    return results
+
+
+def git_commit():
+    """Get the current git commit hash, or None if this is not a git checkout."""
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def append_history(history_fp, record):
+    """Append a benchmark record to the JSON history file and return the previous record, if any."""
+    history = []
+    if history_fp.exists():
+        with open(history_fp) as f:
+            history = json.load(f)
+    previous = history[-1] if history else None
+    history.append(record)
+    with open(history_fp, "w") as f:
+        json.dump(history, f, indent=2)
+    return previous
+
+
+def print_results(results, previous=None):
+    """Print a table of results, with the wall time ratio against the previous run if there is one."""
+    print(
+        f"{'stage':<33} {'wall (s)':>9} {'peak traced (MB)':>17} {'RSS above baseline (MB)':>24} {'vs previous':>12}"
+    )
+    for stage, r in results.items():
+        ratio = ""
+        if previous is not None and stage in previous["results"]:
+            prev_time = previous["results"][stage]["wall_time_s"]
+            if prev_time > 0:
+                ratio = f"{r['wall_time_s'] / prev_time:.2f}x"
+        rss = r.get("peak_rss_above_baseline_mb")
+        rss = "" if rss is None else f"{rss:.1f}"
+        print(
+            f"{stage:<33} {r['wall_time_s']:>9.3f} {r['peak_traced_mb']:>17.1f} {rss:>24} {ratio:>12}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--years",
+        type=int,
+        default=2,
+        help="number of synthetic years per source (default: 2)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="runs per stage, the best time is kept"
+    )
+    parser.add_argument(
+        "--history",
+        type=Path,
+        default=Path("benchmark_history.json"),
+        help="JSON file the results are appended to (default: ./benchmark_history.json)",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["DATA_DIR"] = str(Path(tmp_dir) / "data")
+        os.environ["OUTPUT_DIR"] = str(Path(tmp_dir) / "output")
+
+        tic = time.perf_counter()
+        input_files = make_synthetic_data(
+            Path(os.environ["DATA_DIR"]), list(range(2000, 2000 + args.years))
+        )
+        print(f"{len(input_files)} synthetic files written in {time.perf_counter() - tic:.1f}s")
+
+        results = run_suite(input_files, args.repeat)
+
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "xarray": xr.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "n_files": len(input_files),
+        "repeat": args.repeat,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "results": results,
+    }
+    previous = append_history(args.history, record)
+    print_results(results, previous)
+    print(f"peak RSS of the whole run: {record['peak_rss_mb']:.1f} MB")
@@ -1,14 +1,30 @@
-"""Compute climatologies for a historical reference period by averaging over all years in the period. This module will leverage Dask and Dask Arrays to handle the reading of the 30 years of GeoTIFF data per degree day metric per model and scenario. The climatologies will be written to disk as GeoTIFFs in the climo_dir directory and eventually be used to compute deltas."""
+"""Compute climatologies for a historical reference period by averaging over all years in the period. By default the reprojected GeoTIFFs are streamed once and a running sum and valid count are kept for every model, scenario, and degree day metric, so only one raster per group is held in memory. The original Dask implementation, which stacks the 30 years of GeoTIFF data per group, is still available with the `--dask` flag. The climatologies will be written to disk as GeoTIFFs in the climo_dir directory and eventually be used to compute deltas."""
+
+import argparse
+import json
+from functools import lru_cache
 
 from dask.distributed import LocalCluster, Client
 import dask.array as da
+import numpy as np
 import rasterio as rio
 
 from config import models, scenarios, metrics, climo_dir, reprojected_dir
+from config import cumsum_dir, model_years, daymet_years
+import array_store
+from reproject import (
+    parse_reprojected_filename,
+    make_reprojected_filename,
+    serialize_profile,
+    deserialize_profile,
+)
 
 climo_start_year = 1981
 climo_end_year = 2010
 
+# percentiles of the multi-model ensemble written alongside the mean, min, max, and median
+ensemble_percentiles = [10, 90]
+
 # we know from the EDA that this model is missing data
 try:
     models.remove("HadGEM2-ES")
@@ -30,8 +46,9 @@ def create_climo_file_groups():
                 files = [
                     f
                     for f in files
-                    if int(f.stem.split("_")[-1]) >= climo_start_year
-                    and int(f.stem.split("_")[-1]) <= climo_end_year
+                    if climo_start_year
+                    <= parse_reprojected_filename(f)[3]
+                    <= climo_end_year
                 ]
                 file_groups[(model, scenario, metric)] = files
     return file_groups
@@ -73,8 +90,7 @@ def compute_and_write_daymet_climo():
         files = [
             f
             for f in files
-            if int(f.stem.split("_")[-1]) >= climo_start_year
-            and int(f.stem.split("_")[-1]) <= climo_end_year
+            if climo_start_year <= parse_reprojected_filename(f)[3] <= climo_end_year
         ]
         arrays = [da.from_array(rio.open(f).read(1), chunks=(224, 317)) for f in files]
         assert len(arrays) == climo_end_year - climo_start_year + 1
@@ -99,45 +115,397 @@ def compute_and_write_daymet_climo():
                 dst.write(climo.compute(), 1)
 
 
-def compute_model_minus_daymet_deltas():
-    # need to loop through metrics here
+def add_to_accumulators(accumulators, group_key, year, arr, profile):
+    """Add one year of a group to the running sum and valid (not nodata) count of `stream_climo_accumulators`."""
+    group = accumulators.get(group_key)
+    if group is None:
+        group = {
+            "sum": np.zeros(arr.shape, dtype=np.int64),
+            "count": np.zeros(arr.shape, dtype=np.int64),
+            "years": [],
+            "profile": profile,
+        }
+        accumulators[group_key] = group
 
-    for metric in metrics:
+    valid = arr != group["profile"]["nodata"]
+    # degree days are rounded to whole numbers, so the int64 sum is exact
+    group["sum"][valid] += arr[valid].astype(np.int64)
+    group["count"] += valid
+    group["years"].append(year)
+
+
+def stream_climo_accumulators(start_year=climo_start_year, end_year=climo_end_year):
+    """Walk the annual grids once and accumulate a running sum and valid (not nodata) count for every climatology group. Groups with an intermediate array store are read from zero-copy slices of the store, the others from the reprojected GeoTIFFs.
+
+    Args:
+        start_year (int): first year of the climatology period
+        end_year (int): last year of the climatology period
+
+    Returns:
+        accumulators (dict): keyed by (model, scenario, metric), Daymet groups use ("daymet", "historical", metric). Each value is a dict with the int64 "sum" and "count" arrays, the list of "years" accumulated, and the raster "profile" of the first file in the group.
+    """
+    accumulators = {}
+    climo_years = range(start_year, end_year + 1)
+
+    store_groups = set(array_store.list_stores())
+    for model, scenario, metric in store_groups:
+        if model != "daymet" and model not in models:
+            continue
+        if metric not in metrics:
+            continue
+        stack, store_meta = array_store.open_store(model, scenario, metric)
+        array_store.check_written_years(store_meta, climo_years, (model, scenario, metric))
+        profile = deserialize_profile(store_meta["profile"])
+        for year in climo_years:
+            arr = stack[store_meta["years"].index(year)]
+            add_to_accumulators(accumulators, (model, scenario, metric), year, arr, profile)
+
+    for fp in reprojected_dir.glob("*.tif"):
+        model, scenario, metric, year = parse_reprojected_filename(fp)
+        if model != "daymet" and model not in models:
+            continue
+        if metric not in metrics or not start_year <= year <= end_year:
+            continue
+        # GeoTIFFs published from a store would be counted twice
+        if (model, scenario, metric) in store_groups:
+            continue
+
+        with rio.open(fp) as src:
+            arr = src.read(1)
+            profile = src.profile.copy()
+        add_to_accumulators(accumulators, (model, scenario, metric), year, arr, profile)
 
-        climo_files = list(climo_dir.glob(f"*{metric}*.tif"))
-        daymet_climo_file = list(climo_dir.glob(f"*daymet*{metric}*.tif"))[0]
-        print(daymet_climo_file.name)
+    return accumulators
 
-        # for each model climo file, subtract the daymet climo file with Dask
-        daymet_climo_arr = da.from_array(
-            rio.open(daymet_climo_file).read(1), chunks=(224, 317)
+
+def write_streamed_climos(accumulators, start_year=climo_start_year, end_year=climo_end_year):
+    """Write the climatologies accumulated by `stream_climo_accumulators` to disk.
+
+    Args:
+        accumulators (dict): output of `stream_climo_accumulators`
+        start_year (int): first year of the climatology period
+        end_year (int): last year of the climatology period
+
+    Returns:
+        None
+    """
+    for (model, scenario, metric), group in accumulators.items():
+        assert sorted(group["years"]) == list(range(start_year, end_year + 1))
+
+        nodata = group["profile"]["nodata"]
+        has_data = group["count"] > 0
+        climo = np.full(group["sum"].shape, nodata, dtype=np.int32)
+        # mean makes decimal noise, precision should be 0 for degree day metrics
+        climo[has_data] = (group["sum"][has_data] / group["count"][has_data]).astype(
+            np.int32
         )
-        for model_climo in climo_files:
-            print(model_climo.name)
-            model_climo_arr = da.from_array(
-                rio.open(model_climo).read(1), chunks=(224, 317)
+
+        out_file = (
+            climo_dir / f"{model}_{scenario}_{metric}_{start_year}_{end_year}_climo.tif"
+        )
+        profile = group["profile"]
+        profile.update(
+            dtype="int32",
+            compress="deflate",
+        )
+        with rio.open(out_file, "w", **profile) as dst:
+            dst.write(climo, 1)
+
+
+def cumsum_cube_paths(model, scenario, metric):
+    """Get the paths of the cumulative sum cube, the cumulative valid count cube, and the JSON sidecar for a group.
+
+    Args:
+        model (str): model name or "daymet"
+        scenario (str): scenario name or "historical" for Daymet
+        metric (str): degree day metric
+
+    Returns:
+        tuple: (cumsum_fp, cumcount_fp, meta_fp)
+    """
+    stem = f"{model}_{scenario}_{metric}"
+    return (
+        cumsum_dir / f"{stem}_cumsum.npy",
+        cumsum_dir / f"{stem}_cumcount.npy",
+        cumsum_dir / f"{stem}_cumsum.json",
+    )
+
+
+def build_cumsum_cube(model, scenario, metric):
+    """Build and persist the cumulative sum cube for a model, scenario, and metric. Annual grids are read from the intermediate array store if the group has one, otherwise from the reprojected GeoTIFFs.
+
+    Every year must have been written, a ValueError is raised for a store with unwritten years and a missing GeoTIFF fails to open. The cubes have shape (n_years + 1, height, width). Index 0 is all zeros and index i holds the sum (or count of valid, not nodata, values) over the first i years, so the total for any window of years is the difference of two slices. Sums are stored as int32 (150 years of degree days is well within range) and counts as int16.
+
+    Args:
+        model (str): model name or "daymet"
+        scenario (str): scenario name or "historical" for Daymet
+        metric (str): degree day metric
+
+    Returns:
+        None
+    """
+    years = daymet_years if model == "daymet" else model_years
+    cumsum_fp, cumcount_fp, meta_fp = cumsum_cube_paths(model, scenario, metric)
+
+    if array_store.store_paths(model, scenario, metric)[1].exists():
+        stack, store_meta = array_store.open_store(model, scenario, metric)
+        assert store_meta["years"] == years
+        # unwritten years hold nodata, raise like a missing GeoTIFF instead of averaging them out
+        array_store.check_written_years(store_meta, years, (model, scenario, metric))
+        profile = deserialize_profile(store_meta["profile"])
+    else:
+        stack = None
+
+    for i, year in enumerate(years):
+        if stack is not None:
+            arr = stack[i]
+        else:
+            fp = reprojected_dir / make_reprojected_filename(
+                f"{model}_{scenario}_{metric}_{year}.tif", "ncar_12km"
             )
-            delta = model_climo_arr - daymet_climo_arr
-            out_file = climo_dir / f"{model_climo.stem}_minus_daymet_delta.tif"
-            with rio.open(model_climo) as src:
+            with rio.open(fp) as src:
+                arr = src.read(1)
                 profile = src.profile.copy()
-                profile.update(
-                    dtype="int32",
-                    nodata=0,
-                    compress="deflate",
-                )
-                with rio.open(out_file, "w", **profile) as dst:
-                    dst.write(delta.compute(), 1)
+
+        if i == 0:
+            shape = (len(years) + 1, *arr.shape)
+            cumsum = np.lib.format.open_memmap(
+                cumsum_fp, mode="w+", dtype=np.int32, shape=shape
+            )
+            cumcount = np.lib.format.open_memmap(
+                cumcount_fp, mode="w+", dtype=np.int16, shape=shape
+            )
+            cumsum[0] = 0
+            cumcount[0] = 0
+
+        valid = arr != profile["nodata"]
+        cumsum[i + 1] = cumsum[i] + np.where(valid, arr, 0).astype(np.int32)
+        cumcount[i + 1] = cumcount[i] + valid
+
+    cumsum.flush()
+    cumcount.flush()
+    with open(meta_fp, "w") as f:
+        json.dump(
+            {"years": years, "written_years": years, "profile": serialize_profile(profile)},
+            f,
+        )
+    # drop the cubes and metadata loaded before the rebuild
+    load_cumsum_cube.cache_clear()
+
+
+def build_all_cumsum_cubes(overwrite=False):
+    """Build the cumulative sum cubes for every model, scenario, and metric, plus Daymet.
+
+    Args:
+        overwrite (bool): rebuild cubes that already exist
+
+    Returns:
+        None
+    """
+    groups = [("daymet", "historical", metric) for metric in metrics]
+    groups += [
+        (model, scenario, metric)
+        for model in models
+        for scenario in scenarios
+        for metric in metrics
+    ]
+    for group in groups:
+        if overwrite or not cumsum_cube_paths(*group)[2].exists():
+            build_cumsum_cube(*group)
+
+
+@lru_cache(maxsize=None)
+def load_cumsum_cube(model, scenario, metric):
+    """Memory map the cumulative sum cubes for a group and load the sidecar metadata.
+
+    Returns:
+        tuple: (cumsum, cumcount, meta) where the cubes are read-only memory mapped arrays
+    """
+    cumsum_fp, cumcount_fp, meta_fp = cumsum_cube_paths(model, scenario, metric)
+    with open(meta_fp) as f:
+        meta = json.load(f)
+    return (
+        np.load(cumsum_fp, mmap_mode="r"),
+        np.load(cumcount_fp, mmap_mode="r"),
+        meta,
+    )
+
+
+def climo_profile(model, scenario, metric):
+    """Get the raster profile for climatologies of a group, as used for the source GeoTIFFs."""
+    return deserialize_profile(load_cumsum_cube(model, scenario, metric)[2]["profile"])
+
+
+def climo(model, scenario, metric, start_year, end_year):
+    """Compute a climatology for any window of years from the cumulative sum cube, reading only two slices.
+
+    Args:
+        model (str): model name or "daymet"
+        scenario (str): scenario name or "historical" for Daymet
+        metric (str): degree day metric
+        start_year (int): first year of the climatology period
+        end_year (int): last year of the climatology period (inclusive)
+
+    Returns:
+        climo (numpy.ndarray): int32 mean over valid years, nodata where no year has data
+    """
+    cumsum, cumcount, meta = load_cumsum_cube(model, scenario, metric)
+    first_year, last_year = meta["years"][0], meta["years"][-1]
+    if not first_year <= start_year <= end_year <= last_year:
+        raise ValueError(
+            f"{start_year}-{end_year} is not within {first_year}-{last_year} for {model} {scenario} {metric}"
+        )
+    # cubes record the years they were built from, cubes written without `written_years` must be rebuilt
+    written_years = set(meta.get("written_years", []))
+    missing = [year for year in range(start_year, end_year + 1) if year not in written_years]
+    if missing:
+        raise ValueError(
+            f"the {model} {scenario} {metric} cumulative sum cube has no data for {len(missing)} years of {start_year}-{end_year}: {missing}, rebuild it with `build_cumsum_cube`"
+        )
+    start_idx = start_year - first_year
+    end_idx = end_year - first_year + 1
+
+    total = cumsum[end_idx].astype(np.int64) - cumsum[start_idx]
+    count = cumcount[end_idx].astype(np.int64) - cumcount[start_idx]
+
+    climo = np.full(total.shape, meta["profile"]["nodata"], dtype=np.int32)
+    has_data = count > 0
+    # mean makes decimal noise, precision should be 0 for degree day metrics
+    climo[has_data] = (total[has_data] / count[has_data]).astype(np.int32)
+    return climo
+
+
+def compute_ensemble_stats(stack, valid, percentiles=ensemble_percentiles):
+    """Compute ensemble statistics over the first (model) axis of a stack of rasters in a single vectorized pass.
+
+    Args:
+        stack (numpy.ndarray): (n_models, height, width) array
+        valid (numpy.ndarray): boolean array of the same shape, False where a model has no data
+        percentiles (list): percentiles to compute in addition to the mean, min, max, and median
+
+    Returns:
+        stats (dict): float64 (height, width) arrays keyed by statistic name (e.g. "mean", "p10"), `np.nan` where no model has data
+    """
+    has_data = valid.any(axis=0)
+    # only pixels with data are reduced, which avoids all-NaN slice warnings
+    values = np.where(valid[:, has_data], stack[:, has_data], np.nan)
+
+    reduced = {
+        "mean": np.nanmean(values, axis=0),
+        "min": np.nanmin(values, axis=0),
+        "max": np.nanmax(values, axis=0),
+        "median": np.nanmedian(values, axis=0),
+    }
+    if percentiles:
+        for p, arr in zip(percentiles, np.nanpercentile(values, percentiles, axis=0)):
+            reduced[f"p{p}"] = arr
+
+    stats = {}
+    for name, arr in reduced.items():
+        stats[name] = np.full(has_data.shape, np.nan)
+        stats[name][has_data] = arr
+    return stats
+
+
+def compute_ensemble_deltas(
+    metric,
+    scenario,
+    start_year=climo_start_year,
+    end_year=climo_end_year,
+    percentiles=ensemble_percentiles,
+):
+    """Compute and write per-model deltas and multi-model ensemble statistics for a metric and scenario.
+
+    All model climatologies are loaded into a single (n_models, height, width) array and the Daymet climatology is read once. Per-model deltas are written exactly as before, and the ensemble mean, min, max, median, and percentiles of both the climatologies and the deltas are written as e.g. `ensemble_mean_rcp85_air_thawing_index_1981_2010_climo.tif` and `ensemble_mean_rcp85_air_thawing_index_1981_2010_climo_minus_daymet_delta.tif`.
+
+    Args:
+        metric (str): degree day metric
+        scenario (str): scenario name
+        start_year (int): first year of the climatology period
+        end_year (int): last year of the climatology period
+        percentiles (list): ensemble percentiles to write
+
+    Returns:
+        None
+    """
+    daymet_climo = climo("daymet", "historical", metric, start_year, end_year)
+    model_climos = np.stack(
+        [climo(model, scenario, metric, start_year, end_year) for model in models]
+    )
+    deltas = model_climos - daymet_climo
+
+    profile = climo_profile("daymet", "historical", metric)
+    nodata = profile["nodata"]
+    profile.update(
+        dtype="int32",
+        compress="deflate",
+    )
+
+    # per-model deltas, nodata is 0 because the difference of two nodata values is 0
+    for model, delta in zip(models, deltas):
+        out_file = (
+            climo_dir
+            / f"{model}_{scenario}_{metric}_{start_year}_{end_year}_climo_minus_daymet_delta.tif"
+        )
+        with rio.open(out_file, "w", **{**profile, "nodata": 0}) as dst:
+            dst.write(delta, 1)
+
+    model_valid = model_climos != nodata
+    for suffix, stack, valid in [
+        ("climo", model_climos, model_valid),
+        ("climo_minus_daymet_delta", deltas, model_valid & (daymet_climo != nodata)),
+    ]:
+        stats = compute_ensemble_stats(stack, valid, percentiles)
+        for stat, arr in stats.items():
+            # precision should be 0 for degree day metrics
+            out_arr = np.where(np.isnan(arr), nodata, np.round(arr)).astype(np.int32)
+            out_file = (
+                climo_dir
+                / f"ensemble_{stat}_{scenario}_{metric}_{start_year}_{end_year}_{suffix}.tif"
+            )
+            with rio.open(out_file, "w", **profile) as dst:
+                dst.write(out_arr, 1)
+
+
+def compute_model_minus_daymet_deltas(
+    start_year=climo_start_year, end_year=climo_end_year
+):
+    """Compute and write the difference between each model climatology and the Daymet climatology for the same period, along with the multi-model ensemble statistics (see `compute_ensemble_deltas`).
+
+    Args:
+        start_year (int): first year of the climatology period
+        end_year (int): last year of the climatology period
+
+    Returns:
+        None
+    """
+    for metric in metrics:
+        for scenario in scenarios:
+            compute_ensemble_deltas(metric, scenario, start_year, end_year)
 
 
 if __name__ == "__main__":
-    cluster = LocalCluster()
-    client = Client(cluster)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--dask",
+        action="store_true",
+        help="use the original LocalCluster implementation instead of streaming",
+    )
+    args = parser.parse_args()
+
+    if args.dask:
+        cluster = LocalCluster()
+        client = Client(cluster)
+
+        file_groups = create_climo_file_groups()
+        compute_and_write_climos(file_groups)
+        compute_and_write_daymet_climo()
+    else:
+        write_streamed_climos(stream_climo_accumulators())
 
-    file_groups = create_climo_file_groups()
-    compute_and_write_climos(file_groups)
-    compute_and_write_daymet_climo()
+    build_all_cumsum_cubes()
     compute_model_minus_daymet_deltas()
 
-    client.close()
-    cluster.close()
+    if args.dask:
+        client.close()
+        cluster.close()
@@ -5,6 +5,15 @@ import xarray as xr
 from dask import delayed
 
 from config import metrics
+import instrument
+
+# degree day threshold (F) and whether to count degree days below it, for each metric
+metric_thresholds = {
+    "air_freezing_index": (32, True),
+    "air_thawing_index": (32, False),
+    "heating_degree_days": (65, True),
+    "degree_days_below_zero": (0, True),
+}
 
 
 @delayed
@@ -75,3 +84,54 @@ def compute_cumulative_degree_days_below_0F(temp_ds):
 def compute_cumulative_thawing_index(temp_ds):
     air_thawing_index = summarize_year_dd(temp_ds, 32, False)
     return air_thawing_index
+
+
+@instrument.traced()
+def compute_all_metrics(temp_ds, days_per_block=32):
+    """Compute every degree day metric for a year in a single pass over the daily data.
+
+    This computes the same thing as calling `summarize_year_dd` once per metric, but the daily `tavg_F` cube is only read once. Days are visited in blocks and each block is used to update the running sums for all metrics before moving on to the next block. Sums are accumulated in float64, so a handful of pixels that land right on a .5 boundary can round differently (by 1) than the float32 `np.nansum` used by `summarize_year_dd`.
+
+    Parameters
+    ----------
+    temp_ds : xarray.Dataset
+        The dataset containing the daily average temperature.
+    days_per_block : int
+        The number of days to process at a time. Larger blocks mean fewer numpy calls but larger temporary arrays.
+
+    Returns
+    -------
+    degree_days : numpy.ndarray
+        A float32 array of shape (len(metrics), y, x) with the rounded annual degree days for each metric, stacked in the order of `config.metrics`. Pixels without any valid daily data are set to -9999.
+    all_nan_mask : numpy.ndarray
+        A boolean array of shape (y, x) that is True where every daily value was `np.nan`.
+    """
+    # slicing the underlying array means a Dask-backed `tavg_F` is only loaded one block at a time
+    tavg_F = temp_ds.tavg_F.data
+    n_days, ny, nx = tavg_F.shape
+
+    # accumulate in float64 to avoid float32 round-off in the annual totals
+    sums = np.zeros((len(metrics), ny, nx), dtype=np.float64)
+    valid_day_count = np.zeros((ny, nx), dtype=np.int32)
+    delta = np.empty((min(days_per_block, n_days), ny, nx), dtype=tavg_F.dtype)
+
+    for start in range(0, n_days, days_per_block):
+        block = np.asarray(tavg_F[start : start + days_per_block])
+        block_delta = delta[: block.shape[0]]
+        valid_day_count += np.count_nonzero(~np.isnan(block), axis=0)
+
+        for i, metric in enumerate(metrics):
+            threshold, count_days_below_threshold = metric_thresholds[metric]
+            if count_days_below_threshold:
+                np.subtract(threshold, block, out=block_delta)
+            else:
+                np.subtract(block, threshold, out=block_delta)
+            # fmax replaces negative values and `np.nan` with 0, same as the where + nansum in `summarize_year_dd`
+            np.fmax(block_delta, 0, out=block_delta)
+            sums[i] += block_delta.sum(axis=0, dtype=np.float64)
+
+    all_nan_mask = valid_day_count == 0
+    degree_days = np.round(sums).astype(np.float32)
+    degree_days[:, all_nan_mask] = -9999
+
+    return degree_days, all_nan_mask
@@ -1,7 +1,11 @@
 """Configuration for executing the degree day metric computations. Mostly directory configurations with some sane Atlas defaults. Also where output filenames are tweaked."""
 import os
+import sys
 from pathlib import Path
 
+# make the shared grid registry (grids.py at the repository root) importable
+sys.path.append(str(Path(__file__).parent.parent))
+
 # path to directory containing source input data
 DATA_DIR = Path(os.getenv("DATA_DIR") or "/atlas_scratch/Base_Data/AK_NCAR_12km/met")
 
@@ -32,6 +36,18 @@ aux_dir.mkdir(exist_ok=True)
 climo_dir = OUTPUT_DIR.joinpath("climatologies")
 climo_dir.mkdir(exist_ok=True)
 
+# for the memory-mapped intermediate array store (annual grids, one stack per model/scenario/metric)
+store_dir = OUTPUT_DIR.joinpath("intermediate_store")
+store_dir.mkdir(exist_ok=True)
+
+# for cumulative sum year cubes used to compute climatologies for any window of years
+cumsum_dir = OUTPUT_DIR.joinpath("cumulative_sums")
+cumsum_dir.mkdir(exist_ok=True)
+
+# for the chunked per-metric cubes (NetCDF or Zarr) of all annual grids
+cube_dir = OUTPUT_DIR.joinpath("cubes")
+cube_dir.mkdir(exist_ok=True)
+
 
 # for the zipped goods. zippy longstocking
 zip_dir = OUTPUT_DIR.joinpath("zipped")
@@ -51,6 +67,10 @@ models = [
     "MRI-CGCM3",
 ]
 
+# years covered by the model projections and the Daymet baseline
+model_years = list(range(1950, 2100))
+daymet_years = list(range(1980, 2018))
+
 # metrics to process, strings will be used in output file names
 metrics = [
     "air_freezing_index",
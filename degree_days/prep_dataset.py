@@ -3,9 +3,14 @@
 
 import xarray as xr
 import numpy as np
-import rasterio as rio
-from pyproj import Proj, Transformer, CRS
-from wrf import PolarStereographic
+
+# config puts the repository root on sys.path for the shared grid registry and instrumentation
+import config
+import grids
+import instrument
+
+# number of days read at once by the eager lean loading mode
+lean_read_days = 32
 
 
 def project_datacube(datacube):
@@ -25,58 +30,22 @@ def project_datacube(datacube):
         A dictionary containing parameters for the output raster such as the transform and the
         dimensions of the raster. This will be used to write summarized slices of the projected datacube to a GeoTIFF file.
     """
-    wrf_proj_str = PolarStereographic(**{"TRUELAT1": 64, "STAND_LON": -150}).proj4()
-    wrf_proj = Proj(wrf_proj_str)
-    wgs_proj = Proj(proj="latlong", datum="WGS84")
-
-    transformer = Transformer.from_proj(wgs_proj, wrf_proj)
-    e, n = transformer.transform(-150, 64)
-    # Grid parameters
-    dx, dy = 12000, 12000
-
     try:
         ny, nx = datacube.longitude.shape[1:]
     except:
         ny, nx = datacube.longitude.shape  # met case has a little different structure
 
-    # Down left corner of the domain
-    x0 = -(nx - 1) / 2.0 * dx + e
-    y0 = -(ny - 1) / 2.0 * dy + n
-    # 2d grid
-    x = np.arange(nx) * dx + x0
-    y = np.arange(ny) * dy + y0
-
-    projected_datacube = datacube.assign_coords({"y": ("y", y), "x": ("x", x)})
-
-    # Output geotiff creation profile params
-    width = datacube.x.shape[0]
-    height = datacube.y.shape[0]
-
-    # west and north
-    west = x0 - dx / 2
-    north = y[-1] + dy / 2
-    out_transform = rio.transform.from_origin(west, north, dx, dy)
-
-    wrf_raster_profile = {
-        "driver": "GTiff",
-        "crs": CRS.from_proj4(wrf_proj_str),
-        "transform": out_transform,
-        "width": width,
-        "height": height,
-        "count": 1,
-        "dtype": np.float32,
-        "nodata": -9999,
-        "tiled": False,
-        "compress": "lzw",
-        "interleave": "band",
-    }
+    grid = grids.wrf_grid(ny, nx)
+    projected_datacube = datacube.assign_coords({"y": ("y", grid["y"]), "x": ("x", grid["x"])})
+    wrf_raster_profile = grids.wrf_raster_profile(ny, nx)
 
     datacube.close()
 
     return projected_datacube, wrf_raster_profile
 
 
-def prep_ds(fp):
+@instrument.traced()
+def prep_ds(fp, lean=False, time_chunk=None):
     """
     Prepares the input dataset for the WRF model by projecting the data to a polar stereographic grid and calculating the daily average temperature in Fahrenheit.
 
@@ -84,6 +53,10 @@ def prep_ds(fp):
     ----------
     fp : str
         The file path to the input dataset.
+    lean : bool
+        Use the memory-lean loading mode, see `prep_ds_lean`.
+    time_chunk : int
+        Only used with `lean`. Number of days per Dask chunk, or None to load the data eagerly.
 
     Returns
     -------
@@ -92,6 +65,9 @@ def prep_ds(fp):
     out_profile : dict
         A dictionary containing parameters for the output raster such as the transform and the dimensions of the raster. This will be used to write summarized slices (i.e. annual degree day measures) of the projected datacube to a GeoTIFF.
     """
+    if lean:
+        return prep_ds_lean(fp, time_chunk)
+
     with xr.open_dataset(fp) as ds:
 
         ds["tavg"] = (ds["tmin"] + ds["tmax"]) / 2
@@ -100,3 +76,60 @@ def prep_ds(fp):
         proj_ds, out_profile = project_datacube(ds)
 
     return proj_ds, out_profile
+
+
+def prep_ds_lean(fp, time_chunk=None):
+    """
+    Memory-lean version of `prep_ds`. Only `tmin` and `tmax` are read (never `pcp`), and `tavg_F` is computed in float32 with in-place operations. `tmin` and `tmax` are read `lean_read_days` days at a time into the output cube, so the peak is one float32 cube plus a few slabs. The default mode holds the full `tmin` and `tmax` cubes, and netCDF4 reads each whole variable through a second full size buffer, on top of the `tavg` and `tavg_F` temporaries. With `time_chunk` the data are opened as Dask arrays chunked along time and nothing is read until the caller pulls a slice of `tavg_F`, which lets `compute_degree_days.compute_all_metrics` stream through the year.
+
+    Note that (tmin + tmax) / 2 * 9 / 5 is computed as (tmin + tmax) * 0.9 in float32, so values can differ from `prep_ds` in the last bit.
+
+    Parameters
+    ----------
+    fp : str
+        The file path to the input dataset.
+    time_chunk : int
+        Number of days per Dask chunk, or None to load the data eagerly.
+
+    Returns
+    -------
+    proj_ds : xarray.Dataset
+        The projected dataset with the daily average temperature in Fahrenheit.
+    out_profile : dict
+        See `prep_ds`.
+    """
+    keep_vars = ["tmin", "tmax", "latitude", "longitude"]
+
+    if time_chunk is not None:
+        # the file stays open until the lazy `tavg_F` is consumed
+        ds = xr.open_dataset(fp, chunks={"time": time_chunk})
+        ds = ds.drop_vars([v for v in ds.data_vars if v not in keep_vars])
+        ds["tavg_F"] = (ds["tmin"] + ds["tmax"]).astype(np.float32) * np.float32(
+            0.9
+        ) + np.float32(32)
+        ds = ds.drop_vars(["tmin", "tmax"])
+        return project_datacube(ds)
+
+    with xr.open_dataset(fp) as ds:
+        ds = ds.drop_vars([v for v in ds.data_vars if v not in keep_vars])
+        dims = ds["tmin"].dims
+
+        # reading a whole variable goes through a second full size buffer in netCDF4,
+        # so read slabs of days straight into the output cube instead
+        tavg_F = np.empty(ds["tmin"].shape, dtype=np.float32)
+        for start in range(0, tavg_F.shape[0], lean_read_days):
+            days = slice(start, start + lean_read_days)
+            np.add(
+                ds["tmin"][days].values,
+                ds["tmax"][days].values,
+                out=tavg_F[days],
+                casting="unsafe",
+            )
+        tavg_F *= np.float32(0.9)
+        tavg_F += np.float32(32)
+
+        ds = ds.drop_vars(["tmin", "tmax"])
+        ds["tavg_F"] = (dims, tavg_F)
+        proj_ds, out_profile = project_datacube(ds)
+
+    return proj_ds, out_profile
@@ -1,5 +1,6 @@
 """Module for raster I/O and reprojection tasks."""
 
+import numpy as np
 import rasterio as rio
 from rasterio.warp import (
     Resampling,
@@ -7,41 +8,91 @@ from rasterio.warp import (
 )
 from rasterio.transform import array_bounds
 from config import reprojected_dir, unit_tag
+from grids import grids
+import instrument
 
-# hard coding some experimentally derived output dimensions
+# experimentally derived output dimensions from the shared grid registry,
 # based on results of `gdalwarp -tap -tr 12000 12000`
-dst_crs = rio.crs.CRS.from_epsg(3338)
-tr = 12000
-t_width = 317
-t_height = 224
+dst_crs = rio.crs.CRS.from_string(grids["epsg3338_12km"]["crs"])
+tr = grids["epsg3338_12km"]["resolution"]
+t_height, t_width = grids["epsg3338_12km"]["shape"]
+
+
+def make_target_profile(src_profile):
+    """Derive the EPSG:3338 output raster profile from a source (WRF grid) raster profile.
+
+    Args:
+        src_profile (dict): raster profile of the source raster, must include crs, transform, width, and height.
+
+    Returns:
+        out_profile (dict): raster profile for the target aligned EPSG:3338 grid
+    """
+    src_bounds = array_bounds(
+        src_profile["height"], src_profile["width"], src_profile["transform"]
+    )
+    # compute the new affine transformation, width and height
+    warp_transform, width, height = rio.warp.calculate_default_transform(
+        src_profile["crs"],
+        dst_crs,
+        src_profile["width"],
+        src_profile["height"],
+        *src_bounds,
+        resolution=(tr, tr),
+    )
+    tap_transform, tap_width, tap_height = aligned_target(
+        warp_transform, t_width - 1, t_height - 1, tr
+    )  # the -1 might just be an indexing thing
+    # but without the offset, the output height and width are too large (by 1) when compared to what is created by gdalwarp -tap
+
+    # define the output raster profile
+    out_profile = src_profile.copy()
+    out_profile.update(
+        {
+            "crs": dst_crs,
+            "transform": tap_transform,
+            "width": t_width,
+            "height": t_height,
+            "bounds": array_bounds(tap_height, tap_width, tap_transform),
+        }
+    )
+    return out_profile
+
+
+def make_reprojected_filename(src_name, name_prefix):
+    """Construct the name of a reprojected GeoTIFF from the name of its source GeoTIFF.
+
+    Args:
+        src_name (str): name of the source GeoTIFF, e.g. CCSM4_rcp45_air_freezing_index_2065.tif
+        name_prefix (str): prefix for the output file name, e.g. ncar_12km
+
+    Returns:
+        str: the reprojected file name, e.g. ncar_12km_CCSM4_rcp45_air_freezing_index_2065_Fdays.tif
+    """
+    return f"{name_prefix}_{src_name[:-4]}_{unit_tag}.tif"
+
+
+def parse_reprojected_filename(fp, name_prefix="ncar_12km"):
+    """Parse the model, scenario, metric, and year from a reprojected GeoTIFF file name.
+
+    Args:
+        fp (pathlib.Path): reprojected GeoTIFF, e.g. ncar_12km_CCSM4_rcp45_air_freezing_index_2065_Fdays.tif
+        name_prefix (str): prefix used when the file was created
+
+    Returns:
+        tuple: (model, scenario, metric, year), e.g. ("CCSM4", "rcp45", "air_freezing_index", 2065). Daymet files are parsed as ("daymet", "historical", metric, year).
+    """
+    stem = fp.name[len(name_prefix) + 1 : -len(f"_{unit_tag}.tif")]
+    model, scenario, *metric_parts, year = stem.split("_")
+    return model, scenario, "_".join(metric_parts), int(year)
 
 
 def reproject_raster(file, name_prefix):
     with rio.open(file) as src:
 
-        # compute the new affine transformation, width and height
-        warp_transform, width, height = rio.warp.calculate_default_transform(
-            src.crs, dst_crs, src.width, src.height, *src.bounds, resolution=(tr, tr)
-        )
-        tap_transform, tap_width, tap_height = aligned_target(
-            warp_transform, t_width - 1, t_height - 1, tr
-        )  # the -1 might just be an indexing thing
-        # but without the offset, the output height and width are too large (by 1) when compared to what is created by gdalwarp -tap
-
-        # define the output raster profile
-        out_profile = src.profile.copy()
-        out_profile.update(
-            {
-                "crs": dst_crs,
-                "transform": tap_transform,
-                "width": t_width,
-                "height": t_height,
-                "bounds": array_bounds(tap_height, tap_width, tap_transform),
-            }
-        )
+        out_profile = make_target_profile(src.profile)
 
         # create the new raster file
-        out_file = reprojected_dir / f"{name_prefix}_{file.name[:-4]}_{unit_tag}.tif"
+        out_file = reprojected_dir / make_reprojected_filename(file.name, name_prefix)
         with rio.open(out_file, "w", **out_profile) as dst:
             # reproject the input raster data
             rio.warp.reproject(
@@ -49,12 +100,111 @@ def reproject_raster(file, name_prefix):
                 destination=rio.band(dst, 1),
                 src_transform=src.transform,
                 src_crs=src.crs,
-                dst_transform=tap_transform,
+                dst_transform=out_profile["transform"],
                 dst_crs=dst_crs,
                 resampling=Resampling.nearest,  # NN is default, but explicit here for easy change or experimentation later
             )
 
 
+def build_warp_index(src_profile):
+    """Build a nearest neighbor lookup table that maps each EPSG:3338 target pixel to a WRF grid source pixel.
+
+    The WRF grid never changes, so the warp only needs to be solved once. We warp an array of flat source pixel indices with the same call used in `reproject_raster`, from the source CRS as it reads back from a GeoTIFF, so every target pixel holds the index of the source pixel GDAL samples there and any later warp is a fancy indexing lookup.
+
+    Args:
+        src_profile (dict): raster profile of the WRF grid, e.g. as returned by `prep_dataset.project_datacube`.
+
+    Returns:
+        warp_index (numpy.ndarray): (t_height, t_width) array of flat indices into the source array, -1 where no source pixel maps to the target pixel.
+        out_profile (dict): raster profile for the target aligned EPSG:3338 grid
+    """
+    out_profile = make_target_profile(src_profile)
+
+    # a GeoTIFF does not keep the +nadgrids=@null of the WRF proj4 string, and warping from the CRS read
+    # back by `reproject_raster` selects a different source pixel for a target pixel near a tie
+    with rio.io.MemoryFile() as memfile:
+        with memfile.open(
+            driver="GTiff",
+            width=1,
+            height=1,
+            count=1,
+            dtype="uint8",
+            crs=src_profile["crs"],
+            transform=src_profile["transform"],
+        ):
+            pass
+        with memfile.open() as tmp:
+            src_crs = tmp.crs
+
+    src_shape = (src_profile["height"], src_profile["width"])
+    src_index = np.arange(np.prod(src_shape), dtype=np.int32).reshape(src_shape)
+    warp_index = np.full((t_height, t_width), -1, dtype=np.int32)
+
+    rio.warp.reproject(
+        source=src_index,
+        destination=warp_index,
+        src_transform=src_profile["transform"],
+        src_crs=src_crs,
+        src_nodata=-1,
+        dst_transform=out_profile["transform"],
+        dst_crs=dst_crs,
+        dst_nodata=-1,
+        resampling=Resampling.nearest,
+    )
+    return warp_index, out_profile
+
+
+@instrument.traced()
+def apply_warp_index(raster_data, warp_index, nodata):
+    """Reproject an array on the WRF grid to the EPSG:3338 grid with a precomputed warp index.
+
+    Args:
+        raster_data (ndarray): 2d array on the WRF grid, oriented as it would be written to disk (i.e., north up).
+        warp_index (ndarray): lookup table from `build_warp_index`.
+        nodata (float): value for target pixels with no corresponding source pixel or a source pixel that is nodata.
+
+    Returns:
+        out_data (ndarray): 2d array on the EPSG:3338 grid
+    """
+    out_data = np.full(warp_index.shape, nodata, dtype=raster_data.dtype)
+    valid = warp_index >= 0
+    out_data[valid] = raster_data.ravel()[warp_index[valid]]
+    return out_data
+
+
+def serialize_profile(raster_profile):
+    """Convert a raster profile to a JSON serializable dict, e.g. for a sidecar metadata file.
+
+    Args:
+        raster_profile (dict): raster profile parameters
+
+    Returns:
+        dict: the profile with the CRS as WKT and the transform as a list of six coefficients
+    """
+    profile = dict(raster_profile)
+    profile["crs"] = rio.crs.CRS.from_user_input(profile["crs"]).to_wkt()
+    profile["transform"] = list(profile["transform"])[:6]
+    profile["dtype"] = np.dtype(profile["dtype"]).name
+    profile.pop("bounds", None)
+    return profile
+
+
+def deserialize_profile(profile):
+    """Inverse of `serialize_profile`.
+
+    Args:
+        profile (dict): serialized raster profile
+
+    Returns:
+        dict: raster profile parameters usable with `rio.open`
+    """
+    raster_profile = dict(profile)
+    raster_profile["crs"] = rio.crs.CRS.from_wkt(profile["crs"])
+    raster_profile["transform"] = rio.Affine(*profile["transform"])
+    return raster_profile
+
+
+@instrument.traced(tag_args=("out_filename",))
 def write_raster_to_disk(out_filename, raster_profile, raster_data):
     """
     Args:
@@ -0,0 +1,321 @@
+"""Command line entry point for running the degree day pipeline in parallel.
+
+Each input netCDF file (one model, scenario, and year) is a single task. Tasks are scheduled over a Dask LocalCluster of single-threaded worker processes, and each task computes all requested degree day metrics and writes the final EPSG:3338 GeoTIFFs to `reprojected_dir` with the same file names `reproject.reproject_raster` produces. With `--store`, the grids are written to the memory-mapped intermediate store (see `array_store.py`) instead, and GeoTIFFs are only published at the end with `python array_store.py`.
+
+Example usage:
+    python -m degree_days.run --models daymet CCSM4 --scenarios rcp85 --years 2000-2009 --workers 8 --memory-limit 4GB
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# the sibling modules use flat imports (e.g., `from config import ...`)
+# so make them importable when this is run as `python -m degree_days.run`
+sys.path.insert(0, str(Path(__file__).parent))
+
+import numpy as np
+from dask.distributed import LocalCluster, Client, as_completed
+
+import prep_dataset
+import compute_degree_days
+import reproject
+import array_store
+from config import DATA_DIR, daymet_dir, reprojected_dir
+from config import models, scenarios, metrics
+import instrument
+
+# output file name prefix used for the reprojected GeoTIFFs
+name_prefix = "ncar_12km"
+
+# warp index cache, one per worker process
+_warp_cache = {}
+
+
+def parse_years(year_args):
+    """Parse year arguments like 1980 or 2000-2009 into a set of integer years.
+
+    Args:
+        year_args (list): list of year strings, single years or inclusive ranges
+
+    Returns:
+        years (set): set of integer years
+    """
+    years = set()
+    for arg in year_args:
+        if "-" in arg:
+            start, end = arg.split("-")
+            years.update(range(int(start), int(end) + 1))
+        else:
+            years.add(int(arg))
+    return years
+
+
+def get_year(src_file):
+    """Get the year from a source file name like CCSM4_rcp45_BCSD_met_2065.nc4"""
+    return int(src_file.name.split("_")[-1].split(".")[0])
+
+
+def list_input_files(selected_models, selected_scenarios, years):
+    """List the input netCDF files for the requested models, scenarios, and years.
+
+    Args:
+        selected_models (list): model names, "daymet" selects the historical baseline
+        selected_scenarios (list): scenario names, ignored for Daymet
+        years (set): years to process
+
+    Returns:
+        input_files (list): list of (src_file, model, scenario, year) tuples
+    """
+    input_files = []
+    for model in selected_models:
+        if model == "daymet":
+            for src_file in sorted(daymet_dir.glob("*.nc")):
+                year = get_year(src_file)
+                if year in years:
+                    input_files.append((src_file, "daymet", "historical", year))
+            continue
+
+        for src_file in sorted((DATA_DIR / model).rglob("*.nc*")):
+            scenario = src_file.name.split("_")[1]
+            year = get_year(src_file)
+            if scenario in selected_scenarios and year in years:
+                input_files.append((src_file, model, scenario, year))
+    return input_files
+
+
+def get_warp_index(raster_profile):
+    """Build the WRF grid to EPSG:3338 warp index once per worker process and reuse it."""
+    key = (
+        str(raster_profile["crs"]),
+        tuple(raster_profile["transform"]),
+        raster_profile["width"],
+        raster_profile["height"],
+    )
+    if key not in _warp_cache:
+        _warp_cache[key] = reproject.build_warp_index(raster_profile)
+    return _warp_cache[key]
+
+
+def create_stores(input_files, selected_metrics):
+    """Create the intermediate store for every (model, scenario, metric) group in the input files. The EPSG:3338 grid is taken from the first input file, all inputs share the WRF grid.
+
+    Args:
+        input_files (list): list of (src_file, model, scenario, year) tuples
+        selected_metrics (list): metrics to write
+
+    Returns:
+        None
+    """
+    # only the profile is needed, the lazy dataset keeps the file open until closed
+    ds, raster_creation_profile = prep_dataset.prep_ds(
+        input_files[0][0], lean=True, time_chunk=1
+    )
+    ds.close()
+    _, reprojected_profile = get_warp_index(raster_creation_profile)
+    groups = sorted({(model, scenario) for _, model, scenario, _ in input_files})
+    for model, scenario in groups:
+        for degree_day_metric in selected_metrics:
+            array_store.create_store(
+                model, scenario, degree_day_metric, reprojected_profile
+            )
+
+
+@instrument.traced(tag_args=("model", "scenario", "year"))
+def process_file(
+    src_file, model, scenario, year, selected_metrics, time_chunk=None, store=False
+):
+    """Compute degree day metrics for one input file and write the reprojected GeoTIFFs, or the reprojected grids to the intermediate store.
+
+    Args:
+        src_file (pathlib.Path): input netCDF file
+        model (str): model name or "daymet"
+        scenario (str): scenario name or "historical" for Daymet
+        year (int): year of the input file
+        selected_metrics (list): metrics to write
+        time_chunk (int): days per chunk when streaming the input file, None to load it eagerly
+        store (bool): write to the intermediate store instead of GeoTIFFs
+
+    Returns:
+        out_files (list): paths of the GeoTIFFs written, or of the store stacks written to
+    """
+    daily_avg_temp_F_ds, raster_creation_profile = prep_dataset.prep_ds(
+        src_file, lean=True, time_chunk=time_chunk
+    )
+    warp_index, reprojected_profile = get_warp_index(raster_creation_profile)
+    results, _ = compute_degree_days.compute_all_metrics(daily_avg_temp_F_ds)
+
+    out_files = []
+    for degree_day_metric, result in zip(metrics, results):
+        if degree_day_metric not in selected_metrics:
+            continue
+        reprojected_data = reproject.apply_warp_index(
+            np.flipud(result), warp_index, reprojected_profile["nodata"]
+        )
+        if store:
+            array_store.write_year(
+                model, scenario, degree_day_metric, year, reprojected_data
+            )
+            out_files.append(
+                array_store.store_paths(model, scenario, degree_day_metric)[0]
+            )
+            continue
+        src_name = f"{model}_{scenario}_{degree_day_metric}_{year}.tif"
+        out_file = reprojected_dir / reproject.make_reprojected_filename(
+            src_name, name_prefix
+        )
+        reproject.write_raster_to_disk(out_file, reprojected_profile, reprojected_data)
+        out_files.append(out_file)
+    return out_files
+
+
+def run(
+    input_files,
+    selected_metrics,
+    n_workers,
+    memory_limit,
+    time_chunk=None,
+    store=False,
+    report_every=50,
+):
+    """Process input files in parallel over a Dask LocalCluster of worker processes.
+
+    Args:
+        input_files (list): list of (src_file, model, scenario, year) tuples
+        selected_metrics (list): metrics to write
+        n_workers (int): number of worker processes
+        memory_limit (str): memory limit per worker process, e.g. "4GB"
+        time_chunk (int): days per chunk when streaming input files, None to load them eagerly
+        store (bool): write to the intermediate store instead of GeoTIFFs
+        report_every (int): print throughput after this many completed files
+
+    Returns:
+        failed (list): list of (src_file, exception) tuples for files that could not be processed
+    """
+    if store:
+        create_stores(input_files, selected_metrics)
+
+    cluster = LocalCluster(
+        n_workers=n_workers, threads_per_worker=1, memory_limit=memory_limit
+    )
+    client = Client(cluster)
+    print(client.dashboard_link)
+
+    futures = {}
+    for src_file, model, scenario, year in input_files:
+        future = client.submit(
+            process_file,
+            src_file,
+            model,
+            scenario,
+            year,
+            selected_metrics,
+            time_chunk,
+            store,
+            pure=False,
+        )
+        futures[future] = src_file
+
+    failed = []
+    start_time = time.time()
+    for n_done, future in enumerate(as_completed(futures), start=1):
+        if future.status == "error":
+            failed.append((futures[future], future.exception()))
+        if n_done % report_every == 0 or n_done == len(futures):
+            minutes = (time.time() - start_time) / 60
+            print(
+                f"{n_done}/{len(futures)} files processed, {n_done / minutes:.1f} files per minute"
+            )
+
+    client.close()
+    cluster.close()
+    return failed
+
+
+def parse_args():
+    default_models = ["daymet"] + [m for m in models if m != "HadGEM2-ES"]
+    parser = argparse.ArgumentParser(
+        description="Compute degree day metrics in parallel, one task per input netCDF file."
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=default_models,
+        choices=["daymet"] + models,
+        help="models to process, 'daymet' is the historical baseline (default: all but HadGEM2-ES, which is missing data)",
+    )
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        default=scenarios,
+        choices=scenarios,
+        help="scenarios to process (default: all)",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        default=metrics,
+        choices=metrics,
+        help="degree day metrics to write (default: all)",
+    )
+    parser.add_argument(
+        "--years",
+        nargs="+",
+        default=["1950-2099"],
+        help="years or inclusive year ranges to process, e.g. 1980 2000-2009 (default: 1950-2099)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--memory-limit",
+        default="4GB",
+        help="memory limit per worker process, e.g. 4GB (default: 4GB)",
+    )
+    parser.add_argument(
+        "--time-chunk",
+        type=int,
+        default=None,
+        help="stream each input file in chunks of this many days to lower peak memory per worker (default: load each file at once)",
+    )
+    parser.add_argument(
+        "--store",
+        action="store_true",
+        help="write the grids to the memory-mapped intermediate store instead of GeoTIFFs, publish them later with `python array_store.py`",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        default=None,
+        help="append per-stage timing and memory records to this JSON lines file and print a summary at the end (see instrument.py)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.trace is not None:
+        # enabled before the cluster starts so the worker processes trace too
+        instrument.enable(args.trace)
+
+    input_files = list_input_files(args.models, args.scenarios, parse_years(args.years))
+    print(f"{len(input_files)} input files to process")
+
+    failed = run(
+        input_files,
+        args.metrics,
+        args.workers,
+        args.memory_limit,
+        args.time_chunk,
+        args.store,
+    )
+
+    if args.trace is not None:
+        instrument.print_summary(args.trace)
+
+    if failed:
+        for src_file, exc in failed:
+            print(f"Failed to process {src_file}: {exc!r}")
+        sys.exit(1)
@@ -0,0 +1,319 @@
+"""Write the annual degree day grids as one chunked, compressed cube per metric, in addition to (or instead of) the thousands of single-band GeoTIFFs.
+
+Model cubes have dimensions (model, scenario, year, y, x) and the Daymet baseline gets its own (year, y, x) cube per metric, since it has no model or scenario. Grids are read lazily from the intermediate array store (see `array_store.py`) when a group has one, otherwise from the reprojected GeoTIFFs, so only a few chunks are held in memory at a time. Cubes carry CF metadata (coordinates, a `crs` grid mapping variable, units) and store the whole-number degree days as int32.
+
+Chunks span 10 years and a quarter of the grid in each direction. Reading the map for one year touches 16 chunks and reading the full time series for one pixel touches 15 chunks, so neither access pattern has to decompress much more than it asks for.
+
+Example usage:
+    python write_cube.py --metrics air_freezing_index air_thawing_index --format netcdf
+"""
+
+import argparse
+
+import dask
+import dask.array as da
+import numpy as np
+import rasterio as rio
+import xarray as xr
+from pyproj import CRS
+
+from config import models, scenarios, metrics, reprojected_dir, cube_dir
+from config import model_years, daymet_years, unit_tag
+import array_store
+from reproject import make_reprojected_filename, deserialize_profile
+
+# chunk sizes along each dimension of the cubes
+cube_chunks = {"model": 1, "scenario": 1, "year": 10, "y": 56, "x": 80}
+
+# compression for NetCDF cubes, Zarr cubes use the Zarr default compressor
+netcdf_compression = {"zlib": True, "complevel": 4, "shuffle": True}
+
+cube_nodata = -9999
+
+
+def cube_path(metric, daymet=False, fmt="netcdf"):
+    """Get the path of the cube for a metric.
+
+    Args:
+        metric (str): degree day metric
+        daymet (bool): the Daymet baseline cube instead of the model cube
+        fmt (str): "netcdf" or "zarr"
+
+    Returns:
+        pathlib.Path: path of the cube, e.g. ncar_12km_air_freezing_index_1950_2099_Fdays.nc
+    """
+    if daymet:
+        stem = f"ncar_12km_daymet_historical_{metric}_{daymet_years[0]}_{daymet_years[-1]}_{unit_tag}"
+    else:
+        stem = f"ncar_12km_{metric}_{model_years[0]}_{model_years[-1]}_{unit_tag}"
+    return cube_dir / f"{stem}.{'nc' if fmt == 'netcdf' else 'zarr'}"
+
+
+def tif_path(model, scenario, metric, year):
+    """Get the path of the reprojected GeoTIFF for a model, scenario, metric, and year."""
+    return reprojected_dir / make_reprojected_filename(
+        f"{model}_{scenario}_{metric}_{year}.tif", "ncar_12km"
+    )
+
+
+def has_data(model, scenario, metric):
+    """Check if a group has a store or at least one reprojected GeoTIFF."""
+    if array_store.store_paths(model, scenario, metric)[1].exists():
+        return True
+    return any(reprojected_dir.glob(f"ncar_12km_{model}_{scenario}_{metric}_*.tif"))
+
+
+def get_grid_profile(groups):
+    """Get the raster profile of the grid from the first group with a store or GeoTIFF.
+
+    Args:
+        groups (list): list of (model, scenario, metric) tuples
+
+    Returns:
+        dict: raster profile parameters
+    """
+    for model, scenario, metric in groups:
+        if array_store.store_paths(model, scenario, metric)[1].exists():
+            meta = array_store.read_meta(model, scenario, metric)
+            return deserialize_profile(meta["profile"])
+        for fp in reprojected_dir.glob(f"ncar_12km_{model}_{scenario}_{metric}_*.tif"):
+            with rio.open(fp) as src:
+                return src.profile.copy()
+    raise FileNotFoundError(f"No stores or reprojected GeoTIFFs found for {groups}")
+
+
+def read_tif(fp, shape, nodata):
+    """Read a reprojected GeoTIFF, or a nodata grid if it does not exist."""
+    if not fp.exists():
+        return np.full(shape, nodata, dtype=np.float32)
+    with rio.open(fp) as src:
+        return src.read(1).astype(np.float32, copy=False)
+
+
+def lazy_group_stack(model, scenario, metric, years, raster_profile):
+    """Get a lazy (year, y, x) stack of annual grids for a group. Years without data are nodata.
+
+    Args:
+        model (str): model name or "daymet"
+        scenario (str): scenario name or "historical" for Daymet
+        metric (str): degree day metric
+        years (list): years of the stack
+        raster_profile (dict): raster profile of the grid
+
+    Returns:
+        dask.array.Array: float32 array of shape (len(years), height, width)
+    """
+    shape = (raster_profile["height"], raster_profile["width"])
+    nodata = raster_profile["nodata"]
+    chunks = (cube_chunks["year"], cube_chunks["y"], cube_chunks["x"])
+
+    if array_store.store_paths(model, scenario, metric)[1].exists():
+        stack, meta = array_store.open_store(model, scenario, metric)
+        start = meta["years"].index(years[0])
+        return da.from_array(stack, chunks=chunks)[start : start + len(years)]
+
+    arrs = [
+        da.from_delayed(
+            dask.delayed(read_tif)(
+                tif_path(model, scenario, metric, year), shape, nodata
+            ),
+            shape=shape,
+            dtype=np.float32,
+        )
+        for year in years
+    ]
+    return da.stack(arrs).rechunk(chunks)
+
+
+def grid_coords(raster_profile):
+    """Get the x and y coordinates of the pixel centers of a grid."""
+    transform = raster_profile["transform"]
+    x = transform.c + (np.arange(raster_profile["width"]) + 0.5) * transform.a
+    y = transform.f + (np.arange(raster_profile["height"]) + 0.5) * transform.e
+    return x, y
+
+
+def make_cube(metric, cube_models, cube_scenarios, years, raster_profile, daymet=False):
+    """Assemble the lazy cube dataset for a metric.
+
+    Args:
+        metric (str): degree day metric
+        cube_models (list): models in the cube, ignored for Daymet
+        cube_scenarios (list): scenarios in the cube, ignored for Daymet
+        years (list): years in the cube
+        raster_profile (dict): raster profile of the grid
+        daymet (bool): build the Daymet (year, y, x) cube
+
+    Returns:
+        xarray.Dataset: dataset with the metric variable and a `crs` grid mapping variable
+    """
+    x, y = grid_coords(raster_profile)
+    coords = {
+        "year": ("year", np.array(years, dtype=np.int16), {"long_name": "year"}),
+        "y": (
+            "y",
+            y,
+            {"standard_name": "projection_y_coordinate", "units": "m"},
+        ),
+        "x": (
+            "x",
+            x,
+            {"standard_name": "projection_x_coordinate", "units": "m"},
+        ),
+    }
+
+    if daymet:
+        data = lazy_group_stack("daymet", "historical", metric, years, raster_profile)
+        dims = ("year", "y", "x")
+    else:
+        data = da.stack(
+            [
+                da.stack(
+                    [
+                        lazy_group_stack(model, scenario, metric, years, raster_profile)
+                        for scenario in cube_scenarios
+                    ]
+                )
+                for model in cube_models
+            ]
+        )
+        dims = ("model", "scenario", "year", "y", "x")
+        coords["model"] = ("model", np.array(cube_models, dtype=object))
+        coords["scenario"] = ("scenario", np.array(cube_scenarios, dtype=object))
+
+    # nodata becomes NaN so it is written as the _FillValue of the int32 variable
+    data = da.where(data == raster_profile["nodata"], np.nan, data)
+    data = data.rechunk(tuple(cube_chunks[dim] for dim in dims))
+
+    crs_attrs = CRS.from_user_input(raster_profile["crs"]).to_cf()
+    ds = xr.Dataset(
+        {
+            metric: (
+                dims,
+                data,
+                {
+                    "long_name": metric.replace("_", " "),
+                    "units": "degF day",
+                    "grid_mapping": "crs",
+                },
+            ),
+            "crs": ((), np.int32(0), crs_attrs),
+        },
+        coords=coords,
+        attrs={
+            "title": f"Annual {metric.replace('_', ' ')}, NCAR 12km {'Daymet' if daymet else 'CMIP5'} downscaled data",
+            "Conventions": "CF-1.8",
+        },
+    )
+    return ds
+
+
+def write_cube(ds, out_path, fmt="netcdf"):
+    """Write a cube dataset to disk as NetCDF or Zarr, chunked with `cube_chunks`.
+
+    Args:
+        ds (xarray.Dataset): dataset from `make_cube`
+        out_path (pathlib.Path): output path
+        fmt (str): "netcdf" or "zarr"
+
+    Returns:
+        None
+    """
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        if name == "crs":
+            continue
+        chunks = tuple(cube_chunks[dim] for dim in var.dims)
+        encoding[name] = {"dtype": "int32", "_FillValue": cube_nodata}
+        if fmt == "netcdf":
+            encoding[name].update(netcdf_compression, chunksizes=chunks)
+        else:
+            encoding[name]["chunks"] = chunks
+
+    if fmt == "netcdf":
+        ds.to_netcdf(out_path, engine="netcdf4", encoding=encoding)
+    else:
+        ds.to_zarr(out_path, mode="w", encoding=encoding)
+
+
+def write_metric_cubes(metric, fmt="netcdf", cube_models=None, cube_scenarios=None):
+    """Write the model cube and the Daymet cube for a metric.
+
+    Args:
+        metric (str): degree day metric
+        fmt (str): "netcdf" or "zarr"
+        cube_models (list): models to include, defaults to all models with data for the metric
+        cube_scenarios (list): scenarios to include, defaults to all scenarios with data for the metric
+
+    Returns:
+        out_paths (list): paths of the cubes written
+    """
+    cube_models = [
+        model
+        for model in (cube_models or models)
+        if any(has_data(model, scenario, metric) for scenario in scenarios)
+    ]
+    cube_scenarios = [
+        scenario
+        for scenario in (cube_scenarios or scenarios)
+        if any(has_data(model, scenario, metric) for model in cube_models)
+    ]
+    groups = [(model, scenario, metric) for model in cube_models for scenario in cube_scenarios]
+    groups.append(("daymet", "historical", metric))
+    raster_profile = get_grid_profile(groups)
+
+    out_paths = []
+    if cube_models:
+        ds = make_cube(metric, cube_models, cube_scenarios, model_years, raster_profile)
+        out_paths.append(cube_path(metric, fmt=fmt))
+        write_cube(ds, out_paths[-1], fmt)
+
+    if has_data("daymet", "historical", metric):
+        ds = make_cube(metric, None, None, daymet_years, raster_profile, daymet=True)
+        out_paths.append(cube_path(metric, daymet=True, fmt=fmt))
+        write_cube(ds, out_paths[-1], fmt)
+
+    return out_paths
+
+
+def open_cube(metric, daymet=False, fmt="netcdf"):
+    """Open the cube for a metric lazily, nodata is decoded to NaN.
+
+    Args:
+        metric (str): degree day metric
+        daymet (bool): the Daymet baseline cube instead of the model cube
+        fmt (str): "netcdf" or "zarr"
+
+    Returns:
+        xarray.Dataset
+    """
+    fp = cube_path(metric, daymet, fmt)
+    if fmt == "netcdf":
+        return xr.open_dataset(fp, chunks={})
+    return xr.open_zarr(fp)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        default=metrics,
+        choices=metrics,
+        help="degree day metrics to write cubes for (default: all)",
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=None,
+        choices=models,
+        help="models to include (default: all models with data)",
+    )
+    parser.add_argument(
+        "--format", default="netcdf", choices=["netcdf", "zarr"], help="cube format"
+    )
+    args = parser.parse_args()
+
+    for metric in args.metrics:
+        for out_path in write_metric_cubes(metric, args.format, args.models):
+            print(f"{out_path} written")
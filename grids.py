@@ -0,0 +1,149 @@
+"""Registry of the grids shared by the dataset curation subsystems.
+
+Each named grid lists its CRS, resolution, and, where it is fixed, its shape and transform. Derived objects (pyproj CRS, the WRF grid coordinate vectors, transform, and raster profile) are built once per process and cached, and nothing here imports wrf-python, so worker processes can import this module cheaply.
+
+The subsystems are run from their own directories with flat imports, so each subsystem `config.py` puts the repository root on `sys.path` to make this module importable.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from affine import Affine
+from pyproj import CRS, Transformer
+
+# proj4 string of the NCAR 12km WRF polar stereographic grid, written to match
+# `wrf.PolarStereographic(TRUELAT1=64, STAND_LON=-150).proj4()`, which the subsystems used before.
+# wrf-python could not be installed when this was written, so `check_wrf_grid` checks the CRS and
+# grid against a GeoTIFF written with the wrf-python CRS instead (see ncar12km_decadal_summaries/reproject.ipynb),
+# and against wrf-python itself where it is installed
+wrf_proj4 = "+proj=stere +units=m +a=6370000.0 +b=6370000.0 +lat_0=90.0 +lon_0=-150 +lat_ts=64 +nadgrids=@null"
+
+# the WRF grid is centered on this (lon, lat)
+wrf_center = (-150, 64)
+
+grids = {
+    # source grid of the NCAR 12km met and VIC hydro data
+    "wrf_12km": {"crs": wrf_proj4, "resolution": 12000, "shape": (209, 299)},
+    # output grid of the NCAR 12km products, experimentally derived from `gdalwarp -tap -tr 12000 12000` of the WRF grid
+    "epsg3338_12km": {"crs": "EPSG:3338", "resolution": 12000, "shape": (224, 317)},
+    # output grid of the landfast sea ice products, the extent follows each source raster
+    "landfast_100m": {"crs": "EPSG:3338", "resolution": 100},
+    # grid of the GIPL 1km permafrost outputs, transform rounded to remove the drift between source files
+    "gipl_1km": {
+        "crs": "EPSG:3338",
+        "resolution": 1000,
+        "shape": (1941, 2471),
+        "transform": Affine(1000.0, 0.0, -979791.709, 0.0, -1000.0, 2375479.751),
+    },
+}
+
+# shared parameters of the GeoTIFFs written on the WRF grid
+wrf_profile_defaults = {
+    "driver": "GTiff",
+    "count": 1,
+    "dtype": np.float32,
+    "nodata": -9999,
+    "tiled": False,
+    "compress": "lzw",
+    "interleave": "band",
+}
+
+
+@lru_cache(maxsize=None)
+def get_crs(name):
+    """Get the pyproj CRS of a named grid."""
+    return CRS.from_user_input(grids[name]["crs"])
+
+
+@lru_cache(maxsize=None)
+def wrf_center_xy():
+    """Get the projected (x, y) of the WRF grid center."""
+    transformer = Transformer.from_crs("EPSG:4326", get_crs("wrf_12km"), always_xy=True)
+    return transformer.transform(*wrf_center)
+
+
+@lru_cache(maxsize=None)
+def wrf_grid(ny=209, nx=299):
+    """
+    Get the coordinates and transform of the WRF grid. The shape is a parameter because some inputs (e.g., subsets used for testing) only cover part of the domain, the grid is always centered on `wrf_center`.
+
+    Args:
+        ny (int): number of rows
+        nx (int): number of columns
+
+    Returns:
+        grid (dict): "x" and "y" cell center coordinate vectors (y ascending, like the source data), the north-up "transform", and the "shape"
+    """
+    dx = dy = grids["wrf_12km"]["resolution"]
+    e, n = wrf_center_xy()
+
+    # Down left corner of the domain
+    x0 = -(nx - 1) / 2.0 * dx + e
+    y0 = -(ny - 1) / 2.0 * dy + n
+    x = np.arange(nx) * dx + x0
+    y = np.arange(ny) * dy + y0
+    x.flags.writeable = False
+    y.flags.writeable = False
+
+    # west and north edges
+    transform = Affine(dx, 0.0, x0 - dx / 2, 0.0, -dy, y[-1] + dy / 2)
+    return {"x": x, "y": y, "transform": transform, "shape": (ny, nx)}
+
+
+def wrf_raster_profile(ny=209, nx=299):
+    """
+    Get a raster profile for writing a GeoTIFF on the WRF grid. A new dict is returned on every call, so callers can update it.
+
+    Args:
+        ny (int): number of rows
+        nx (int): number of columns
+
+    Returns:
+        dict: raster profile parameters
+    """
+    grid = wrf_grid(ny, nx)
+    profile = {
+        "crs": get_crs("wrf_12km"),
+        "transform": grid["transform"],
+        "width": nx,
+        "height": ny,
+    }
+    profile.update(wrf_profile_defaults)
+    return profile
+
+
+def check_wrf_grid():
+    """Check the WRF grid against a GeoTIFF written with the wrf-python CRS by the original pipeline, and `wrf_proj4` against wrf-python if it is installed.
+
+    The reference is the gdalinfo output of runoff_mm_CSIRO-Mk3-6-0_rcp85_aug_total_2050-2060_mean.tif: a 6370000 m sphere, polar stereographic (variant B) with a 64 degree standard parallel and -150 degree origin longitude, origin (-1794000.0, -1538424.205046423245221), and 12000 m pixels.
+
+    Raises:
+        AssertionError: if the grid or the proj4 string differ from the reference
+    """
+    crs = get_crs("wrf_12km")
+    # the +nadgrids=@null of the proj4 string wraps the CRS in a BoundCRS
+    crs = crs.source_crs or crs
+    assert (crs.ellipsoid.semi_major_metre, crs.ellipsoid.semi_minor_metre) == (6370000.0, 6370000.0)
+    conversion = crs.coordinate_operation
+    assert conversion.method_name == "Polar Stereographic (variant B)"
+    params = {param.name: param.value for param in conversion.params}
+    assert params["Latitude of standard parallel"] == 64
+    assert params["Longitude of origin"] == -150
+    assert params["False easting"] == params["False northing"] == 0
+    transform = wrf_grid(209, 299)["transform"]
+    assert (transform.a, transform.e) == (12000.0, -12000.0)
+    assert np.isclose(transform.c, -1794000.0, rtol=0, atol=1e-6)
+    assert np.isclose(transform.f, -1538424.205046423245221, rtol=0, atol=1e-6)
+
+    try:
+        from wrf import PolarStereographic
+    except ImportError:
+        print("wrf-python is not installed, wrf_proj4 was only checked against the reference GeoTIFF")
+        return
+    wrf_python_proj4 = PolarStereographic(TRUELAT1=64, STAND_LON=-150).proj4()
+    assert wrf_proj4 == wrf_python_proj4, f"{wrf_proj4} != {wrf_python_proj4}"
+
+
+if __name__ == "__main__":
+    check_wrf_grid()
+    print("WRF grid matches the reference")
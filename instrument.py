@@ -0,0 +1,246 @@
+"""Opt-in timing and memory instrumentation of pipeline stages.
+
+Tracing is off unless the `ARDAC_TRACE` environment variable names a trace file (the run scripts set it with `--trace`). When it is on, every stage wrapped with `stage` or `traced` appends one JSON line to the trace file with its wall time, the CPU time, bytes read and written, and the resident set size of the process. A stage also carries its tags (e.g. model, scenario, year) and those of the stages it is nested in. Tags are kept per thread, so work handed to a thread pool is wrapped with `with_current_tags` to keep the tags of the thread that submitted it. Child processes inherit the environment variable, so workers started after tracing is enabled write to the same file. When tracing is off the wrappers only check the environment variable and call through.
+
+CPU time and I/O bytes are counted for the whole process (from `time.process_time` and /proc/self/io), so stages that overlap in threads of the same process share them. `peak_rss_mb` is the high-water mark of the process when the stage ended.
+
+Example usage:
+    ARDAC_TRACE=trace.jsonl python run.py ...
+    python instrument.py trace.jsonl --by stage model
+"""
+
+import argparse
+import inspect
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+trace_env_var = "ARDAC_TRACE"
+
+# tags of the stages open in each thread
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def trace_path():
+    """Get the path of the trace file, None if tracing is off."""
+    path = os.environ.get(trace_env_var)
+    return Path(path) if path else None
+
+
+def enable(path):
+    """Turn tracing on for this process and the child processes it starts later, appending to the trace file at `path`."""
+    os.environ[trace_env_var] = str(path)
+
+
+def read_io_bytes():
+    """Get the (read, written) bytes of this process from /proc/self/io, (None, None) where that is not available."""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def current_rss_mb():
+    """Get the current resident set size of this process in MB, None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_tags():
+    """Get the tags of the stages open in this thread, inner stages override outer ones."""
+    tags = {}
+    for stage_tags in getattr(_local, "stack", []):
+        tags.update(stage_tags)
+    return tags
+
+
+def with_current_tags(func):
+    """
+    Wrap a function so it runs with the stages open in the calling thread, e.g. for jobs submitted to a thread pool. The tags are captured when `with_current_tags` is called, and the stages the function opens record the innermost captured stage as their parent.
+
+    Args:
+        func (callable): function to run in another thread
+
+    Returns:
+        callable: the wrapped function
+    """
+    captured = list(getattr(_local, "stack", []))
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, "stack", None)
+        _local.stack = list(captured)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.stack = previous if previous is not None else []
+
+    return wrapper
+
+
+def write_record(path, record):
+    """Append a record to the trace file as one JSON line."""
+    line = json.dumps(record, default=str) + "\n"
+    with _write_lock:
+        with open(path, "a") as f:
+            f.write(line)
+
+
+@contextmanager
+def stage(name, **tags):
+    """
+    Trace a block of code as a stage. Does nothing but run the block when tracing is off.
+
+    Args:
+        name (str): name of the stage, e.g. "load" or "write_raster_to_disk"
+        **tags: tags of the stage, e.g. model="CCSM4", scenario="rcp45"
+
+    Yields:
+        None
+    """
+    path = trace_path()
+    if path is None:
+        yield
+        return
+
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1].get("stage") if stack else None
+    stack.append(dict(tags, stage=name))
+
+    read_start, written_start = read_io_bytes()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    start_time = time.time()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        wall_s = time.perf_counter() - wall_start
+        cpu_s = time.process_time() - cpu_start
+        read_end, written_end = read_io_bytes()
+        record = current_tags()
+        stack.pop()
+        record.update(
+            {
+                "stage": name,
+                "parent": parent,
+                "status": status,
+                "pid": os.getpid(),
+                "thread": threading.current_thread().name,
+                "start": round(start_time, 3),
+                "wall_s": round(wall_s, 4),
+                "cpu_s": round(cpu_s, 4),
+                "read_mb": None if read_end is None else round((read_end - read_start) / 1024**2, 3),
+                "written_mb": None if written_end is None else round((written_end - written_start) / 1024**2, 3),
+                "rss_mb": current_rss_mb(),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            }
+        )
+        write_record(path, record)
+
+
+def traced(name=None, tag_args=()):
+    """
+    Decorate a function so each call is traced as a stage.
+
+    Args:
+        name (str): name of the stage, defaults to the function name
+        tag_args (tuple): names of function arguments recorded as tags, e.g. ("model", "scenario", "year")
+
+    Returns:
+        callable: decorator
+    """
+
+    def decorator(func):
+        stage_name = name or func.__name__
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if trace_path() is None:
+                return func(*args, **kwargs)
+            tags = {}
+            if tag_args:
+                arguments = signature.bind_partial(*args, **kwargs).arguments
+                tags = {arg: arguments[arg] for arg in tag_args if arg in arguments}
+            with stage(stage_name, **tags):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def read_trace(path=None):
+    """Read a trace file into a DataFrame with one row per stage call."""
+    import pandas as pd
+
+    with open(path or trace_path()) as f:
+        return pd.DataFrame.from_records([json.loads(line) for line in f if line.strip()])
+
+
+def summarize(path=None, by=("stage",)):
+    """
+    Summarize a trace per stage, or per any combination of stage and tag columns.
+
+    Args:
+        path (pathlib.Path): trace file, defaults to the current one
+        by (tuple): columns to group by, e.g. ("stage", "model")
+
+    Returns:
+        pandas.DataFrame: call count, total, mean, and max wall time, total CPU time, MB read and written, and the largest peak RSS of each group, slowest first
+    """
+    trace = read_trace(path)
+    summary = trace.groupby(list(by), dropna=False).agg(
+        calls=("wall_s", "size"),
+        wall_s=("wall_s", "sum"),
+        mean_wall_s=("wall_s", "mean"),
+        max_wall_s=("wall_s", "max"),
+        cpu_s=("cpu_s", "sum"),
+        read_mb=("read_mb", "sum"),
+        written_mb=("written_mb", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+    )
+    return summary.sort_values("wall_s", ascending=False).round(3)
+
+
+def print_summary(path=None, by=("stage",)):
+    """Print the summary table of a trace, see `summarize`."""
+    path = path or trace_path()
+    print(f"trace written to {path}")
+    print(summarize(path, by).to_string())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a stage trace file.")
+    parser.add_argument("trace", type=Path, help="JSON lines trace file")
+    parser.add_argument(
+        "--by",
+        nargs="+",
+        default=["stage"],
+        help="columns to group by, e.g. stage model scenario (default: stage)",
+    )
+    args = parser.parse_args()
+    print_summary(args.trace, tuple(args.by))
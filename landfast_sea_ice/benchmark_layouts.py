@@ -0,0 +1,226 @@
+"""Benchmark the "frame" and "timeseries" chunk layouts of the season NetCDFs on synthetic daily SLIE GeoTIFFs.
+
+Synthetic daily GeoTIFFs are written on an EPSG:3338 100m grid with the landfast classes of the source data: land along one edge, a band of landfast ice whose seaward edge advances and retreats through the season, and open water beyond. Each layout is written with `merge.write_season_netcdf` and then queried with `query.py` for the multi-season history of random points and of a small bounding box. Write and query wall times are the best of `--repeat` runs, and the query results of both layouts are checked to be identical.
+
+All inputs and outputs go to a temporary directory, `INPUT_DIR`, `SCRATCH_DIR`, and `OUTPUT_DIR` are pointed there before `config` is imported.
+
+Example usage:
+    python benchmark_layouts.py --seasons 3 --days 90 --size 2048 --points 20 --repeat 3
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import rasterio
+from affine import Affine
+from pyproj import Transformer
+
+# `config` can only be imported once the data directories point at the synthetic data,
+# so put the repository root on sys.path for the shared grid registry here
+sys.path.append(str(Path(__file__).parent.parent))
+import grids
+
+crs = grids.grids["landfast_100m"]["crs"]
+res = grids.grids["landfast_100m"]["resolution"]
+# upper left corner of the synthetic grid, on the Beaufort coast
+origin = (200000, 2300000)
+
+
+def make_synthetic_season(season_dir, start_date, days, size, seed=0):
+    """Write the daily GeoTIFFs of one synthetic season.
+
+    Args:
+        season_dir (pathlib.Path): output directory
+        start_date (datetime.date): date of the first day
+        days (int): number of days
+        size (int): width and height of the rasters in pixels
+        seed (int): random seed
+
+    Returns:
+        geotiffs (list): paths of the daily GeoTIFFs in date order
+        dates (list): pd.Timestamp date of each GeoTIFF
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size]
+    # distance from a wavy coastline along the top edge, in pixels
+    coast = size * 0.1 + size * 0.03 * np.sin(xx / size * 6 * np.pi)
+    distance = yy - coast
+    transform = Affine(res, 0.0, origin[0], 0.0, -res, origin[1])
+    profile = {
+        "driver": "GTiff",
+        "height": size,
+        "width": size,
+        "count": 1,
+        "dtype": "float32",
+        "crs": crs,
+        "transform": transform,
+        "tiled": True,
+        "compress": "lzw",
+    }
+
+    geotiffs, dates = [], []
+    for i in range(days):
+        day = start_date + timedelta(days=i)
+        # landfast ice edge grows then retreats through the season
+        edge = size * 0.4 * np.sin(np.pi * (i + 1) / (days + 1))
+        edge = edge + rng.normal(0, size * 0.01, size)[None, :]
+        arr = np.where(distance < 0, 128, np.where(distance < edge, 255, 0)).astype("float32")
+        arr[rng.random((size, size)) < 0.001] = np.nan
+        fp = season_dir / f"beaufort_{day:%Y%m%d}_asip_slie.tif"
+        with rasterio.open(fp, "w", **profile) as dst:
+            dst.write(arr, 1)
+        geotiffs.append(fp)
+        dates.append(pd.Timestamp(day))
+    return geotiffs, dates
+
+
+def make_random_points(n, size, seed=0):
+    """Make random point locations (lat / lon) at pixel centers of the synthetic grid, with the "id" index used by `query.query_points`."""
+    rng = np.random.default_rng(seed)
+    rows, cols = rng.integers(0, size, n), rng.integers(0, size, n)
+    xs = origin[0] + (cols + 0.5) * res
+    ys = origin[1] - (rows + 0.5) * res
+    lons, lats = Transformer.from_crs(crs, "EPSG:4326", always_xy=True).transform(xs, ys)
+    return pd.DataFrame(
+        {"latitude": lats, "longitude": lons}, index=pd.Index(range(n), name="id")
+    )
+
+
+def best_time(func, repeat=1):
+    """Run a function `repeat` times and return its last result and the best wall time in seconds."""
+    wall_times = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        result = func()
+        wall_times.append(time.perf_counter() - tic)
+    return result, min(wall_times)
+
+
+def run_benchmark(seasons, nc_dir, points, bbox, workers=4, repeat=1, encoding="int16"):
+    """Write and query every layout. `config` must point at the synthetic data before this is called.
+
+    Args:
+        seasons (list): (geotiffs, dates) of each synthetic season
+        nc_dir (pathlib.Path): directory for the season NetCDFs
+        points (pandas.DataFrame): point locations to query
+        bbox (tuple): bounding box to query, in EPSG:3338
+        workers (int): number of threads reading GeoTIFFs
+        repeat (int): runs per measurement, the best time is kept
+        encoding (str): encoding of the stored classes, "int16" or "uint8"
+
+    Returns:
+        dict: results keyed by layout
+    """
+    import merge
+    import query
+
+    results = {}
+    answers = {}
+    for layout in merge.layouts:
+        nc_files = [nc_dir / f"{layout}_{i}.nc" for i in range(len(seasons))]
+
+        def write_all():
+            for (geotiffs, dates), fp in zip(seasons, nc_files):
+                merge.write_season_netcdf(
+                    geotiffs, dates, fp, workers, layout=layout, encoding=encoding
+                )
+
+        _, write_s = best_time(write_all, repeat)
+        point_history, points_s = best_time(lambda: query.query_points(nc_files, points), repeat)
+        bbox_history, bbox_s = best_time(lambda: query.query_bbox(nc_files, bbox), repeat)
+        answers[layout] = (point_history, bbox_history)
+        results[layout] = {
+            "write_s": round(write_s, 3),
+            "size_mb": round(sum(fp.stat().st_size for fp in nc_files) / 1024**2, 1),
+            "points_s": round(points_s, 4),
+            "bbox_s": round(bbox_s, 4),
+        }
+
+    reference_points, reference_bbox = answers["frame"]
+    for layout, (point_history, bbox_history) in answers.items():
+        if not point_history.equals(reference_points) or not bbox_history.equals(reference_bbox):
+            raise AssertionError(f"the {layout} layout query results differ from the frame layout")
+    return results
+
+
+def print_results(results, n_points):
+    """Print a table of results, with the query speedup over the frame layout."""
+    frame = results["frame"]
+    print(
+        f"{'layout':<12} {'write (s)':>10} {'size (MB)':>10} {f'{n_points} points (s)':>14} {'bbox (s)':>10} {'points speedup':>15}"
+    )
+    for layout, r in results.items():
+        speedup = frame["points_s"] / r["points_s"] if r["points_s"] > 0 else float("nan")
+        print(
+            f"{layout:<12} {r['write_s']:>10.2f} {r['size_mb']:>10.1f} {r['points_s']:>14.4f} {r['bbox_s']:>10.4f} {speedup:>14.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--seasons", type=int, default=3, help="number of synthetic seasons (default: 3)"
+    )
+    parser.add_argument(
+        "--days", type=int, default=90, help="number of days per season (default: 90)"
+    )
+    parser.add_argument(
+        "--size", type=int, default=2048, help="width and height of the rasters in pixels (default: 2048)"
+    )
+    parser.add_argument(
+        "--points", type=int, default=20, help="number of random points to query (default: 20)"
+    )
+    parser.add_argument(
+        "--bbox-size", type=int, default=32, help="width and height of the queried box in pixels (default: 32)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="number of threads reading GeoTIFFs (default: 4)"
+    )
+    parser.add_argument(
+        "--encoding",
+        default="int16",
+        choices=["int16", "uint8"],
+        help="encoding of the stored classes (default: int16)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="runs per measurement, the best time is kept"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        for env_var in ["INPUT_DIR", "SCRATCH_DIR", "OUTPUT_DIR"]:
+            os.environ[env_var] = str(tmp_dir / env_var.lower())
+
+        tic = time.perf_counter()
+        seasons = []
+        for i in range(args.seasons):
+            season_dir = tmp_dir / f"season_{i}"
+            season_dir.mkdir()
+            seasons.append(
+                make_synthetic_season(season_dir, date(2010 + i, 10, 1), args.days, args.size, seed=i)
+            )
+        print(
+            f"{args.seasons} synthetic seasons of {args.days} {args.size} x {args.size} days written in {time.perf_counter() - tic:.1f}s"
+        )
+
+        points = make_random_points(args.points, args.size)
+        # box near the coast, where the ice edge moves
+        box_x0 = origin[0] + args.size * 0.5 * res
+        box_y1 = origin[1] - args.size * 0.15 * res
+        bbox = (box_x0, box_y1 - args.bbox_size * res, box_x0 + args.bbox_size * res, box_y1)
+
+        nc_dir = tmp_dir / "netcdf"
+        nc_dir.mkdir()
+        results = run_benchmark(
+            seasons, nc_dir, points, bbox, args.workers, args.repeat, args.encoding
+        )
+
+    print_results(results, args.points)
@@ -0,0 +1,158 @@
+"""Date-indexed catalog of the daily SLIE GeoTIFFs in a directory.
+
+A catalog is built with a single scan of a directory. Each GeoTIFF file name is parsed once to get its date, zone, and data source, and the entries are kept sorted by date. A date range (e.g., an ice year) is then selected by bisection instead of parsing every file name again. Catalogs are cached per directory and rebuilt only when the directory modification time changes (i.e., when files are added, removed, or renamed).
+
+Both the curated file names (e.g., beaufort_20230726_asip_slie.tif) and the source file names (e.g., a20230726_dailyslie.tif, with the zone taken from the "Beau" / "Chuk" grandparent directory) are understood.
+"""
+
+import os
+import re
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from pathlib import Path
+
+from luts import ice_zones, ice_zones_full, data_sources
+
+date_pattern = re.compile(r"(\d{4})(\d{2})(\d{2})")
+
+# zone names as used in the curated file names, keyed by the source directory names
+zone_names = {k: v.lower() for k, v in zip(ice_zones, ice_zones_full)}
+
+# catalogs built so far, keyed by (directory, str_to_match)
+_catalogs = {}
+
+
+def parse_geotiff_name(fp):
+    """Parse the date, zone, and data source of a daily SLIE GeoTIFF from its path.
+
+    Args:
+        fp (pathlib.PosixPath): path to the GeoTIFF
+    Returns:
+        tuple: (date, zone, source), e.g. (datetime(2023, 7, 26), "beaufort", "asip"), or None if the file name has no date
+    """
+    match = date_pattern.search(fp.name)
+    if match is None:
+        return None
+    date = datetime(*map(int, match.groups()))
+
+    name_parts = fp.stem.split("_")
+    if name_parts[0] in zone_names.values():
+        # curated name like beaufort_20230726_asip_slie
+        zone = name_parts[0]
+        source = "_".join(name_parts[2:-1])
+    else:
+        # source name like a20230726_dailyslie, the zone is the grandparent directory
+        zone = zone_names.get(fp.parent.parent.name)
+        source = data_sources.get(fp.name[0])
+        if source is not None:
+            source = source.lower().replace(" ", "_")
+    return date, zone, source
+
+
+def build_catalog(directory, str_to_match=None):
+    """Build the catalog of the GeoTIFFs in a directory with one scan.
+
+    Args:
+        directory (pathlib.PosixPath): directory of daily SLIE GeoTIFFs
+        str_to_match (str, optional): only catalog files with this string in the name. Defaults to None.
+    Returns:
+        catalog (dict): parallel "dates", "zones", "sources", and "paths" lists sorted by date, "positions" mapping each path to its position, and the "directory" as given and "resolved" to an absolute path. Files without a date in the name are left out.
+    """
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not entry.name.endswith(".tif"):
+                continue
+            if str_to_match and str_to_match not in entry.name:
+                continue
+            fp = Path(entry.path)
+            parsed = parse_geotiff_name(fp)
+            if parsed is not None:
+                entries.append((*parsed, fp))
+
+    entries.sort(key=lambda e: (e[0], e[3]))
+    paths = [e[3] for e in entries]
+    return {
+        "directory": Path(directory),
+        "resolved": Path(directory).resolve(),
+        "dates": [e[0] for e in entries],
+        "zones": [e[1] for e in entries],
+        "sources": [e[2] for e in entries],
+        "paths": paths,
+        "positions": {fp: i for i, fp in enumerate(paths)},
+    }
+
+
+def get_catalog(directory, str_to_match=None):
+    """Get the catalog of a directory, building it only on first use or when the directory changed.
+
+    Args:
+        directory (pathlib.PosixPath): directory of daily SLIE GeoTIFFs
+        str_to_match (str, optional): only catalog files with this string in the name. Defaults to None.
+    Returns:
+        catalog (dict): see `build_catalog`
+    """
+    key = (Path(directory), str_to_match)
+    mtime_ns = os.stat(directory).st_mtime_ns
+    cached = _catalogs.get(key)
+    if cached is None or cached[0] != mtime_ns:
+        cached = (mtime_ns, build_catalog(directory, str_to_match))
+        _catalogs[key] = cached
+    return cached[1]
+
+
+def select_range(catalog, start, end, zone=None, source=None):
+    """Select the catalog entries dated from `start` to `end` (both inclusive) by bisection.
+
+    Args:
+        catalog (dict): catalog from `get_catalog`
+        start (datetime.datetime): first date
+        end (datetime.datetime): last date
+        zone (str, optional): only select this zone, e.g. "beaufort". Defaults to None.
+        source (str, optional): only select this data source, e.g. "asip". Defaults to None.
+    Returns:
+        tuple: (paths, dates) lists of the selected entries in date order
+    """
+    lo = bisect_left(catalog["dates"], start)
+    hi = bisect_right(catalog["dates"], end)
+    selected = [
+        i
+        for i in range(lo, hi)
+        if (zone is None or catalog["zones"][i] == zone)
+        and (source is None or catalog["sources"][i] == source)
+    ]
+    paths = [catalog["paths"][i] for i in selected]
+    dates = [catalog["dates"][i] for i in selected]
+    return paths, dates
+
+
+def lookup_date(fp):
+    """Get the date of a GeoTIFF from a cached catalog of its directory, parsing the name only if the file is not cataloged.
+
+    Every cached catalog of the directory is searched, whatever its `str_to_match`, and directories are compared as resolved paths, so relative and absolute paths to the same file find the same entry.
+
+    Args:
+        fp (pathlib.PosixPath): path to the GeoTIFF
+    Returns:
+        date (datetime.datetime): the date of the file
+    """
+    fp = Path(fp)
+    parent = fp.parent.resolve()
+    for _, catalog in _catalogs.values():
+        if catalog["resolved"] == parent:
+            position = catalog["positions"].get(catalog["directory"] / fp.name)
+            if position is not None:
+                return catalog["dates"][position]
+    return parse_geotiff_name(fp)[0]
+
+
+def ice_year_bounds(ice_year):
+    """Get the first and last dates of an ice year. An ice year begins in October of one calendar year and ends in July of the following year.
+
+    Args:
+        ice_year (str): the ice year, e.g., '2010-11'
+    Returns:
+        tuple: (October 1 of the start year, July 31 of the end year)
+    """
+    start_year = int(ice_year.split("-")[0])
+    return datetime(start_year, 10, 1), datetime(start_year + 1, 7, 31)
@@ -1,8 +1,12 @@
 """Configuration for curating Einhorn/Mahoney 2024 Landfast Sea Ice Data."""
 
 import os
+import sys
 from pathlib import Path
 
+# make the shared grid registry (grids.py at the repository root) importable
+sys.path.append(str(Path(__file__).parent.parent))
+
 # path to directory of compressed data
 # if not set, use the default
 if "INPUT_ZIP_DIR" not in os.environ:
@@ -38,3 +42,6 @@ DAILY_CHUKCHI_DIR = OUTPUT_DIR / "Chukchi_Daily"
 DAILY_CHUKCHI_DIR.mkdir(exist_ok=True)
 CHUKCHI_NETCDF_DIR = OUTPUT_DIR / "Chukchi_NetCDFs"
 CHUKCHI_NETCDF_DIR.mkdir(exist_ok=True)
+# per-pixel season metrics computed from the daily SLIE NetCDFs
+SEASON_METRICS_DIR = OUTPUT_DIR / "Season_Metrics"
+SEASON_METRICS_DIR.mkdir(exist_ok=True)
@@ -2,13 +2,12 @@
 
 import os
 import random
-import re
-from datetime import datetime
 
 import numpy as np
 import rasterio as rio
 import matplotlib.pyplot as plt
 
+from catalog import get_catalog
 from luts import pixel_values, daily_slie_norm, daily_slie_cmap, mmm_cmap
 
 
@@ -137,13 +136,14 @@ def plot_random_sample(directory):
 
 
 def get_dates(target_directory):
-    dates = []
-    geotiffs = list_geotiffs(target_directory, "dailyslie")
+    """Get the dates of the daily SLIE GeoTIFFs in a directory from its catalog.
 
-    for file in geotiffs:
-        date = re.search(r"(\d{4})(\d{2})(\d{2})", file.name).groups()
-        dates.append(datetime(int(date[0]), int(date[1]), int(date[2])))
-    return dates
+    Args:
+        target_directory (pathlib.PosixPath): The directory containing daily SLIE GeoTIFF files.
+    Returns:
+        list: A list of datetime objects, in date order.
+    """
+    return list(get_catalog(target_directory, "dailyslie")["dates"])
 
 
 def plot_daily_slie_array(arr_to_plot):
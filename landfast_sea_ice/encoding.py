@@ -0,0 +1,65 @@
+"""Encodings of the daily SLIE class stacks.
+
+The daily SLIE rasters only take the six class values of `luts.pixel_values` (0, 32, 64, 111, 128, 255), so they fit in uint8 without remapping: the "uint8" encoding stores the class values themselves in half the memory of the "int16" encoding (compressed files shrink much less), and describes them with CF `flag_values` / `flag_meanings` attributes.
+
+The landfast ice class (255) can also be stored as a bit-packed boolean mask, eight pixels per byte along x (`numpy.packbits`, most significant bit first). Counting or combining landfast days then touches an eighth of the bytes of the class stack.
+"""
+
+import numpy as np
+
+from luts import pixel_values
+
+slie_encodings = {"int16": "i2", "uint8": "u1"}
+
+# class value of landfast ice
+landfast_value = 255
+
+
+def flag_attrs(encoding):
+    """Get the CF flag attributes of the SLIE classes for an encoding, e.g. flag_meanings "not_landfast_ice coast_vector_shadow ..."."""
+    return {
+        "flag_values": np.array(list(pixel_values), dtype=slie_encodings[encoding]),
+        "flag_meanings": " ".join(
+            meaning.lower().replace(" ", "_") for meaning in pixel_values.values()
+        ),
+    }
+
+
+def encode_slie(arr, encoding):
+    """Cast a daily SLIE array to an encoding.
+
+    Args:
+        arr (numpy.ndarray): SLIE class values
+        encoding (str): one of `slie_encodings`
+    Returns:
+        numpy.ndarray: the class values with the dtype of the encoding
+    """
+    dtype = slie_encodings[encoding]
+    if encoding == "uint8" and arr.size and (arr.min() < 0 or arr.max() > 255):
+        raise ValueError(
+            f"SLIE values from {arr.min()} to {arr.max()} do not fit the uint8 encoding"
+        )
+    return arr.astype(dtype)
+
+
+def pack_landfast(arr):
+    """Pack the landfast ice pixels of a SLIE array into a bit mask along the last axis.
+
+    Args:
+        arr (numpy.ndarray): SLIE class values, (..., x)
+    Returns:
+        numpy.ndarray: uint8 bit mask, (..., ceil(x / 8))
+    """
+    return np.packbits(arr == landfast_value, axis=-1)
+
+
+def unpack_landfast(packed, width):
+    """Unpack a landfast ice bit mask.
+
+    Args:
+        packed (numpy.ndarray): uint8 bit mask from `pack_landfast`, (..., ceil(width / 8))
+        width (int): number of x pixels
+    Returns:
+        numpy.ndarray: boolean landfast ice mask, (..., width)
+    """
+    return np.unpackbits(packed, axis=-1, count=width).astype(bool)
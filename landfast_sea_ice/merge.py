@@ -1,147 +1,368 @@
-import re
+"""Stack the daily SLIE GeoTIFFs of each ice year into one NetCDF per ice zone and ice year.
+
+A season is streamed to disk: the `slie` variable is created with an unlimited time dimension, zlib / shuffle compression, and explicit chunking, and each day's raster is appended as soon as it is read. Rasters are read ahead on a small local thread pool, but never more than `--prefetch` at once, so memory holds a few rasters regardless of the length of the season.
+
+Two chunk layouts are available with `--layout`:
+- "frame" (default) chunks each day in 1024 x 1024 tiles, suited to reading whole days or maps.
+- "timeseries" chunks the whole season in 64 x 64 pixel tiles, suited to reading the history of a few pixels (see `query.py`). Such a chunk holds every day of the season, so the file is written in strips of tile rows instead of day by day: the strip is read from every daily GeoTIFF with windowed reads and written at once, which holds one strip of the season in memory.
+
+With `--encoding uint8` the classes are stored as uint8 instead of int16 (see `encoding.py`), which halves the in-memory arrays and strips. The NetCDFs only shrink a little, because shuffle and zlib already compress away the high bytes of int16. `--landfast-mask` adds a `landfast_mask` variable holding the landfast ice pixels as a bit-packed boolean mask, for fast counts of landfast days.
+
+Example usage:
+    python merge.py --zones beaufort chukchi --ice-years 2010-11 2011-12 --workers 4 --prefetch 4
+    python merge.py --layout timeseries --out-suffix _timeseries
+    python merge.py --encoding uint8 --landfast-mask
+"""
+
+import argparse
 import time
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import Path
 
-import rasterio
-import xarray as xr
-import rioxarray
-import dask
+import netCDF4
+import numpy as np
 import pandas as pd
-import dask.distributed as dd
-from dask_jobqueue import SLURMCluster
+import rasterio
+from rasterio.windows import Window
 
-from eda import list_geotiffs
+from catalog import get_catalog, select_range, lookup_date, ice_year_bounds
+from encoding import slie_encodings, flag_attrs, encode_slie, pack_landfast
 from config import (
     DAILY_BEAUFORT_DIR,
     BEAUFORT_NETCDF_DIR,
     DAILY_CHUKCHI_DIR,
     CHUKCHI_NETCDF_DIR,
-    SCRATCH_DIR,
 )
 from luts import ice_years
 
+# daily GeoTIFF directory and NetCDF output directory of each ice zone
+zone_dirs = {
+    "beaufort": (DAILY_BEAUFORT_DIR, BEAUFORT_NETCDF_DIR),
+    "chukchi": (DAILY_CHUKCHI_DIR, CHUKCHI_NETCDF_DIR),
+}
+
+# chunk shape (time, y, x) of the slie variable for each layout, None is the length of the season
+layouts = {
+    "frame": (1, 1024, 1024),
+    "timeseries": (None, 64, 64),
+}
+slie_complevel = 4
+# value of pixels without data, as written by the original xarray based merge
+slie_fill = 111
+
 
 def extract_date_from_filename(geotiff):
-    """Extract datetime object from a GeoTIFF filename.
+    """Extract datetime object from a GeoTIFF filename. The date is taken from the catalog of the file's directory when it has been built, otherwise the name is parsed.
 
     Args:
-        geotiff (str): filename of the GeoTIFF
+        geotiff (str or pathlib.PosixPath): filename or path of the GeoTIFF
     Returns:
         date (pd.Timestamp): the date extracted from the filename
     """
     # file names will be like: beaufort_20230726_asip_slie.tif
-    date = re.search(r"(\d{4})(\d{2})(\d{2})", geotiff).groups()
-    date = datetime(int(date[0]), int(date[1]), int(date[2]))
-    return pd.to_datetime(date, format="%Y%m%d")
+    return pd.Timestamp(lookup_date(Path(geotiff)))
 
 
-def select_by_ice_year(geotiff_list, ice_year):
-    """Select GeoTIFFs by ice year. An ice year begins in October of one calendar year and ends in July of the following year.
+def select_by_ice_year(daily_geotiff_dir, ice_year):
+    """Select GeoTIFFs by ice year. An ice year begins in October of one calendar year and ends in July of the following year. The files are looked up in the date-sorted catalog of the directory, which is built once and reused for every ice year.
 
     Args:
-        geotiff_list (list): list of GeoTIFF filenames
+        daily_geotiff_dir (pathlib.PosixPath): directory of daily GeoTIFFs
         ice_year (str): the ice year to select data for, e.g., '2010-11'
     Returns:
-        selected_geotiffs (list): list of GeoTIFF filenames for specified ice year
+        selected_geotiffs (list): list of GeoTIFF paths for specified ice year, in date order
+        dates (list): list of pd.Timestamp dates of the selected GeoTIFFs
     """
-    start_year, _ = ice_year.split("-")
-    start_year = int(start_year)
-    end_year = start_year + 1
-    ice_year_start = datetime(start_year, 10, 1)  # October 1 of start_year
-    ice_year_end = datetime(end_year, 7, 31)  # July 31 of end_year
+    ice_year_start, ice_year_end = ice_year_bounds(ice_year)
+    catalog = get_catalog(daily_geotiff_dir)
+    selected_geotiffs, dates = select_range(catalog, ice_year_start, ice_year_end)
+    return selected_geotiffs, [pd.Timestamp(date) for date in dates]
+
 
-    selected_geotiffs = []
+def read_daily_slie(geotiff, window=None, encoding="int16"):
+    """Read a daily SLIE GeoTIFF, or a window of it, as an array of class values.
 
-    for geotiff in geotiff_list:
-        # geotiff name format like beaufort_20230726_asip_slie.tif
-        match = re.search(r"(\d{4})(\d{2})(\d{2})", geotiff.name)
-        if match:
-            year, month, day = map(int, match.groups())
-            file_date = datetime(year, month, day)
+    Args:
+        geotiff (pathlib.PosixPath): path to the GeoTIFF file
+        window (rasterio.windows.Window, optional): window to read. Defaults to None, the whole raster.
+        encoding (str): one of `encoding.slie_encodings`, the dtype of the array. Defaults to "int16".
+    Returns:
+        arr (numpy.ndarray): the raster with NaN pixels set to 111
+        grid (tuple): (height, width, transform) of the whole raster
+    """
+    with rasterio.open(geotiff) as src:
+        arr = src.read(1, window=window)
+        grid = (src.height, src.width, src.transform)
+    if np.issubdtype(arr.dtype, np.floating):
+        arr = np.where(np.isnan(arr), slie_fill, arr)
+    return encode_slie(arr, encoding), grid
 
-            if ice_year_start <= file_date <= ice_year_end:
-                selected_geotiffs.append(geotiff)
 
-    return selected_geotiffs
+def check_grid(geotiff, grid, expected_grid, template_geotiff):
+    """Raise a ValueError if a daily GeoTIFF is not on the (height, width) grid of the season."""
+    height, width, _ = grid
+    if (height, width) != expected_grid:
+        raise ValueError(
+            f"{geotiff} is {height} x {width}, expected {expected_grid[0]} x {expected_grid[1]} like {template_geotiff}"
+        )
 
 
-def load_geotiff_as_dataarray(geotiff):
-    """Load a GeoTIFF file as a DataArray using rioxarray.
+def create_season_netcdf(
+    output_nc_file,
+    template_geotiff,
+    time_units,
+    chunks,
+    encoding="int16",
+    landfast_mask=False,
+):
+    """Create an empty season NetCDF on the grid of a daily GeoTIFF, with an unlimited time dimension.
 
     Args:
-        geotiff (pathlib.PosixPath): path to the GeoTIFF file
+        output_nc_file (pathlib.PosixPath): NetCDF file to create
+        template_geotiff (pathlib.PosixPath): daily GeoTIFF with the grid and CRS of the season
+        time_units (str): CF units of the time coordinate, e.g. "days since 2010-10-01"
+        chunks (tuple): (time, y, x) chunk shape of the slie variable, clipped to the grid
+        encoding (str): one of `encoding.slie_encodings`, the dtype of the slie variable. Defaults to "int16".
+        landfast_mask (bool): also create the bit-packed "landfast_mask" variable. Defaults to False.
     Returns:
-        xr_da (xarray.DataArray): the GeoTIFF data as an xarray DataArray
+        ds (netCDF4.Dataset): the open NetCDF, with "time", "slie", and optionally "landfast_mask" variables of length zero
     """
-    xr_da = rioxarray.open_rasterio(
-        geotiff,
-        chunks={"x": 4096, "y": 4096},  # chunk size seems OK for t2small
-        lock=False,
+    with rasterio.open(template_geotiff) as src:
+        height, width, transform, crs = src.height, src.width, src.transform, src.crs
+
+    ds = netCDF4.Dataset(output_nc_file, "w", format="NETCDF4")
+    ds.createDimension("time", None)
+    ds.createDimension("y", height)
+    ds.createDimension("x", width)
+
+    # cell center coordinates, like rioxarray
+    x = ds.createVariable("x", "f8", ("x",))
+    x[:] = transform.c + (np.arange(width) + 0.5) * transform.a
+    x.setncatts({"axis": "X", "standard_name": "projection_x_coordinate", "units": "metre"})
+    y = ds.createVariable("y", "f8", ("y",))
+    y[:] = transform.f + (np.arange(height) + 0.5) * transform.e
+    y.setncatts({"axis": "Y", "standard_name": "projection_y_coordinate", "units": "metre"})
+
+    time_var = ds.createVariable("time", "i8", ("time",))
+    time_var.setncatts({"units": time_units, "calendar": "proleptic_gregorian"})
+
+    spatial_ref = ds.createVariable("spatial_ref", "i8")
+    spatial_ref.setncatts(
+        {
+            "crs_wkt": crs.to_wkt(),
+            "spatial_ref": crs.to_wkt(),
+            "GeoTransform": " ".join(str(v) for v in transform.to_gdal()),
+        }
     )
-    # drop the "band" dimension because these are all single band GeoTIFFs
-    # rioxarray adds a "band" dimension by default
-    xr_da = xr_da.squeeze(drop=True)
-    xr_da = xr_da.fillna(111).astype("int16")
-    return xr_da
 
+    chunksizes = (chunks[0], min(chunks[1], height), min(chunks[2], width))
+    slie = ds.createVariable(
+        "slie",
+        slie_encodings[encoding],
+        ("time", "y", "x"),
+        zlib=True,
+        complevel=slie_complevel,
+        shuffle=True,
+        chunksizes=chunksizes,
+        fill_value=False,
+    )
+    slie.setncatts({"grid_mapping": "spatial_ref", **flag_attrs(encoding)})
 
-def write_netcdf(dataset, output_nc_file):
-    encoding = {"slie": {"dtype": "int16"}}
-    dataset.to_netcdf(output_nc_file, encoding=encoding)
+    if landfast_mask:
+        # eight x pixels per byte, most significant bit first
+        ds.createDimension("x_packed", (width + 7) // 8)
+        mask = ds.createVariable(
+            "landfast_mask",
+            "u1",
+            ("time", "y", "x_packed"),
+            zlib=True,
+            complevel=slie_complevel,
+            shuffle=True,
+            chunksizes=(chunksizes[0], chunksizes[1], (chunksizes[2] + 7) // 8),
+            fill_value=False,
+        )
+        mask.setncatts(
+            {
+                "long_name": "landfast ice mask packed along x with numpy.packbits",
+                "bit_order": "big",
+                "unpacked_width": width,
+            }
+        )
+    ds.setncattr("crs", crs.to_string())
+    return ds
 
 
-if __name__ == "__main__":
-    cluster = SLURMCluster(
-        cores=24,
-        memory="128GB",
-        queue="t2small",
-        walltime="23:00:00",
-        log_directory=SCRATCH_DIR,
-        local_directory=SCRATCH_DIR,
-        account="cmip6",
-        interface="ib0",
+def write_frames(ds, geotiffs, dates, time_units, workers, prefetch, encoding):
+    """Append the daily GeoTIFFs to a season NetCDF one day at a time, reading at most `prefetch` rasters ahead."""
+    expected_grid = (len(ds.dimensions["y"]), len(ds.dimensions["x"]))
+    read = partial(read_daily_slie, encoding=encoding)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        to_read = iter(geotiffs)
+        for geotiff in islice(to_read, max(prefetch, 1)):
+            pending.append(executor.submit(read, geotiff))
+
+        for i, date in enumerate(dates):
+            arr, grid = pending.popleft().result()
+            # read the next raster before writing this one so reads overlap the compression
+            next_geotiff = next(to_read, None)
+            if next_geotiff is not None:
+                pending.append(executor.submit(read, next_geotiff))
+
+            check_grid(geotiffs[i], grid, expected_grid, geotiffs[0])
+            ds["slie"][i, :, :] = arr
+            if "landfast_mask" in ds.variables:
+                ds["landfast_mask"][i, :, :] = pack_landfast(arr)
+            ds["time"][i] = netCDF4.date2num(
+                date.to_pydatetime(), time_units, "proleptic_gregorian"
+            )
+
+
+def write_strips(ds, geotiffs, dates, time_units, workers, encoding):
+    """Write the daily GeoTIFFs to a season NetCDF in strips of chunk rows, reading each strip from every day with windowed reads."""
+    height, width = len(ds.dimensions["y"]), len(ds.dimensions["x"])
+    strip_rows = ds["slie"].chunking()[1]
+    ds["time"][: len(dates)] = netCDF4.date2num(
+        [date.to_pydatetime() for date in dates], time_units, "proleptic_gregorian"
     )
-    client = dd.Client(cluster)
-    print(client.dashboard_link)
-    cluster.scale(100)
-
-    for daily_geotiff_dir in [DAILY_BEAUFORT_DIR, DAILY_CHUKCHI_DIR]:
-        for ice_season in ice_years:
-            geotiff_files = list_geotiffs(daily_geotiff_dir)
-            ice_year_geotiffs = sorted(select_by_ice_year(geotiff_files, ice_season))
-            data_arrays = []
-            dates = []
-
-            for file in ice_year_geotiffs:
-                date = extract_date_from_filename(file.name)
-                dates.append(date)
-                # dask to load the data lazily
-                data_array = dask.delayed(load_geotiff_as_dataarray)(file)
-                data_arrays.append(data_array)
-
-            # compute and stack data arrays to xr dataset with time dim
-            data_arrays = dask.compute(*data_arrays)
-            dataset = xr.concat(data_arrays, dim="time").to_dataset(name="slie")
-            dataset["slie"] = dataset["slie"].astype("int16")
-
-            dataset = dataset.assign_coords(time=("time", dates))
-            dataset.attrs["crs"] = rasterio.open(geotiff_files[0]).crs.to_string()
-
-            if daily_geotiff_dir == DAILY_BEAUFORT_DIR:
-                nc_prefix = "beaufort"
-                nc_output_dir = BEAUFORT_NETCDF_DIR
-            else:
-                nc_prefix = "chukchi"
-                nc_output_dir = CHUKCHI_NETCDF_DIR
 
-            output_nc_file = (
-                nc_output_dir / f"{nc_prefix}_sea_daily_slie_{ice_season}.nc"
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for row_off in range(0, height, strip_rows):
+            window = Window(0, row_off, width, min(strip_rows, height - row_off))
+            strips = executor.map(lambda fp: read_daily_slie(fp, window, encoding), geotiffs)
+            season_strip = np.empty(
+                (len(geotiffs), window.height, width), dtype=slie_encodings[encoding]
             )
-            write_netcdf(dataset, output_nc_file)
+            for i, (arr, grid) in enumerate(strips):
+                check_grid(geotiffs[i], grid, (height, width), geotiffs[0])
+                season_strip[i] = arr
+            ds["slie"][:, row_off : row_off + window.height, :] = season_strip
+            if "landfast_mask" in ds.variables:
+                ds["landfast_mask"][:, row_off : row_off + window.height, :] = (
+                    pack_landfast(season_strip)
+                )
+
+
+def write_season_netcdf(
+    geotiffs,
+    dates,
+    output_nc_file,
+    workers=4,
+    prefetch=4,
+    layout="frame",
+    encoding="int16",
+    landfast_mask=False,
+):
+    """Write the daily GeoTIFFs of a season to a NetCDF with one of the chunk `layouts`.
+
+    Args:
+        geotiffs (list): daily GeoTIFF paths of the season, in date order
+        dates (list): pd.Timestamp date of each GeoTIFF
+        output_nc_file (pathlib.PosixPath): NetCDF file to write
+        workers (int): number of threads reading GeoTIFFs
+        prefetch (int): maximum number of rasters read ahead of the writer, for the "frame" layout
+        layout (str): "frame" to stream day by day with daily chunks, "timeseries" to write strips with whole-season chunks
+        encoding (str): "int16" or "uint8" class values
+        landfast_mask (bool): also write the bit-packed landfast ice mask
+    Returns:
+        None
+    """
+    chunks = layouts[layout]
+    if chunks[0] is None:
+        chunks = (len(dates),) + chunks[1:]
+    time_units = f"days since {dates[0]:%Y-%m-%d}"
+    ds = create_season_netcdf(
+        output_nc_file, geotiffs[0], time_units, chunks, encoding, landfast_mask
+    )
+    try:
+        if layout == "frame":
+            write_frames(ds, geotiffs, dates, time_units, workers, prefetch, encoding)
+        else:
+            write_strips(ds, geotiffs, dates, time_units, workers, encoding)
+    finally:
+        ds.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--zones",
+        nargs="+",
+        default=list(zone_dirs),
+        choices=list(zone_dirs),
+        help="ice zones to merge (default: all)",
+    )
+    parser.add_argument(
+        "--ice-years",
+        nargs="+",
+        default=ice_years,
+        choices=ice_years,
+        help="ice years to merge, e.g. 2010-11 (default: all)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="number of threads reading GeoTIFFs (default: 4)"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=4,
+        help="maximum number of rasters held in memory ahead of the writer (default: 4)",
+    )
+    parser.add_argument(
+        "--layout",
+        default="frame",
+        choices=list(layouts),
+        help="chunk layout of the slie variable, frame for daily maps or timeseries for pixel histories (default: frame)",
+    )
+    parser.add_argument(
+        "--encoding",
+        default="int16",
+        choices=list(slie_encodings),
+        help="dtype of the stored classes, uint8 halves the in-memory strips, files shrink only a little (default: int16)",
+    )
+    parser.add_argument(
+        "--landfast-mask",
+        action="store_true",
+        help="also store a bit-packed landfast ice mask",
+    )
+    parser.add_argument(
+        "--out-suffix",
+        default="",
+        help="suffix added to the output file names, e.g. _timeseries to keep both layouts (default: none)",
+    )
+    return parser.parse_args()
+
 
-            print(f"NetCDF successfully written to {output_nc_file}")
+if __name__ == "__main__":
+    args = parse_args()
 
-    time.sleep(10)
-    client.close()
-    cluster.scale(0)
-    cluster.close()
+    for zone in args.zones:
+        daily_geotiff_dir, nc_output_dir = zone_dirs[zone]
+        for ice_season in args.ice_years:
+            tic = time.perf_counter()
+            ice_year_geotiffs, dates = select_by_ice_year(daily_geotiff_dir, ice_season)
+            if not ice_year_geotiffs:
+                print(f"No {zone} GeoTIFFs found for {ice_season}, skipping")
+                continue
+
+            output_nc_file = (
+                nc_output_dir
+                / f"{zone}_sea_daily_slie_{ice_season}{args.out_suffix}.nc"
+            )
+            write_season_netcdf(
+                ice_year_geotiffs,
+                dates,
+                output_nc_file,
+                args.workers,
+                args.prefetch,
+                args.layout,
+                args.encoding,
+                args.landfast_mask,
+            )
+
+            print(
+                f"NetCDF successfully written to {output_nc_file} ({len(dates)} days in {time.perf_counter() - tic:.1f}s)"
+            )
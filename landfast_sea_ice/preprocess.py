@@ -6,10 +6,11 @@ from rasterio.transform import array_bounds
 
 from luts import data_sources
 from config import CHUKCHI_DIR, BEAUFORT_DIR, DAILY_CHUKCHI_DIR, DAILY_BEAUFORT_DIR
+from grids import grids
 
 # set target resolution and crs globally for all outputs
-tr = 100
-dst_crs = rio.crs.CRS.from_epsg(3338)
+tr = grids["landfast_100m"]["resolution"]
+dst_crs = rio.crs.CRS.from_string(grids["landfast_100m"]["crs"])
 
 
 def mmm_rename(fp):
@@ -0,0 +1,242 @@
+"""Query the daily landfast ice class history of points or a bounding box across the season NetCDFs written by `merge.py`.
+
+Only the hyperslabs covering the requested pixels are read from each season, so with the "timeseries" chunk layout a point history reads one chunk per season instead of every daily frame. Points are grouped by the chunk they fall in and each group is read as one hyperslab, so nearby points share their chunk reads with either layout.
+
+`landfast_day_counts` counts the landfast ice days of every pixel of a season from the bit-packed landfast ice mask, reading an eighth of the bytes of the class stack.
+
+Example usage:
+    python query.py /path/to/Beaufort_NetCDFs --points points.csv --out point_history.csv
+    python query.py /path/to/Beaufort_NetCDFs --bbox -200000 2150000 -190000 2160000 --out bbox_history.nc
+"""
+
+import argparse
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+from pyproj import Transformer
+
+from encoding import unpack_landfast
+
+
+def read_grid(ds):
+    """Get the coordinates, resolution, and chunk shape of a season NetCDF.
+
+    Args:
+        ds (netCDF4.Dataset): open season NetCDF
+    Returns:
+        grid (dict): "x" and "y" cell center coordinates, "res" (x, y) cell size, "chunks" (time, y, x) chunk shape of slie, and "crs"
+    """
+    x = np.asarray(ds["x"][:])
+    y = np.asarray(ds["y"][:])
+    chunking = ds["slie"].chunking()
+    if chunking == "contiguous":
+        chunking = list(ds["slie"].shape)
+    return {
+        "x": x,
+        "y": y,
+        "res": (x[1] - x[0], y[1] - y[0]),
+        "chunks": chunking,
+        "crs": ds.getncattr("crs"),
+    }
+
+
+def xy_to_rowcol(grid, xs, ys):
+    """Find the rows and columns of projected coordinates on a season grid.
+
+    Args:
+        grid (dict): grid from `read_grid`
+        xs (numpy.ndarray): x coordinates
+        ys (numpy.ndarray): y coordinates
+    Returns:
+        rows (numpy.ndarray): row of each point
+        cols (numpy.ndarray): column of each point
+        inside (numpy.ndarray): boolean mask of the points that fall on the grid
+    """
+    cols = np.round((np.asarray(xs) - grid["x"][0]) / grid["res"][0]).astype(np.int64)
+    rows = np.round((np.asarray(ys) - grid["y"][0]) / grid["res"][1]).astype(np.int64)
+    inside = (rows >= 0) & (rows < len(grid["y"])) & (cols >= 0) & (cols < len(grid["x"]))
+    return rows, cols, inside
+
+
+def read_time(ds):
+    """Read the decoded time coordinate of a season NetCDF."""
+    time_var = ds["time"]
+    return pd.to_datetime(
+        netCDF4.num2date(
+            time_var[:],
+            time_var.units,
+            time_var.calendar,
+            only_use_cftime_datetimes=False,
+            only_use_python_datetimes=True,
+        )
+    )
+
+
+def read_point_histories(ds, grid, rows, cols):
+    """Read the full season history of some pixels, one hyperslab per chunk tile holding pixels.
+
+    Args:
+        ds (netCDF4.Dataset): open season NetCDF
+        grid (dict): grid from `read_grid`
+        rows (numpy.ndarray): rows of the pixels, all on the grid
+        cols (numpy.ndarray): columns of the pixels, all on the grid
+    Returns:
+        numpy.ndarray: (time, pixel) array of classes
+    """
+    _, chunk_y, chunk_x = grid["chunks"]
+    histories = np.empty((len(ds.dimensions["time"]), len(rows)), dtype=ds["slie"].dtype)
+    tiles = pd.DataFrame({"tile_row": rows // chunk_y, "tile_col": cols // chunk_x})
+    for _, idx in tiles.groupby(["tile_row", "tile_col"]).indices.items():
+        row_off, col_off = rows[idx].min(), cols[idx].min()
+        block = ds["slie"][:, row_off : rows[idx].max() + 1, col_off : cols[idx].max() + 1]
+        histories[:, idx] = np.asarray(block)[:, rows[idx] - row_off, cols[idx] - col_off]
+    return histories
+
+
+def query_points(nc_files, points, lat_col="latitude", lon_col="longitude"):
+    """Get the daily class history of points across seasons.
+
+    Args:
+        nc_files (list): season NetCDFs of one ice zone
+        points (pandas.DataFrame): point locations, the index identifies each location
+        lat_col (str): name of the latitude column of `points`
+        lon_col (str): name of the longitude column of `points`
+    Returns:
+        pandas.DataFrame: tidy table with "location", "time", and "slie" columns, in time order. Points off a season's grid are left out of that season.
+    """
+    lats = points[lat_col].to_numpy(dtype=np.float64)
+    lons = points[lon_col].to_numpy(dtype=np.float64)
+    locations = points.index.to_numpy()
+
+    tables = []
+    for fp in nc_files:
+        with netCDF4.Dataset(fp) as ds:
+            ds.set_auto_maskandscale(False)
+            grid = read_grid(ds)
+            transformer = Transformer.from_crs("EPSG:4326", grid["crs"], always_xy=True)
+            xs, ys = transformer.transform(lons, lats)
+            rows, cols, inside = xy_to_rowcol(grid, xs, ys)
+            if not inside.any():
+                continue
+            histories = read_point_histories(ds, grid, rows[inside], cols[inside])
+            time = read_time(ds)
+
+        tables.append(
+            pd.DataFrame(
+                {
+                    "location": np.tile(locations[inside], len(time)),
+                    "time": np.repeat(time.to_numpy(), inside.sum()),
+                    "slie": histories.ravel(),
+                }
+            )
+        )
+
+    if not tables:
+        return pd.DataFrame(columns=["location", "time", "slie"])
+    return pd.concat(tables, ignore_index=True).sort_values(
+        ["time", "location"], ignore_index=True, kind="stable"
+    )
+
+
+def query_bbox(nc_files, bbox):
+    """Get the daily class history of the pixels in a bounding box across seasons.
+
+    Args:
+        nc_files (list): season NetCDFs of one ice zone
+        bbox (tuple): (xmin, ymin, xmax, ymax) in the projected CRS of the files (EPSG:3338)
+    Returns:
+        xarray.DataArray: (time, y, x) classes of the pixels whose centers are in the box, seasons concatenated in time order
+    """
+    xmin, ymin, xmax, ymax = bbox
+    seasons = []
+    for fp in nc_files:
+        with netCDF4.Dataset(fp) as ds:
+            ds.set_auto_maskandscale(False)
+            grid = read_grid(ds)
+            x_idx = np.flatnonzero((grid["x"] >= xmin) & (grid["x"] <= xmax))
+            y_idx = np.flatnonzero((grid["y"] >= ymin) & (grid["y"] <= ymax))
+            if len(x_idx) == 0 or len(y_idx) == 0:
+                continue
+            y_slice = slice(y_idx.min(), y_idx.max() + 1)
+            x_slice = slice(x_idx.min(), x_idx.max() + 1)
+            seasons.append(
+                xr.DataArray(
+                    np.asarray(ds["slie"][:, y_slice, x_slice]),
+                    dims=("time", "y", "x"),
+                    coords={
+                        "time": read_time(ds),
+                        "y": grid["y"][y_slice],
+                        "x": grid["x"][x_slice],
+                    },
+                    name="slie",
+                )
+            )
+
+    if not seasons:
+        raise ValueError(f"No pixels of the files are in the bounding box {bbox}")
+    return xr.concat(seasons, dim="time").sortby("time")
+
+
+def landfast_day_counts(nc_file, days_per_read=32):
+    """Count the landfast ice days of every pixel of a season from its bit-packed "landfast_mask" (see `merge.py --landfast-mask`).
+
+    Args:
+        nc_file (pathlib.Path): season NetCDF with a "landfast_mask" variable
+        days_per_read (int): number of days of the mask read at once
+    Returns:
+        xarray.DataArray: (y, x) number of days each pixel was landfast ice
+    """
+    with netCDF4.Dataset(nc_file) as ds:
+        ds.set_auto_maskandscale(False)
+        grid = read_grid(ds)
+        mask = ds["landfast_mask"]
+        width = len(grid["x"])
+        counts = np.zeros((len(grid["y"]), width), dtype="int32")
+        for start in range(0, mask.shape[0], days_per_read):
+            packed = np.asarray(mask[start : start + days_per_read])
+            counts += unpack_landfast(packed, width).sum(axis=0, dtype="int32")
+
+    return xr.DataArray(
+        counts,
+        dims=("y", "x"),
+        coords={"y": grid["y"], "x": grid["x"]},
+        name="landfast_days",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("nc_dir", type=Path, help="directory of the season NetCDFs of one ice zone")
+    parser.add_argument(
+        "--glob",
+        default="*_sea_daily_slie_*.nc",
+        help="pattern of the season NetCDFs in nc_dir (default: *_sea_daily_slie_*.nc)",
+    )
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument(
+        "--points",
+        type=Path,
+        help="CSV of point locations with id, latitude, and longitude columns",
+    )
+    query.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        metavar=("XMIN", "YMIN", "XMAX", "YMAX"),
+        help="bounding box in EPSG:3338",
+    )
+    parser.add_argument("--out", type=Path, required=True, help="output CSV for points, NetCDF for a bounding box")
+    args = parser.parse_args()
+
+    nc_files = sorted(args.nc_dir.glob(args.glob))
+    if args.points is not None:
+        history = query_points(nc_files, pd.read_csv(args.points).set_index("id"))
+        history.to_csv(args.out, index=False)
+        print(f"{len(history)} point days from {len(nc_files)} files written to {args.out}")
+    else:
+        history = query_bbox(nc_files, args.bbox)
+        history.to_netcdf(args.out)
+        print(f"{history.sizes['time']} days of a {history.sizes['y']} x {history.sizes['x']} box written to {args.out}")
@@ -0,0 +1,288 @@
+"""Compute per-pixel landfast ice season metrics from the daily SLIE NetCDFs written by `merge.py`.
+
+For every pixel of a zone and ice year:
+- landfast_days: number of days classed as landfast ice
+- first_landfast_day / last_landfast_day: first and last landfast ice day, as days since October 1 of the ice year (-1 if never landfast)
+- longest_landfast_run: longest run of consecutive landfast ice days. A missing date or any other class ends a run.
+- no_data_days: number of days classed as no data
+
+The season stack is streamed in strips of rows sized to fit `--memory-budget`, aligned to the chunk rows of the NetCDF when the budget allows, so each chunk is decompressed once. Each strip is read whole and the metrics are accumulated in one pass over its days with vectorized updates, then written to the outputs before the next strip is read, so neither the stack nor the metric grids are ever held in full. Outputs are one EPSG:3338 GeoTIFF per metric, or one NetCDF with all metrics, per zone and ice year.
+
+Example usage:
+    python season_metrics.py --zones beaufort chukchi --ice-years 2010-11 --format geotiff --memory-budget 4GB
+"""
+
+import argparse
+import time
+from datetime import datetime
+
+import netCDF4
+import numpy as np
+import rasterio
+from affine import Affine
+from dask.utils import parse_bytes, format_bytes
+from rasterio.windows import Window
+
+from config import SEASON_METRICS_DIR
+from luts import ice_years, pixel_values
+from merge import zone_dirs
+from query import read_grid, read_time
+from encoding import landfast_value
+
+metrics = {
+    "landfast_days": "number of landfast ice days",
+    "first_landfast_day": "first landfast ice day",
+    "last_landfast_day": "last landfast ice day",
+    "longest_landfast_run": "longest run of consecutive landfast ice days",
+    "no_data_days": "number of no data days",
+}
+metric_nodata = -1
+no_data_value = next(k for k, v in pixel_values.items() if v == "No Data")
+
+# bytes per pixel of the metric accumulators and the temporary masks of a daily update
+accumulator_bytes = 2 * (len(metrics) + 1) + 4
+
+
+def season_start(times):
+    """Get October 1 of the ice year of a season's time coordinate."""
+    first = times[0]
+    year = first.year if first.month >= 10 else first.year - 1
+    return datetime(year, 10, 1)
+
+
+def strip_rows_for_budget(n_days, width, itemsize, chunk_rows, memory_budget):
+    """Get the number of rows per strip that fits a memory budget.
+
+    Args:
+        n_days (int): number of days of the season
+        width (int): number of pixels per row
+        itemsize (int): bytes per stored class value
+        chunk_rows (int): rows per chunk of the slie variable
+        memory_budget (int): memory budget in bytes
+
+    Returns:
+        int: rows per strip, a multiple of `chunk_rows` when at least one chunk row fits
+    """
+    row_bytes = width * (n_days * itemsize + accumulator_bytes)
+    rows = max(memory_budget // row_bytes, 1)
+    if rows >= chunk_rows:
+        rows = rows // chunk_rows * chunk_rows
+    return int(rows)
+
+
+def compute_strip_metrics(stack, day_index):
+    """Compute the season metrics of a strip in one pass over its days.
+
+    Args:
+        stack (numpy.ndarray): (time, rows, x) SLIE classes of the strip
+        day_index (numpy.ndarray): day of each time step, as days since the start of the ice year
+
+    Returns:
+        dict: int16 (rows, x) array of each metric
+    """
+    shape = stack.shape[1:]
+    landfast_days = np.zeros(shape, dtype="int16")
+    first = np.full(shape, metric_nodata, dtype="int16")
+    last = np.full(shape, metric_nodata, dtype="int16")
+    run = np.zeros(shape, dtype="int16")
+    longest = np.zeros(shape, dtype="int16")
+    no_data_days = np.zeros(shape, dtype="int16")
+
+    for i, day in enumerate(day_index):
+        is_landfast = stack[i] == landfast_value
+        if i > 0 and day - day_index[i - 1] > 1:
+            # a missing date ends every run
+            run[:] = 0
+        landfast_days += is_landfast
+        first[(first == metric_nodata) & is_landfast] = day
+        last[is_landfast] = day
+        run += 1
+        run *= is_landfast
+        np.maximum(longest, run, out=longest)
+        no_data_days += stack[i] == no_data_value
+
+    return {
+        "landfast_days": landfast_days,
+        "first_landfast_day": first,
+        "last_landfast_day": last,
+        "longest_landfast_run": longest,
+        "no_data_days": no_data_days,
+    }
+
+
+def grid_transform(grid):
+    """Get the north-up transform of a season grid from its cell center coordinates."""
+    res_x, res_y = grid["res"]
+    return Affine(res_x, 0.0, grid["x"][0] - res_x / 2, 0.0, res_y, grid["y"][0] - res_y / 2)
+
+
+def open_geotiff_outputs(out_prefix, grid):
+    """Open one GeoTIFF per metric for writing.
+
+    Args:
+        out_prefix (pathlib.Path): output path prefix, the metric name and .tif are appended
+        grid (dict): grid from `query.read_grid`
+
+    Returns:
+        dict: open rasterio datasets keyed by metric
+    """
+    profile = {
+        "driver": "GTiff",
+        "height": len(grid["y"]),
+        "width": len(grid["x"]),
+        "count": 1,
+        "dtype": "int16",
+        "nodata": metric_nodata,
+        "crs": grid["crs"],
+        "transform": grid_transform(grid),
+        "compress": "lzw",
+    }
+    outputs = {}
+    for metric, description in metrics.items():
+        dst = rasterio.open(f"{out_prefix}_{metric}.tif", "w", **profile)
+        dst.set_band_description(1, description)
+        outputs[metric] = dst
+    return outputs
+
+
+def open_netcdf_output(out_fp, src_ds, grid, start):
+    """Create a NetCDF with a (y, x) variable per metric on the grid of a season NetCDF.
+
+    Args:
+        out_fp (pathlib.Path): NetCDF file to create
+        src_ds (netCDF4.Dataset): open season NetCDF, its coordinates and grid mapping are copied
+        grid (dict): grid from `query.read_grid`
+        start (datetime.datetime): start of the ice year
+
+    Returns:
+        netCDF4.Dataset: the open NetCDF
+    """
+    ds = netCDF4.Dataset(out_fp, "w", format="NETCDF4")
+    for dim in ["y", "x"]:
+        ds.createDimension(dim, len(grid[dim]))
+        coord = ds.createVariable(dim, "f8", (dim,))
+        coord[:] = grid[dim]
+        coord.setncatts({k: src_ds[dim].getncattr(k) for k in src_ds[dim].ncattrs()})
+    spatial_ref = ds.createVariable("spatial_ref", "i8")
+    spatial_ref.setncatts(
+        {k: src_ds["spatial_ref"].getncattr(k) for k in src_ds["spatial_ref"].ncattrs()}
+    )
+
+    chunksizes = (min(256, len(grid["y"])), min(256, len(grid["x"])))
+    for metric, description in metrics.items():
+        var = ds.createVariable(
+            metric,
+            "i2",
+            ("y", "x"),
+            zlib=True,
+            shuffle=True,
+            chunksizes=chunksizes,
+            fill_value=metric_nodata,
+        )
+        units = f"days since {start:%Y-%m-%d}" if metric.endswith("_day") else "days"
+        var.setncatts({"long_name": description, "units": units, "grid_mapping": "spatial_ref"})
+    ds.setncattr("crs", grid["crs"])
+    return ds
+
+
+def compute_season_metrics(
+    nc_file, out_prefix, out_format="geotiff", memory_budget=parse_bytes("2GB")
+):
+    """Compute the season metrics of one zone and ice year, streaming the daily stack in strips.
+
+    Args:
+        nc_file (pathlib.Path): season NetCDF from `merge.py`
+        out_prefix (pathlib.Path): output path prefix, e.g. SEASON_METRICS_DIR / "beaufort_sea_2010-11"
+        out_format (str): "geotiff" for one GeoTIFF per metric, "netcdf" for one NetCDF
+        memory_budget (int): memory budget of a strip and its accumulators, in bytes
+
+    Returns:
+        int: rows per strip used
+    """
+    with netCDF4.Dataset(nc_file) as src_ds:
+        src_ds.set_auto_maskandscale(False)
+        grid = read_grid(src_ds)
+        times = read_time(src_ds)
+        start = season_start(times)
+        day_index = np.asarray((times - start).days)
+        slie = src_ds["slie"]
+        height, width = len(grid["y"]), len(grid["x"])
+        rows = strip_rows_for_budget(
+            len(times), width, slie.dtype.itemsize, grid["chunks"][1], memory_budget
+        )
+
+        if out_format == "geotiff":
+            outputs = open_geotiff_outputs(out_prefix, grid)
+        else:
+            out_ds = open_netcdf_output(f"{out_prefix}.nc", src_ds, grid, start)
+        try:
+            for row_off in range(0, height, rows):
+                row_end = min(row_off + rows, height)
+                strip_metrics = compute_strip_metrics(np.asarray(slie[:, row_off:row_end, :]), day_index)
+                for metric, arr in strip_metrics.items():
+                    if out_format == "geotiff":
+                        outputs[metric].write(arr, 1, window=Window(0, row_off, width, row_end - row_off))
+                    else:
+                        out_ds[metric][row_off:row_end, :] = arr
+        finally:
+            if out_format == "geotiff":
+                for dst in outputs.values():
+                    dst.close()
+            else:
+                out_ds.close()
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--zones",
+        nargs="+",
+        default=list(zone_dirs),
+        choices=list(zone_dirs),
+        help="ice zones to summarize (default: all)",
+    )
+    parser.add_argument(
+        "--ice-years",
+        nargs="+",
+        default=ice_years,
+        choices=ice_years,
+        help="ice years to summarize, e.g. 2010-11 (default: all)",
+    )
+    parser.add_argument(
+        "--format",
+        default="geotiff",
+        choices=["geotiff", "netcdf"],
+        help="one GeoTIFF per metric or one NetCDF with all metrics (default: geotiff)",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        default="2GB",
+        help="memory budget of a strip of the daily stack and its metrics (default: 2GB)",
+    )
+    parser.add_argument(
+        "--in-suffix",
+        default="",
+        help="suffix of the season NetCDF names, e.g. _timeseries (default: none)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    memory_budget = parse_bytes(args.memory_budget)
+
+    for zone in args.zones:
+        _, nc_dir = zone_dirs[zone]
+        for ice_season in args.ice_years:
+            nc_file = nc_dir / f"{zone}_sea_daily_slie_{ice_season}{args.in_suffix}.nc"
+            if not nc_file.exists():
+                print(f"{nc_file} not found, skipping")
+                continue
+
+            tic = time.perf_counter()
+            out_prefix = SEASON_METRICS_DIR / f"{zone}_sea_{ice_season}"
+            rows = compute_season_metrics(nc_file, out_prefix, args.format, memory_budget)
+            print(
+                f"{zone} {ice_season} season metrics written to {out_prefix}* in {time.perf_counter() - tic:.1f}s ({rows} rows per strip, {format_bytes(memory_budget)} budget)"
+            )
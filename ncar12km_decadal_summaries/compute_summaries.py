@@ -1,16 +1,26 @@
 """Module for loading, projecting, slicing, and summarizing climate data into GeoTIFFs from a set of netCDF files."""
 
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import dask
+import dask.array as da
+import netCDF4
 import xarray as xr
 import rasterio as rio
 import numpy as np
-from pyproj import Proj, Transformer, CRS
 from pathlib import Path
-from wrf import PolarStereographic
 from config import models, scenarios, variable_di, precision_di, months, unit_di, summary_di, mo_names
 from config import DATA_DIR, OUTPUT_DIR
+import grids
+import instrument
+from netcdf_index import get_index
 
+# netCDF4 / HDF5 is not thread safe, so reads of the source files by dask threads take turns
+netcdf_read_lock = threading.Lock()
 
+
+@instrument.traced("load")
 def mfload_all_netcdf_data(paths):
     """
     Load and combine all netCDF files specified in `paths` into a single xarray DataArray.
@@ -23,8 +33,65 @@ def mfload_all_netcdf_data(paths):
     """
     with xr.open_mfdataset(paths, combine="nested", concat_dim=["time"]) as datacube:
         return datacube
-    
 
+
+def read_netcdf_variable(path, name):
+    """Read the raw (not masked or scaled) values of a variable from a netCDF file. Traced as a "read_netcdf" stage once the lock is held."""
+    with netcdf_read_lock:
+        with instrument.stage("read_netcdf", file=Path(path).name, variable=name):
+            with netCDF4.Dataset(path) as ds:
+                var = ds.variables[name]
+                var.set_auto_maskandscale(False)
+                return var[:]
+
+
+@instrument.traced("load")
+def load_indexed_datacube(paths):
+    """
+    Lazily assemble the same datacube as `mfload_all_netcdf_data` from the header index of the files (see `netcdf_index.py`), without opening every file. Each variable with a time dimension becomes one dask chunk per file along time, and variables without one (e.g., latitude and longitude of the met files) are read from the first file. The index is built or updated first if the files changed since it was written.
+
+    The traced "load" stage only covers indexing and building the dask graph. The chunks are read when the summaries are computed, each as a "read_netcdf" stage carrying the tags of the stages open here.
+
+    Args:
+        paths (list): A list of PosixPath pathlib objects pointing to the yearly netCDF files of one model, scenario, and variable group, in time order.
+
+    Returns:
+        datacube (xarray.Dataset): A single, combined, lazy xarray Dataset of all data from the netCDF files, decoded like `xr.open_dataset` does.
+    """
+    files = get_index(paths)["files"]
+    time = np.concatenate([np.array(entry["time"], dtype=np.int64) for entry in files])
+
+    # dask reads the chunks on its own threads, which do not see the stages open in this one
+    read_netcdf = instrument.with_current_tags(read_netcdf_variable)
+    data_vars = {}
+    for name, meta in files[0]["variables"].items():
+        dtype = np.dtype(meta["dtype"])
+        if "time" in meta["dims"]:
+            data = da.concatenate(
+                [
+                    da.from_delayed(
+                        dask.delayed(read_netcdf)(entry["path"], name),
+                        shape=tuple(entry["variables"][name]["shape"]),
+                        dtype=dtype,
+                    )
+                    for entry in files
+                ],
+                axis=meta["dims"].index("time"),
+            )
+        else:
+            data = read_netcdf_variable(files[0]["path"], name)
+        data_vars[name] = xr.Variable(meta["dims"], data, meta["attrs"])
+
+    raw = xr.Dataset(
+        data_vars,
+        coords={"time": ("time", time.astype("datetime64[ns]"))},
+        attrs=files[0]["attrs"],
+    )
+    return xr.decode_cf(raw)
+
+
+
+@instrument.traced()
 def project_datacube(datacube):
     """
     Projects an xarray datacube to a polar stereographic grid with a 12 km resolution.
@@ -42,54 +109,17 @@ def project_datacube(datacube):
         A dictionary containing parameters for the output raster such as the transform and the
         dimensions of the raster. This will be used to write summarized slices of the projected datacube to a GeoTIFF file.
     """
-    wrf_proj_str = PolarStereographic(**{"TRUELAT1": 64, "STAND_LON": -150}).proj4()
-    wrf_proj = Proj(wrf_proj_str)
-    wgs_proj = Proj(proj='latlong', datum='WGS84')
-    
-    transformer = Transformer.from_proj(wgs_proj, wrf_proj)
-    e, n = transformer.transform(-150, 64)
-    # Grid parameters
-    dx, dy = 12000, 12000
-    
     try:
         ny, nx = datacube.longitude.shape[1:]
     except:
         ny, nx = datacube.longitude.shape # met case has a little different structure
-    
-    # Down left corner of the domain
-    x0 = -(nx-1) / 2. * dx + e
-    y0 = -(ny-1) / 2. * dy + n
-    # 2d grid
-    x = np.arange(nx) * dx + x0
-    y = np.arange(ny) * dy + y0
-    
-    projected_datacube = datacube.assign_coords({"y": ("y", y), "x": ("x", x)})
-    
-    # Output geotiff creation profile params  
-    width = datacube.x.shape[0]
-    height = datacube.y.shape[0]
-    
-    # west and north
-    west = x0 - dx / 2
-    north = y[-1] + dy / 2
-    out_transform = rio.transform.from_origin(west, north, dx, dy)
-    
-    wrf_raster_profile = {
-        "driver": "GTiff",
-        "crs": CRS.from_proj4(wrf_proj_str),
-        "transform": out_transform,
-        "width": width,
-        "height": height,
-        "count": 1,
-        "dtype": np.float32,
-        "nodata": -9999,
-        "tiled": False,
-        "compress": "lzw",
-        "interleave": "band",
-    }
-    
+
+    grid = grids.wrf_grid(ny, nx)
+    projected_datacube = datacube.assign_coords({"y": ("y", grid["y"]), "x": ("x", grid["x"])})
+    wrf_raster_profile = grids.wrf_raster_profile(ny, nx)
+
     datacube.close()
-    
+
     return projected_datacube, wrf_raster_profile
 
 
@@ -124,7 +154,173 @@ def slice_by_decade(datacube, decade_start_year):
     return decade_slice
 
 
-def compute_monthly_summaries(decade_slice, vargroup, climvar):
+# named reductions supported by `grouped_reduce`
+reductions = ["sum", "mean", "max", "min", "count"]
+
+
+def sum_segments(data, group_starts, dtype):
+    """
+    Sum consecutive segments of a numpy array along the first axis. Row k of every segment is added at once, so there is one vectorized add per time step of the longest segment (31 for months). Rows are added in order, which gives bit for bit the same result as `np.sum(segment, axis=0)` (`np.add.reduceat` does not).
+
+    Args:
+        data (numpy.ndarray): array with time as the first axis
+        group_starts (numpy.ndarray): sorted indices along the first axis where each group starts, the first must be 0
+        dtype (numpy.dtype): accumulator and output dtype
+
+    Returns:
+        numpy.ndarray: array with one sum per group along the first axis
+    """
+    lengths = np.diff(np.append(group_starts, data.shape[0]))
+    sums = data[group_starts].astype(dtype)
+    for k in range(1, lengths.max()):
+        in_group = lengths > k
+        sums[in_group] += data[group_starts[in_group] + k]
+    return sums
+
+
+def reduce_segments(data, group_starts, reduction, skipna=False):
+    """
+    Reduce consecutive segments (groups) of a numpy array along the first (time) axis with vectorized operations over all segments at once.
+
+    NaN handling is explicit. With `skipna=False` a NaN anywhere in a group makes the result NaN, exactly like `np.sum`, `np.mean`, or `np.max` over the group. With `skipna=True` NaNs are ignored, and groups with no valid values are NaN (not 0 like `np.nansum`). "count" is always the number of non-NaN values.
+
+    Args:
+        data (numpy.ndarray): array with time as the first axis
+        group_starts (numpy.ndarray): sorted indices along the first axis where each group starts, the first must be 0
+        reduction (str): one of `reductions`
+        skipna (bool): ignore NaN values
+
+    Returns:
+        numpy.ndarray: array with one entry per group along the first axis
+    """
+    if reduction not in reductions:
+        raise ValueError(f"Unknown reduction {reduction}, expected one of {reductions}")
+
+    valid = ~np.isnan(data)
+    if reduction == "count":
+        return sum_segments(valid, group_starts, np.int32)
+
+    # shape the group lengths / counts to broadcast against the reduced array
+    bcast = (-1,) + (1,) * (data.ndim - 1)
+    out_dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+
+    if not skipna:
+        if reduction == "max":
+            return np.maximum.reduceat(data, group_starts, axis=0)
+        if reduction == "min":
+            return np.minimum.reduceat(data, group_starts, axis=0)
+        sums = sum_segments(data, group_starts, out_dtype)
+        if reduction == "sum":
+            return sums
+        lengths = np.diff(np.append(group_starts, data.shape[0])).astype(out_dtype)
+        return sums / lengths.reshape(bcast)
+
+    if reduction == "max":
+        return np.fmax.reduceat(data, group_starts, axis=0)
+    if reduction == "min":
+        return np.fmin.reduceat(data, group_starts, axis=0)
+    counts = sum_segments(valid, group_starts, np.int32)
+    sums = sum_segments(np.where(valid, data, 0), group_starts, out_dtype)
+    if reduction == "mean":
+        sums /= np.maximum(counts, 1)
+    sums[counts == 0] = np.nan
+    return sums
+
+
+def align_chunks_to_groups(chunks, group_starts, length):
+    """
+    Move the chunk boundaries of a dask array along time to the nearest following group start, so that no group is split across chunks.
+
+    Args:
+        chunks (tuple): chunk sizes along time
+        group_starts (numpy.ndarray): sorted indices where each group starts
+        length (int): length of the time axis
+
+    Returns:
+        tuple: new chunk sizes along time
+    """
+    bounds = np.cumsum(chunks)[:-1]
+    idx = np.searchsorted(group_starts, bounds)
+    aligned = np.unique(group_starts[idx[idx < len(group_starts)]])
+    aligned = aligned[aligned > 0]
+    edges = np.concatenate([[0], aligned, [length]])
+    return tuple(np.diff(edges).tolist())
+
+
+def grouped_reduce(data, group_starts, reduction, skipna=False):
+    """
+    Chunk-aware grouped reduction over the first (time) axis of a numpy or dask array. Dask arrays are rechunked along time so chunk boundaries fall on group starts (chunks keep roughly their size, e.g. one file per chunk), then each chunk is reduced with `reduce_segments`. Chunks along the other axes are untouched.
+
+    Args:
+        data (numpy.ndarray or dask.array.Array): array with time as the first axis
+        group_starts (numpy.ndarray): sorted indices along the first axis where each group starts, the first must be 0
+        reduction (str): one of `reductions`
+        skipna (bool): ignore NaN values, see `reduce_segments`
+
+    Returns:
+        numpy.ndarray or dask.array.Array: array with one entry per group along the first axis
+    """
+    group_starts = np.asarray(group_starts)
+    if not isinstance(data, da.Array):
+        return reduce_segments(data, group_starts, reduction, skipna)
+
+    time_chunks = align_chunks_to_groups(data.chunks[0], group_starts, data.shape[0])
+    data = data.rechunk({0: time_chunks})
+
+    chunk_starts = np.concatenate([[0], np.cumsum(time_chunks)[:-1]])
+    groups_per_chunk = np.diff(
+        np.append(np.searchsorted(group_starts, chunk_starts), len(group_starts))
+    )
+
+    def reduce_block(block, block_info=None):
+        start, stop = block_info[0]["array-location"][0]
+        in_block = group_starts[(group_starts >= start) & (group_starts < stop)]
+        return reduce_segments(block, in_block - start, reduction, skipna)
+
+    if reduction == "count":
+        out_dtype = np.int32
+    elif reduction in ("max", "min"):
+        out_dtype = data.dtype
+    else:
+        out_dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+    return data.map_blocks(
+        reduce_block,
+        chunks=(tuple(groups_per_chunk.tolist()),) + data.chunks[1:],
+        dtype=out_dtype,
+    )
+
+
+def monthly_reduce(dataarray, reduction, skipna=False):
+    """
+    Reduce a daily time series to monthly values with `grouped_reduce`. Drop-in replacement for `.resample(time="1M").reduce(func)`, the output time coordinate holds the same month end labels. Months with no time steps at all are left out rather than filled with NaN.
+
+    Args:
+        dataarray (xr.DataArray): daily data with time as the first dimension, sorted by time
+        reduction (str): one of `reductions`
+        skipna (bool): ignore NaN values, see `reduce_segments`
+
+    Returns:
+        monthly (xr.DataArray): one value per month
+    """
+    time = dataarray.indexes["time"]
+    labels = time.year * 12 + time.month
+    if np.any(np.diff(labels) < 0):
+        raise ValueError("Time must be sorted to reduce by month")
+    group_starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+
+    coords = {dim: dataarray[dim] for dim in dataarray.dims[1:] if dim in dataarray.coords}
+    coords["time"] = time[group_starts].to_period("M").to_timestamp(how="end").normalize()
+    monthly = xr.DataArray(
+        grouped_reduce(dataarray.data, group_starts, reduction, skipna),
+        coords=coords,
+        dims=dataarray.dims,
+        attrs=dataarray.attrs,
+    )
+    return monthly
+
+
+@instrument.traced(tag_args=("climvar",))
+def compute_monthly_summaries(decade_slice, vargroup, climvar, skipna=False):
     """
     Compute monthly summaries like mean, total, etc. of a climatological variable over a decadal slice of data.
     
@@ -132,16 +328,15 @@ def compute_monthly_summaries(decade_slice, vargroup, climvar):
         decade_slice (xarray.Dataset): a slice of data corresponding to a decade.
         vargroup (str): category of variables to summarize (one of wf, ws, eb, or met)
         climvar (str): name of the climatological variable to summarize.
+        skipna (bool): ignore NaN values in the monthly summaries, see `reduce_segments`
     
     Returns:
         dec_mean_monthly_summary (xr.DataArray): a dataset containing the decadal monthly summaries of the given climatological variable.
     """
     
-    summary_func = variable_di[vargroup][climvar]
+    reduction = variable_di[vargroup][climvar]
     out = (
-        decade_slice[climvar]
-        .resample(time="1M")
-        .reduce(summary_func)
+        monthly_reduce(decade_slice[climvar], reduction, skipna)
         .groupby("time.month")
         .reduce(np.mean)  # decadal summary is always a mean
     )
@@ -149,6 +344,55 @@ def compute_monthly_summaries(decade_slice, vargroup, climvar):
     return dec_mean_monthly_summary
 
 
+@instrument.traced(tag_args=("vargroup",))
+def compute_all_decadal_summaries(
+    datacube, vargroup, decade_starts=range(1950, 2100, 10), skipna=False
+):
+    """
+    Compute the decadal means of monthly summaries for every variable in a group and every decade in a single pass. Monthly summaries are computed once over the full record (instead of once per decade slice), reshaped to (decade, year, month) and averaged over the years of each decade. Results match `compute_monthly_summaries` applied to each decade slice.
+
+    Args:
+        datacube (xarray.Dataset): projected datacube covering every year of the requested decades
+        vargroup (str): category of variables to summarize (one of wf, ws, eb, or met)
+        decade_starts (iterable): first year of each decade to summarize
+        skipna (bool): ignore NaN values in the monthly summaries, see `reduce_segments`
+
+    Returns:
+        summaries (dict): keyed by variable name, each value is an xr.DataArray of dimensions (decade, month, y, x) where `decade` is the first year of the decade. Select a decade with `.sel(decade=start_year)` to use it with `array_from_monthly_summary`.
+    """
+    decade_starts = list(decade_starts)
+    first_year, last_year = decade_starts[0], decade_starts[-1] + 9
+    if decade_starts != list(range(first_year, last_year + 1, 10)):
+        raise ValueError(f"Decades must be consecutive, got {decade_starts}")
+
+    lazy_summaries = {}
+    for climvar, reduction in variable_di[vargroup].items():
+        monthly = monthly_reduce(datacube[climvar], reduction, skipna)
+        monthly = monthly.isel(
+            time=(monthly.time.dt.year >= first_year) & (monthly.time.dt.year <= last_year)
+        )
+        n_months = len(decade_starts) * 10 * 12
+        if monthly.time.size != n_months or monthly.time.dt.month[0] != 1:
+            raise ValueError(
+                f"{climvar} does not have every month of {first_year}-{last_year} ({monthly.time.size} of {n_months} months found)"
+            )
+
+        ny, nx = monthly.shape[1:]
+        by_decade = monthly.data.reshape(len(decade_starts), 10, 12, ny, nx)
+        # decadal summary is always a mean
+        lazy_summaries[climvar] = xr.DataArray(
+            by_decade.mean(axis=1),
+            coords={"decade": decade_starts, "month": months, "y": monthly.y, "x": monthly.x},
+            dims=["decade", "month", "y", "x"],
+            attrs=monthly.attrs,
+        )
+
+    # one compute for all variables, so variables from the same files share reads
+    computed = dask.compute(*lazy_summaries.values())
+    summaries = dict(zip(lazy_summaries.keys(), computed))
+    return summaries
+
+
 def array_from_monthly_summary(dec_mean_monthly_summary, climvar, month):
     """
     Convert monthly summary data into a numpy array, rotate, set nodata to -9999.
@@ -192,8 +436,11 @@ def make_output_filename(climvar, model, scenario, month, start_year):
     return out_filename
 
 
+@instrument.traced(tag_args=("out_filename",))
 def write_raster_to_disk(out_filename, raster_profile, raster_data):
     """
+    Write a GeoTIFF to a temporary file and move it into place, so a job killed mid-write never leaves a truncated output under the final name (resumed runs only check that outputs exist).
+
     Args:
         out_filename (str): name of the output GeoTIFF.
         raster_profile (dict): raster profile parameters used to create the output GeoTIFF.
@@ -202,7 +449,90 @@ def write_raster_to_disk(out_filename, raster_profile, raster_data):
     Returns:
         None
     """
-    with rio.open(
-        OUTPUT_DIR / out_filename, "w", **raster_profile
-    ) as dst:
-        dst.write(raster_data, 1)
\ No newline at end of file
+    out_fp = OUTPUT_DIR / out_filename
+    tmp_fp = out_fp.with_name(f".{out_fp.name}.{os.getpid()}.tmp")
+    try:
+        with rio.open(tmp_fp, "w", **raster_profile) as dst:
+            dst.write(raster_data, 1)
+        os.replace(tmp_fp, out_fp)
+    finally:
+        if tmp_fp.exists():
+            tmp_fp.unlink()
+
+
+class AsyncRasterWriter:
+    """
+    Write GeoTIFFs with `write_raster_to_disk` on a pool of background threads, so the next summary can be computed while LZW encoding and filesystem writes happen. GDAL releases the GIL while encoding and writing, and every job opens its own dataset.
+
+    At most `max_pending` jobs are queued or being written at once. `submit` blocks when that many are in flight, which bounds the memory held by arrays waiting to be written. Arrays must not be modified after they are submitted. `flush` waits for every submitted job and raises the first error, and errors are also raised by the next `submit` after they happen. Use it as a context manager to flush and shut down the threads on exit:
+
+        with AsyncRasterWriter() as writer:
+            writer.submit(output_filename, wrf_raster_profile, month_array)
+
+    Args:
+        max_workers (int): number of writer threads
+        max_pending (int): maximum number of jobs queued or being written
+    """
+
+    def __init__(self, max_workers=4, max_pending=64):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+    def submit(self, out_filename, raster_profile, raster_data):
+        """
+        Queue a GeoTIFF to be written, blocking while `max_pending` jobs are in flight.
+
+        Args:
+            out_filename (str): name of the output GeoTIFF.
+            raster_profile (dict): raster profile parameters used to create the output GeoTIFF.
+            raster_data (ndarray): raster data to be written to disk.
+
+        Returns:
+            None
+        """
+        self.raise_errors()
+        self.slots.acquire()
+        # the write is traced with the tags (e.g. model and scenario) of the stages open at submit time
+        future = self.executor.submit(
+            instrument.with_current_tags(write_raster_to_disk),
+            out_filename,
+            raster_profile,
+            raster_data,
+        )
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def raise_errors(self):
+        """Forget about finished jobs and raise the error of the first one that failed, if any."""
+        # done() is checked once per future, a job finishing mid-split must not be dropped from both lists
+        done, pending = [], []
+        for f in self.futures:
+            (done if f.done() else pending).append(f)
+        self.futures = pending
+        for future in done:
+            if future.exception() is not None:
+                raise future.exception()
+
+    def flush(self):
+        """Wait for every submitted job to finish and raise the first error, if any."""
+        wait(self.futures)
+        self.raise_errors()
+
+    def close(self):
+        """Flush and shut down the writer threads."""
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't mask the original error, but still wait for the writes in flight
+            self.executor.shutdown(wait=True)
+        return False
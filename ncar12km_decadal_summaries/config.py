@@ -1,10 +1,13 @@
 """Configuration for shared directories and objects"""
 
 import os
+import sys
 import calendar
-import numpy as np
 from pathlib import Path
 
+# make the shared grid registry (grids.py at the repository root) importable
+sys.path.append(str(Path(__file__).parent.parent))
+
 # path to directory containing input NCAR met and VIC hydro datasets
 DATA_DIR = Path(os.getenv("DATA_DIR") or "/atlas_scratch/cparr4/ncar_replacement_data")
 # path to directory containing where outputs will be writtene
@@ -23,6 +26,18 @@ reprojected_dir.mkdir(exist_ok=True)
 aux_dir = OUTPUT_DIR.joinpath("auxiliary_content")
 aux_dir.mkdir(exist_ok=True)
 
+# for the JSON header indexes of the source netCDF files, see `netcdf_index.py`
+index_dir = aux_dir.joinpath("netcdf_index")
+index_dir.mkdir(exist_ok=True)
+
+# for the summary statistics tables of the input and output files, see `harvest_stats.py`
+stats_dir = aux_dir.joinpath("summary_stats")
+stats_dir.mkdir(exist_ok=True)
+
+# for the chunked per-variable cubes (NetCDF or Zarr) of all summaries
+cube_dir = OUTPUT_DIR.joinpath("cubes")
+cube_dir.mkdir(exist_ok=True)
+
 # for the zipped goods. zippy longstocking
 zip_dir = OUTPUT_DIR.joinpath("zipped")
 zip_dir.mkdir(exist_ok=True)
@@ -44,21 +59,21 @@ models = [
 months = list(range(1, 13))  # xr indexes months 1 to 12 after `groupby('time.month')`
 mo_names = [x.lower() for x in calendar.month_abbr]
 
-# monthly summary functions for each variable
+# monthly summary reductions for each variable, names of reductions in `compute_summaries.reductions`
 variable_di = {
-    "met": {"pcp": np.sum, "tmax": np.mean, "tmin": np.mean},
+    "met": {"pcp": "sum", "tmax": "mean", "tmin": "mean"},
     "wf": {
-            "SNOW_MELT": np.sum,
-            "EVAP": np.sum,
-            "GLACIER_MELT": np.sum,
-            "RUNOFF": np.sum,
+            "SNOW_MELT": "sum",
+            "EVAP": "sum",
+            "GLACIER_MELT": "sum",
+            "RUNOFF": "sum",
         },
         "ws": {
-            "IWE": np.max,
-            "SWE": np.max,
-            "SM1": np.mean,
-            "SM2": np.mean,
-            "SM3": np.mean,
+            "IWE": "max",
+            "SWE": "max",
+            "SM1": "mean",
+            "SM2": "mean",
+            "SM3": "mean",
         },
     }
 
@@ -0,0 +1,430 @@
+"""Harvest summary statistics from every input NetCDF or output GeoTIFF in one streaming pass per file, as a queryable replacement for the EDA pickles.
+
+For every file and variable the harvester records the min, max, sum, number of valid and NaN (or nodata) values, a mergeable log-bucket quantile sketch, and a fixed-bin histogram. Files are processed in parallel worker processes, and NetCDF variables are read in blocks of days so memory stays small. The results are written to a Parquet table in `stats_dir` with one row per file and variable.
+
+Because the sketches and histograms of different files can be added together, statistics for any grouping (per variable, model, scenario, decade, ...) are computed from the table with `merge_stats` without touching the data again. The sketch gives quantiles within `sketch_relative_accuracy` of the true value (for the magnitude of the value), and histogram values outside the fixed range are counted in `hist_under` and `hist_over`.
+
+Example usage:
+    python harvest_stats.py inputs --var-groups met wf ws --workers 16
+    python harvest_stats.py outputs --src-dir $OUTPUT_DIR/reprojected_geotiffs
+
+    then, e.g.
+    table = read_stats("inputs")
+    merge_stats(table, ["var_group", "variable"])
+"""
+
+import argparse
+import math
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import rasterio as rio
+import xarray as xr
+
+from config import DATA_DIR, OUTPUT_DIR, stats_dir
+from config import variable_di, unit_di, mo_names
+
+# quantiles are estimated to within 1% of their value
+sketch_relative_accuracy = 0.01
+sketch_gamma = (1 + sketch_relative_accuracy) / (1 - sketch_relative_accuracy)
+# absolute values at or below this are counted as zero by the sketch
+sketch_min_value = 1e-6
+
+# quantiles reported for each file and for merged groups
+report_quantiles = [0.01, 0.05, 0.5, 0.95, 0.99]
+
+# (low, high, number of bins) of the fixed-bin histograms of the daily input values
+input_histogram_ranges = {
+    "pcp": (0, 1000, 200),
+    "tmax": (-80, 60, 140),
+    "tmin": (-80, 60, 140),
+    "SNOW_MELT": (0, 500, 100),
+    "EVAP": (-50, 50, 100),
+    "GLACIER_MELT": (0, 500, 100),
+    "RUNOFF": (0, 500, 100),
+    "IWE": (0, 5000, 100),
+    "SWE": (0, 5000, 100),
+    "SM1": (0, 1000, 100),
+    "SM2": (0, 2000, 100),
+    "SM3": (0, 2000, 100),
+}
+
+# (low, high, number of bins) of the fixed-bin histograms of the decadal means of monthly summaries
+output_histogram_ranges = {
+    "pcp": (0, 3000, 150),
+    "tmax": (-60, 40, 100),
+    "tmin": (-60, 40, 100),
+    "SNOW_MELT": (0, 3000, 150),
+    "EVAP": (-200, 400, 150),
+    "GLACIER_MELT": (0, 3000, 150),
+    "RUNOFF": (0, 3000, 150),
+    "IWE": (0, 5000, 100),
+    "SWE": (0, 5000, 100),
+    "SM1": (0, 1000, 100),
+    "SM2": (0, 2000, 100),
+    "SM3": (0, 2000, 100),
+}
+
+# number of days read from a NetCDF variable at a time
+days_per_block = 32
+
+
+def stats_path(kind):
+    """Get the path of the Parquet table for "inputs" or "outputs"."""
+    return stats_dir / f"{kind}_summary_stats.parquet"
+
+
+def sketch_keys(values):
+    """Get the log-bucket index of each (nonzero, absolute) value."""
+    return np.ceil(np.log(values) / math.log(sketch_gamma)).astype(np.int64)
+
+
+def count_keys(keys):
+    """Count the values in each log-bucket, returned as a {key: count} dict."""
+    if keys.size == 0:
+        return {}
+    offset = keys.min()
+    counts = np.bincount(keys - offset)
+    nonzero = np.flatnonzero(counts)
+    return dict(zip((nonzero + offset).tolist(), counts[nonzero].tolist()))
+
+
+def add_counts(a, b):
+    """Add the bucket counts of dict `b` to dict `a` in place."""
+    for key, count in b.items():
+        a[key] = a.get(key, 0) + count
+    return a
+
+
+def new_stats(lo, hi, n_bins):
+    """
+    Make empty statistics accumulators for one variable.
+
+    Args:
+        lo (float): lower edge of the histogram
+        hi (float): upper edge of the histogram
+        n_bins (int): number of histogram bins
+
+    Returns:
+        stats (dict): accumulators updated by `update_stats`
+    """
+    return {
+        "size": 0,
+        "count": 0,
+        "nan_count": 0,
+        "min": np.nan,
+        "max": np.nan,
+        "sum": 0.0,
+        "sketch_pos": {},
+        "sketch_neg": {},
+        "sketch_zero": 0,
+        "hist_lo": lo,
+        "hist_hi": hi,
+        "hist_counts": np.zeros(n_bins, dtype=np.int64),
+        "hist_under": 0,
+        "hist_over": 0,
+    }
+
+
+def update_stats(stats, arr):
+    """
+    Update the accumulators of a variable with a block of values, in place.
+
+    Args:
+        stats (dict): accumulators from `new_stats`
+        arr (numpy.ndarray): block of values, NaN for missing
+
+    Returns:
+        stats (dict): the updated accumulators
+    """
+    valid = arr[~np.isnan(arr)].astype(np.float64, copy=False)
+    stats["size"] += arr.size
+    stats["nan_count"] += arr.size - valid.size
+    if valid.size == 0:
+        return stats
+
+    stats["count"] += valid.size
+    stats["sum"] += float(valid.sum())
+    stats["min"] = float(np.fmin(stats["min"], valid.min()))
+    stats["max"] = float(np.fmax(stats["max"], valid.max()))
+
+    magnitude = np.abs(valid)
+    nonzero = magnitude > sketch_min_value
+    stats["sketch_zero"] += int(valid.size - nonzero.sum())
+    add_counts(stats["sketch_pos"], count_keys(sketch_keys(valid[nonzero & (valid > 0)])))
+    add_counts(stats["sketch_neg"], count_keys(sketch_keys(-valid[nonzero & (valid < 0)])))
+
+    n_bins = len(stats["hist_counts"])
+    width = (stats["hist_hi"] - stats["hist_lo"]) / n_bins
+    bins = np.floor((valid - stats["hist_lo"]) / width).astype(np.int64)
+    under = bins < 0
+    over = bins >= n_bins
+    stats["hist_under"] += int(under.sum())
+    stats["hist_over"] += int(over.sum())
+    stats["hist_counts"] += np.bincount(bins[~(under | over)], minlength=n_bins)
+    return stats
+
+
+def sketch_quantiles(pos, neg, zero, quantiles):
+    """
+    Estimate quantiles from a log-bucket sketch.
+
+    Args:
+        pos (dict): {key: count} buckets of the positive values
+        neg (dict): {key: count} buckets of the absolute negative values
+        zero (int): number of values counted as zero
+        quantiles (list): quantiles to estimate, between 0 and 1
+
+    Returns:
+        list: estimated value of each quantile, NaN if the sketch is empty
+    """
+    # buckets in ascending order of value: negatives from the largest magnitude down, zero, positives
+    neg_keys = sorted(neg, reverse=True)
+    pos_keys = sorted(pos)
+    bucket_values = np.concatenate(
+        [
+            -2 * sketch_gamma ** np.array(neg_keys, dtype=np.float64) / (sketch_gamma + 1),
+            [0.0],
+            2 * sketch_gamma ** np.array(pos_keys, dtype=np.float64) / (sketch_gamma + 1),
+        ]
+    )
+    bucket_counts = np.array(
+        [neg[k] for k in neg_keys] + [zero] + [pos[k] for k in pos_keys], dtype=np.int64
+    )
+    total = bucket_counts.sum()
+    if total == 0:
+        return [np.nan] * len(quantiles)
+    cumulative = np.cumsum(bucket_counts)
+    ranks = np.array(quantiles) * (total - 1)
+    return bucket_values[np.searchsorted(cumulative, ranks, side="right")].tolist()
+
+
+def stats_to_record(stats):
+    """Flatten accumulators to a table row, with the sketch buckets and histogram as list columns."""
+    record = {
+        "size": stats["size"],
+        "count": stats["count"],
+        "nan_count": stats["nan_count"],
+        "min": stats["min"],
+        "max": stats["max"],
+        "sum": stats["sum"],
+        "mean": stats["sum"] / stats["count"] if stats["count"] else np.nan,
+    }
+    estimates = sketch_quantiles(
+        stats["sketch_pos"], stats["sketch_neg"], stats["sketch_zero"], report_quantiles
+    )
+    for q, value in zip(report_quantiles, estimates):
+        record[f"p{round(q * 100):02d}"] = value
+    record.update(
+        {
+            "sketch_pos_keys": list(stats["sketch_pos"].keys()),
+            "sketch_pos_counts": list(stats["sketch_pos"].values()),
+            "sketch_neg_keys": list(stats["sketch_neg"].keys()),
+            "sketch_neg_counts": list(stats["sketch_neg"].values()),
+            "sketch_zero": stats["sketch_zero"],
+            "hist_lo": stats["hist_lo"],
+            "hist_hi": stats["hist_hi"],
+            "hist_counts": stats["hist_counts"].tolist(),
+            "hist_under": stats["hist_under"],
+            "hist_over": stats["hist_over"],
+        }
+    )
+    return record
+
+
+def parse_input_filename(fp):
+    """Parse the model, scenario, variable group, and year from an input file name, e.g. CCSM4_rcp45_BCSD_met_2005.nc or daymet_met_1980.nc"""
+    parts = fp.stem.split("_")
+    scenario = parts[1] if len(parts) > 3 else "historical"
+    return {"model": parts[0], "scenario": scenario, "var_group": parts[-2], "year": int(parts[-1])}
+
+
+def parse_output_filename(fp):
+    """Parse the variable, model, scenario, month, and decade from a summary GeoTIFF name made with `compute_summaries.make_output_filename`."""
+    for climvar, units in unit_di.items():
+        prefix = f"{climvar.lower()}_{units}_"
+        if fp.name.startswith(prefix):
+            model, scenario, month, _, years, _ = fp.stem[len(prefix):].split("_")
+            return {
+                "variable": climvar,
+                "model": model,
+                "scenario": scenario,
+                "month": mo_names.index(month),
+                "decade": int(years.split("-")[0]),
+            }
+    raise ValueError(f"{fp.name} is not a summary GeoTIFF name")
+
+
+def harvest_netcdf(fp):
+    """
+    Harvest the statistics of every variable of an input NetCDF file, reading `days_per_block` days at a time.
+
+    Args:
+        fp (pathlib.Path): input NetCDF file
+
+    Returns:
+        records (list): one table row (dict) per variable
+    """
+    meta = parse_input_filename(fp)
+    records = []
+    with xr.open_dataset(fp) as ds:
+        for climvar in variable_di[meta["var_group"]]:
+            stats = new_stats(*input_histogram_ranges[climvar])
+            for start in range(0, ds.sizes["time"], days_per_block):
+                block = ds[climvar].isel(time=slice(start, start + days_per_block)).values
+                update_stats(stats, block)
+            records.append({"file": fp.name, **meta, "variable": climvar, **stats_to_record(stats)})
+    return records
+
+
+def harvest_geotiff(fp):
+    """
+    Harvest the statistics of a summary GeoTIFF, nodata counts as NaN.
+
+    Args:
+        fp (pathlib.Path): summary GeoTIFF
+
+    Returns:
+        records (list): a single table row (dict)
+    """
+    meta = parse_output_filename(fp)
+    with rio.open(fp) as src:
+        arr = src.read(1).astype(np.float32, copy=False)
+        if src.nodata is not None:
+            arr[arr == src.nodata] = np.nan
+    stats = update_stats(new_stats(*output_histogram_ranges[meta["variable"]]), arr)
+    return [{"file": fp.name, **meta, **stats_to_record(stats)}]
+
+
+def harvest(paths, harvest_file, max_workers=8):
+    """
+    Harvest statistics from many files in parallel worker processes.
+
+    Args:
+        paths (list): files to harvest
+        harvest_file (callable): `harvest_netcdf` or `harvest_geotiff`
+        max_workers (int): number of worker processes
+
+    Returns:
+        pandas.DataFrame: table with one row per file and variable
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(harvest_file, paths, chunksize=8)
+        records = [record for file_records in results for record in file_records]
+    return pd.DataFrame.from_records(records)
+
+
+def read_stats(kind):
+    """Read the Parquet table of "inputs" or "outputs" statistics."""
+    return pd.read_parquet(stats_path(kind))
+
+
+def merge_stats(table, by):
+    """
+    Merge the statistics of the files in each group of a table, without reading any data. Sketch buckets and histograms are added together, so merged quantiles have the same accuracy as per-file ones.
+
+    Args:
+        table (pandas.DataFrame): table from `harvest` or `read_stats`
+        by (list): columns to group by, e.g. ["variable"] or ["variable", "model", "decade"]
+
+    Returns:
+        pandas.DataFrame: one row per group with the merged statistics
+    """
+    records = []
+    for key, group in table.groupby(by):
+        key = key if isinstance(key, tuple) else (key,)
+        pos, neg = {}, {}
+        for keys, counts in zip(group["sketch_pos_keys"], group["sketch_pos_counts"]):
+            add_counts(pos, dict(zip(keys, counts)))
+        for keys, counts in zip(group["sketch_neg_keys"], group["sketch_neg_counts"]):
+            add_counts(neg, dict(zip(keys, counts)))
+
+        count = group["count"].sum()
+        record = dict(zip(by, key))
+        record.update(
+            {
+                "n_files": group["file"].nunique(),
+                "size": group["size"].sum(),
+                "count": count,
+                "nan_count": group["nan_count"].sum(),
+                "min": group["min"].min(),
+                "max": group["max"].max(),
+                "mean": group["sum"].sum() / count if count else np.nan,
+            }
+        )
+        estimates = sketch_quantiles(pos, neg, group["sketch_zero"].sum(), report_quantiles)
+        for q, value in zip(report_quantiles, estimates):
+            record[f"p{round(q * 100):02d}"] = value
+        if group["hist_lo"].nunique() == 1 and group["hist_hi"].nunique() == 1:
+            record.update(
+                {
+                    "hist_lo": group["hist_lo"].iloc[0],
+                    "hist_hi": group["hist_hi"].iloc[0],
+                    "hist_counts": np.sum(np.stack(group["hist_counts"].to_numpy()), axis=0),
+                    "hist_under": group["hist_under"].sum(),
+                    "hist_over": group["hist_over"].sum(),
+                }
+            )
+        records.append(record)
+    return pd.DataFrame.from_records(records)
+
+
+def find_out_of_range(table, bounds):
+    """
+    Find the files with values outside of plausible bounds, e.g. negative precipitation.
+
+    Args:
+        table (pandas.DataFrame): table from `harvest` or `read_stats`
+        bounds (dict): (low, high) bounds keyed by variable, either may be None
+
+    Returns:
+        pandas.DataFrame: the rows of `table` with a min below or a max above the bounds of their variable
+    """
+    out_of_range = np.zeros(len(table), dtype=bool)
+    for climvar, (lo, hi) in bounds.items():
+        is_var = (table["variable"] == climvar).to_numpy()
+        if lo is not None:
+            out_of_range |= is_var & (table["min"] < lo).to_numpy()
+        if hi is not None:
+            out_of_range |= is_var & (table["max"] > hi).to_numpy()
+    return table[out_of_range]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "kind", choices=["inputs", "outputs"], help="harvest the input NetCDFs or the summary GeoTIFFs"
+    )
+    parser.add_argument(
+        "--var-groups",
+        nargs="+",
+        default=list(variable_di),
+        choices=list(variable_di),
+        help="variable groups of the input NetCDFs to harvest (default: all)",
+    )
+    parser.add_argument(
+        "--src-dir",
+        type=Path,
+        default=OUTPUT_DIR,
+        help="directory of the summary GeoTIFFs (default: $OUTPUT_DIR)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="number of worker processes (default: 8)"
+    )
+    args = parser.parse_args()
+
+    if args.kind == "inputs":
+        paths = sorted(
+            fp
+            for var_set in args.var_groups
+            for fp in list(DATA_DIR.glob(f"*_{var_set}_*.nc")) + list(DATA_DIR.glob(f"daymet/*_{var_set}_*.nc"))
+        )
+        table = harvest(paths, harvest_netcdf, args.workers)
+    else:
+        paths = sorted(args.src_dir.glob("*.tif"))
+        table = harvest(paths, harvest_geotiff, args.workers)
+
+    table.to_parquet(stats_path(args.kind), index=False)
+    print(f"statistics of {len(paths)} files written to {stats_path(args.kind)}")
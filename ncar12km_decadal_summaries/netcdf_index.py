@@ -0,0 +1,170 @@
+"""Index the headers of the yearly netCDF files so a model / scenario / variable group datacube can be opened without `xr.open_mfdataset`.
+
+`xr.open_mfdataset` opens all 150 files of a group, decodes their time coordinates, and rebuilds the combined index every time a notebook or job starts. The index written here holds everything needed to assemble the same datacube lazily: for each file its path, modification time, size, and decoded time coordinate, and for each variable its dimensions, shape, dtype, attributes, and on-disk chunk layout and filters. One JSON index is kept per group in `index_dir`, named like the source files without the year (e.g. CCSM4_rcp45_BCSD_met.json).
+
+An index is checked against the source files every time it is loaded. Files whose modification time or size changed, and files that were added, are scanned again, and files that are gone are dropped, so a stale index is never used.
+
+Example usage:
+    python netcdf_index.py --var-groups met wf ws
+"""
+
+import argparse
+import json
+import os
+
+import netCDF4
+import numpy as np
+import xarray as xr
+
+from config import DATA_DIR, variable_di
+from config import index_dir
+
+index_version = 1
+
+
+def index_name(paths):
+    """Get the group name of the index for a list of yearly files, e.g. CCSM4_rcp45_BCSD_met"""
+    return "_".join(paths[0].stem.split("_")[:-1])
+
+
+def index_path(name):
+    """Get the path of the JSON index for a group."""
+    return index_dir / f"{name}.json"
+
+
+def file_stamp(fp):
+    """Get the modification time (ns) and size (bytes) of a file, used to check if an index entry is current."""
+    stat = os.stat(fp)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def to_json_value(value):
+    """Convert a netCDF attribute value to something JSON can store."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def scan_header(fp):
+    """
+    Scan the header of one netCDF file. Only the time coordinate is read, no data variables are.
+
+    Args:
+        fp (pathlib.Path): netCDF file
+
+    Returns:
+        entry (dict): index entry with the "path", "mtime_ns", "size", decoded "time" (int64 ns since 1970), and "variables" of the file
+    """
+    mtime_ns, size = file_stamp(fp)
+    with netCDF4.Dataset(fp) as ds:
+        time_var = ds.variables["time"]
+        time_var.set_auto_maskandscale(False)
+        time = xr.coding.times.decode_cf_datetime(
+            time_var[:],
+            time_var.getncattr("units"),
+            getattr(time_var, "calendar", "standard"),
+        )
+
+        variables = {}
+        for name, var in ds.variables.items():
+            if name == "time":
+                continue
+            chunking = var.chunking()
+            variables[name] = {
+                "dims": list(var.dimensions),
+                "shape": list(var.shape),
+                "dtype": var.dtype.str,
+                "attrs": {k: to_json_value(var.getncattr(k)) for k in var.ncattrs()},
+                "chunking": chunking if chunking == "contiguous" else list(chunking),
+                "filters": var.filters(),
+            }
+        global_attrs = {k: to_json_value(ds.getncattr(k)) for k in ds.ncattrs()}
+
+    return {
+        "path": str(fp),
+        "mtime_ns": mtime_ns,
+        "size": size,
+        "time": np.asarray(time, dtype="datetime64[ns]").astype(np.int64).tolist(),
+        "variables": variables,
+        "attrs": global_attrs,
+    }
+
+
+def read_index(name):
+    """Read the JSON index for a group, None if there is none or it was written by another index version."""
+    fp = index_path(name)
+    if not fp.exists():
+        return None
+    with open(fp) as f:
+        index = json.load(f)
+    if index.get("version") != index_version:
+        return None
+    return index
+
+
+def write_index(name, index):
+    """Write the JSON index for a group. The index is written to a temporary file first so a concurrent reader never sees a partial index."""
+    fp = index_path(name)
+    tmp_fp = fp.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_fp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_fp, fp)
+
+
+def get_index(paths):
+    """
+    Get the current index for a group of yearly files, building or updating it as needed. Files that are new or whose modification time or size changed since they were indexed are scanned again.
+
+    Args:
+        paths (list): yearly netCDF files of one model, scenario, and variable group, in time order
+
+    Returns:
+        index (dict): index with the "files" entries in the order of `paths`
+    """
+    name = index_name(paths)
+    index = read_index(name)
+    known = {}
+    if index is not None:
+        known = {entry["path"]: entry for entry in index["files"]}
+
+    files = []
+    n_scanned = 0
+    for fp in paths:
+        entry = known.get(str(fp))
+        if entry is None or (entry["mtime_ns"], entry["size"]) != file_stamp(fp):
+            entry = scan_header(fp)
+            n_scanned += 1
+        files.append(entry)
+
+    # rewrite when anything was scanned or when files were dropped or reordered
+    if index is None or n_scanned or [entry["path"] for entry in index["files"]] != [str(fp) for fp in paths]:
+        index = {"version": index_version, "name": name, "files": files}
+        write_index(name, index)
+    return index
+
+
+def list_groups(var_groups):
+    """List the yearly files of every group in `DATA_DIR` for some variable groups, keyed by index name."""
+    groups = {}
+    for var_set in var_groups:
+        for fp in sorted(DATA_DIR.glob(f"*{var_set}*.nc")):
+            groups.setdefault(index_name([fp]), []).append(fp)
+    return groups
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--var-groups",
+        nargs="+",
+        default=list(variable_di),
+        choices=list(variable_di),
+        help="variable groups to index (default: all)",
+    )
+    args = parser.parse_args()
+
+    for name, paths in list_groups(args.var_groups).items():
+        get_index(paths)
+        print(f"{index_path(name)} is current ({len(paths)} files)")
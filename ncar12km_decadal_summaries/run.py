@@ -0,0 +1,294 @@
+"""Command line entry point for computing the decadal summaries without the run_*_vars notebooks.
+
+Every model, scenario, and variable group (met, wf, ws) combination is a job. Jobs run concurrently in separate worker processes, each one loading its 150 files, summarizing them with `compute_all_decadal_summaries`, and writing the GeoTIFFs with `AsyncRasterWriter`, exactly like the notebooks. A job is only started when its estimated memory fits in the node memory budget next to the jobs already running, so I/O waits in one job are filled with work from another without running out of memory. Jobs whose outputs all exist already are skipped, so an interrupted run can simply be started again. Timing is printed for every job.
+
+Example usage:
+    python -m ncar12km_decadal_summaries.run --var-groups wf ws --max-jobs 4 --threads-per-job 8 --memory-budget 200GB
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+# the sibling modules use flat imports (e.g., `from config import ...`)
+# so make them importable when this is run as `python -m ncar12km_decadal_summaries.run`
+sys.path.insert(0, str(Path(__file__).parent))
+
+import dask
+import xarray as xr
+from dask.utils import parse_bytes, format_bytes
+
+from config import DATA_DIR, OUTPUT_DIR
+from config import models, scenarios, variable_di, months
+import instrument
+from compute_summaries import (
+    load_indexed_datacube,
+    project_datacube,
+    compute_all_decadal_summaries,
+    array_from_monthly_summary,
+    make_output_filename,
+    AsyncRasterWriter,
+)
+
+decade_starts = list(range(1950, 2100, 10))
+
+
+def list_jobs(selected_models, selected_scenarios, var_groups):
+    """
+    List the model, scenario, and variable group jobs along with their input files.
+
+    Args:
+        selected_models (list): names of the climate models
+        selected_scenarios (list): names of the emissions scenarios
+        var_groups (list): variable groups (met, wf, ws)
+
+    Returns:
+        jobs (list): list of dicts with the "model", "scenario", "var_set", and input "paths" of each job
+    """
+    jobs = []
+    for var_set in var_groups:
+        groups = {}
+        for fp in DATA_DIR.glob(f"*{var_set}*.nc"):
+            fp_model, fp_scenario = fp.name.split("_")[:2]
+            groups.setdefault((fp_model, fp_scenario), []).append(fp)
+
+        for model in selected_models:
+            # we know from the EDA that HadGEM2-ES is missing some met data for December 2005
+            if var_set == "met" and model == "HadGEM2-ES":
+                continue
+            for scenario in selected_scenarios:
+                paths = sorted(groups.get((model, scenario), []))
+                if paths:
+                    jobs.append(
+                        {"model": model, "scenario": scenario, "var_set": var_set, "paths": paths}
+                    )
+    return jobs
+
+
+def expected_outputs(job):
+    """List the GeoTIFFs a job writes."""
+    return [
+        OUTPUT_DIR / make_output_filename(climvar, job["model"], job["scenario"], month, decade_start)
+        for climvar in variable_di[job["var_set"]]
+        for decade_start in decade_starts
+        for month in months
+    ]
+
+
+def is_complete(job):
+    """Check if every output of a job exists already. Outputs are moved into place only once fully written (see `write_raster_to_disk`), so an existing output is complete."""
+    return all(fp.exists() for fp in expected_outputs(job))
+
+
+def estimate_job_memory(job, threads_per_job):
+    """
+    Estimate the peak memory of a job in bytes. Each thread holds about one file (one year of daily data) of every variable in the group plus a temporary of the same size, and the decadal summaries of every variable are held until they are written.
+
+    Args:
+        job (dict): job from `list_jobs`
+        threads_per_job (int): number of dask threads per job
+
+    Returns:
+        int: estimated peak memory in bytes
+    """
+    n_vars = len(variable_di[job["var_set"]])
+    with xr.open_dataset(job["paths"][0]) as ds:
+        climvar = list(variable_di[job["var_set"]])[0]
+        n_days, ny, nx = ds[climvar].shape
+        itemsize = ds[climvar].dtype.itemsize
+
+    daily_year = n_days * ny * nx * itemsize
+    in_flight = threads_per_job * n_vars * daily_year * 2
+    summaries = n_vars * len(decade_starts) * len(months) * ny * nx * 8
+    return in_flight + summaries
+
+
+@instrument.traced(tag_args=("model", "scenario", "var_set"))
+def run_job(model, scenario, var_set, paths, threads_per_job):
+    """
+    Compute and write the decadal summaries for one model, scenario, and variable group. Meant to run in a worker process.
+
+    Args:
+        model (str): name of the climate model
+        scenario (str): name of the emissions scenario
+        var_set (str): variable group (met, wf, or ws)
+        paths (list): input netCDF files
+        threads_per_job (int): number of dask threads to use
+
+    Returns:
+        timings (dict): seconds spent in the "load", "summarize", and "write" steps
+    """
+    dask.config.set(scheduler="threads", num_workers=threads_per_job)
+    timings = {}
+
+    tic = time.perf_counter()
+    ncube = load_indexed_datacube(paths)
+    projcube, wrf_raster_profile = project_datacube(ncube)
+    timings["load"] = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    summaries = compute_all_decadal_summaries(projcube, var_set, decade_starts)
+    timings["summarize"] = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    with AsyncRasterWriter() as writer:
+        for climvar, decadal_summaries in summaries.items():
+            for decade_start in decadal_summaries.decade.values:
+                decadal_means_of_monthly_summaries = decadal_summaries.sel(decade=decade_start)
+                for month in months:
+                    month_array = array_from_monthly_summary(
+                        decadal_means_of_monthly_summaries, climvar, month
+                    )
+                    output_filename = make_output_filename(
+                        climvar, model, scenario, month, decade_start
+                    )
+                    writer.submit(output_filename, wrf_raster_profile, month_array)
+    timings["write"] = time.perf_counter() - tic
+
+    projcube.close()
+    return timings
+
+
+def job_name(job):
+    """Name a job for progress messages, e.g. CCSM4 rcp45 met"""
+    return f"{job['model']} {job['scenario']} {job['var_set']}"
+
+
+def run(jobs, max_jobs, threads_per_job, memory_budget, job_memory=None):
+    """
+    Run jobs concurrently in worker processes under a memory budget. Jobs are started largest first, and a job only starts once its estimated memory fits in the budget next to the running jobs (a job larger than the budget runs alone).
+
+    Args:
+        jobs (list): jobs from `list_jobs`
+        max_jobs (int): maximum number of jobs running at once
+        threads_per_job (int): number of dask threads per job
+        memory_budget (int): memory budget for all running jobs, in bytes
+        job_memory (int): memory per job in bytes, None to estimate it for each job
+
+    Returns:
+        failed (list): list of (job, exception) tuples for jobs that did not finish
+    """
+    for job in jobs:
+        job["memory"] = job_memory or estimate_job_memory(job, threads_per_job)
+    pending = sorted(jobs, key=lambda job: job["memory"], reverse=True)
+
+    running = {}
+    failed = []
+    start_time = time.perf_counter()
+    n_done = 0
+    with ProcessPoolExecutor(max_workers=max_jobs) as executor:
+        while pending or running:
+            # start every pending job that fits in the budget
+            in_use = sum(job["memory"] for job, _ in running.values())
+            for job in list(pending):
+                if len(running) == max_jobs:
+                    break
+                if running and in_use + job["memory"] > memory_budget:
+                    continue
+                future = executor.submit(
+                    run_job,
+                    job["model"],
+                    job["scenario"],
+                    job["var_set"],
+                    job["paths"],
+                    threads_per_job,
+                )
+                running[future] = (job, time.perf_counter())
+                in_use += job["memory"]
+                pending.remove(job)
+                print(f"started {job_name(job)} (estimated {format_bytes(job['memory'])}, {format_bytes(in_use)} of {format_bytes(memory_budget)} in use)")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, job_start = running.pop(future)
+                n_done += 1
+                elapsed = time.perf_counter() - job_start
+                if future.exception() is not None:
+                    failed.append((job, future.exception()))
+                    print(f"[{n_done}/{len(jobs)}] {job_name(job)} failed after {elapsed:.1f}s: {future.exception()!r}")
+                    continue
+                steps = ", ".join(f"{step} {seconds:.1f}s" for step, seconds in future.result().items())
+                print(f"[{n_done}/{len(jobs)}] {job_name(job)} done in {elapsed:.1f}s ({steps})")
+
+    print(f"{len(jobs)} jobs finished in {(time.perf_counter() - start_time) / 60:.1f} minutes")
+    return failed
+
+
+def parse_args():
+    available_memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    parser = argparse.ArgumentParser(
+        description="Compute the decadal means of monthly summaries, one job per model, scenario, and variable group."
+    )
+    parser.add_argument(
+        "--models", nargs="+", default=models, choices=models, help="models to process (default: all)"
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", default=scenarios, choices=scenarios, help="scenarios to process (default: all)"
+    )
+    parser.add_argument(
+        "--var-groups",
+        nargs="+",
+        default=list(variable_di),
+        choices=list(variable_di),
+        help="variable groups to process (default: all)",
+    )
+    parser.add_argument(
+        "--max-jobs", type=int, default=4, help="maximum number of jobs running at once (default: 4)"
+    )
+    parser.add_argument(
+        "--threads-per-job", type=int, default=8, help="dask threads per job (default: 8)"
+    )
+    parser.add_argument(
+        "--memory-budget",
+        default=format_bytes(int(available_memory * 0.8)).replace(" ", ""),
+        help="memory budget for all running jobs, e.g. 200GB (default: 80%% of the node memory)",
+    )
+    parser.add_argument(
+        "--job-memory",
+        default=None,
+        help="memory per job, e.g. 20GB, instead of the estimate from the input files",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="rerun jobs even if all of their outputs exist",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        default=None,
+        help="append per-stage timing and memory records to this JSON lines file and print a summary at the end (see instrument.py)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.trace is not None:
+        # enabled before the worker processes start so they trace too
+        instrument.enable(args.trace)
+
+    jobs = list_jobs(args.models, args.scenarios, args.var_groups)
+    if not args.overwrite:
+        n_jobs = len(jobs)
+        jobs = [job for job in jobs if not is_complete(job)]
+        print(f"{n_jobs - len(jobs)} jobs already complete, skipping them")
+    print(f"{len(jobs)} jobs to run")
+
+    failed = run(
+        jobs,
+        args.max_jobs,
+        args.threads_per_job,
+        parse_bytes(args.memory_budget),
+        parse_bytes(args.job_memory) if args.job_memory else None,
+    )
+    if args.trace is not None:
+        instrument.print_summary(args.trace)
+
+    if failed:
+        for job, exc in failed:
+            print(f"Failed to process {job_name(job)}: {exc!r}")
+        sys.exit(1)
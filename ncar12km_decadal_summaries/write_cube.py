@@ -0,0 +1,277 @@
+"""Write the decadal means of monthly summaries as one chunked, compressed cube per variable, as an alternative to the thousands of single-band GeoTIFFs.
+
+Each cube has dimensions (model, scenario, decade, month, y, x) and is assembled lazily from the summary GeoTIFFs, by default the EPSG:3338 GeoTIFFs in `reprojected_dir` that are zipped for distribution. The information carried by the GeoTIFF file names (units from `unit_di`, the monthly summary from `summary_di`, and the decadal mean) moves into CF attributes. Models or scenarios without any GeoTIFFs for a variable are left out, and missing GeoTIFFs are filled with nodata.
+
+Chunks hold the 12 months of one decade for a tile of 56 x 80 pixels, so reading the map of one month and decade and reading the full series for one pixel both touch no more than 16 chunks.
+
+Example usage:
+    python write_cube.py --vars pcp tmax tmin --format netcdf
+"""
+
+import argparse
+from pathlib import Path
+
+import dask
+import dask.array as da
+import numpy as np
+import rasterio as rio
+import xarray as xr
+from pyproj import CRS
+
+from config import models, scenarios, months, mo_names, unit_di, summary_di
+from config import reprojected_dir, cube_dir
+from compute_summaries import make_output_filename
+
+decade_starts = list(range(1950, 2100, 10))
+
+# chunk sizes along each dimension of the cubes
+cube_chunks = {"model": 1, "scenario": 1, "decade": 1, "month": 12, "y": 56, "x": 80}
+
+# compression for NetCDF cubes, Zarr cubes use the Zarr default compressor
+netcdf_compression = {"zlib": True, "complevel": 4, "shuffle": True}
+
+cube_nodata = -9999
+
+# CF cell methods for each monthly summary type
+cell_methods_di = {
+    "total": "time: sum within months time: mean over years",
+    "mean": "time: mean within months time: mean over years",
+    "max": "time: maximum within months time: mean over years",
+}
+
+
+def cube_path(climvar, fmt="netcdf"):
+    """
+    Get the path of the cube for a variable.
+
+    Args:
+        climvar (str): name of the physical variable
+        fmt (str): "netcdf" or "zarr"
+
+    Returns:
+        pathlib.Path: path of the cube, e.g. pcp_decadal_means_of_monthly_total_1950-2099.nc
+    """
+    stem = f"{climvar.lower()}_decadal_means_of_monthly_{summary_di[climvar]}_{decade_starts[0]}-{decade_starts[-1] + 9}"
+    return cube_dir / f"{stem}.{'nc' if fmt == 'netcdf' else 'zarr'}"
+
+
+def list_group_tifs(src_dir, climvar, model, scenario):
+    """List the summary GeoTIFFs for a variable, model, and scenario."""
+    return list(
+        src_dir.glob(f"{climvar.lower()}_{unit_di[climvar]}_{model}_{scenario}_*.tif")
+    )
+
+
+def read_tif(fp, shape):
+    """Read a summary GeoTIFF with nodata as NaN, or a NaN grid if it does not exist."""
+    if not fp.exists():
+        return np.full(shape, np.nan, dtype=np.float32)
+    with rio.open(fp) as src:
+        arr = src.read(1).astype(np.float32)
+        arr[arr == src.nodata] = np.nan
+        return arr
+
+
+def lazy_group_stack(src_dir, climvar, model, scenario, raster_profile):
+    """
+    Get a lazy (decade, month, y, x) stack of the summary GeoTIFFs for a variable, model, and scenario.
+
+    Args:
+        src_dir (pathlib.Path): directory of the summary GeoTIFFs
+        climvar (str): name of the physical variable
+        model (str): name of the climate model
+        scenario (str): name of the emissions scenario
+        raster_profile (dict): raster profile of the GeoTIFFs
+
+    Returns:
+        dask.array.Array: float32 array of shape (len(decade_starts), 12, height, width)
+    """
+    shape = (raster_profile["height"], raster_profile["width"])
+    arrs = [
+        da.from_delayed(
+            dask.delayed(read_tif)(
+                src_dir / make_output_filename(climvar, model, scenario, month, decade_start),
+                shape,
+            ),
+            shape=shape,
+            dtype=np.float32,
+        )
+        for decade_start in decade_starts
+        for month in months
+    ]
+    return da.stack(arrs).reshape(len(decade_starts), len(months), *shape)
+
+
+def make_cube(src_dir, climvar, cube_models, cube_scenarios, raster_profile):
+    """
+    Assemble the lazy cube dataset for a variable.
+
+    Args:
+        src_dir (pathlib.Path): directory of the summary GeoTIFFs
+        climvar (str): name of the physical variable
+        cube_models (list): models in the cube
+        cube_scenarios (list): scenarios in the cube
+        raster_profile (dict): raster profile of the GeoTIFFs
+
+    Returns:
+        xarray.Dataset: dataset with the variable and a `crs` grid mapping variable
+    """
+    transform = raster_profile["transform"]
+    x = transform.c + (np.arange(raster_profile["width"]) + 0.5) * transform.a
+    y = transform.f + (np.arange(raster_profile["height"]) + 0.5) * transform.e
+
+    data = da.stack(
+        [
+            da.stack(
+                [
+                    lazy_group_stack(src_dir, climvar, model, scenario, raster_profile)
+                    for scenario in cube_scenarios
+                ]
+            )
+            for model in cube_models
+        ]
+    )
+    dims = ("model", "scenario", "decade", "month", "y", "x")
+    data = data.rechunk(tuple(cube_chunks[dim] for dim in dims))
+
+    summary = summary_di[climvar]
+    ds = xr.Dataset(
+        {
+            climvar: (
+                dims,
+                data,
+                {
+                    "long_name": f"decadal mean of monthly {summary} {climvar}",
+                    "units": unit_di[climvar],
+                    "monthly_summary": summary,
+                    "decadal_summary": "mean",
+                    "cell_methods": cell_methods_di[summary],
+                    "grid_mapping": "crs",
+                },
+            ),
+            "crs": ((), np.int32(0), CRS.from_user_input(raster_profile["crs"]).to_cf()),
+        },
+        coords={
+            "model": ("model", np.array(cube_models, dtype=object)),
+            "scenario": ("scenario", np.array(cube_scenarios, dtype=object)),
+            "decade": (
+                "decade",
+                np.array(decade_starts, dtype=np.int16),
+                {"long_name": "first year of the decade"},
+            ),
+            "month": (
+                "month",
+                np.array(months, dtype=np.int8),
+                {"long_name": "month", "month_names": " ".join(mo_names[1:])},
+            ),
+            "y": ("y", y, {"standard_name": "projection_y_coordinate", "units": "m"}),
+            "x": ("x", x, {"standard_name": "projection_x_coordinate", "units": "m"}),
+        },
+        attrs={
+            "title": f"Decadal means of monthly {summary} {climvar}, NCAR 12km downscaled CMIP5 and VIC hydrologic model outputs",
+            "Conventions": "CF-1.8",
+        },
+    )
+    return ds
+
+
+def write_cube(ds, out_path, fmt="netcdf"):
+    """
+    Write a cube dataset to disk as NetCDF or Zarr, chunked with `cube_chunks`.
+
+    Args:
+        ds (xarray.Dataset): dataset from `make_cube`
+        out_path (pathlib.Path): output path
+        fmt (str): "netcdf" or "zarr"
+
+    Returns:
+        None
+    """
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        if name == "crs":
+            continue
+        chunks = tuple(min(cube_chunks[dim], size) for dim, size in zip(var.dims, var.shape))
+        encoding[name] = {"dtype": "float32", "_FillValue": cube_nodata}
+        if fmt == "netcdf":
+            encoding[name].update(netcdf_compression, chunksizes=chunks)
+        else:
+            encoding[name]["chunks"] = chunks
+
+    if fmt == "netcdf":
+        ds.to_netcdf(out_path, engine="netcdf4", encoding=encoding)
+    else:
+        ds.to_zarr(out_path, mode="w", encoding=encoding)
+
+
+def write_variable_cube(climvar, src_dir=reprojected_dir, fmt="netcdf"):
+    """
+    Write the cube for a variable from its summary GeoTIFFs.
+
+    Args:
+        climvar (str): name of the physical variable
+        src_dir (pathlib.Path): directory of the summary GeoTIFFs
+        fmt (str): "netcdf" or "zarr"
+
+    Returns:
+        out_path (pathlib.Path): path of the cube written
+    """
+    groups = {
+        (model, scenario): list_group_tifs(src_dir, climvar, model, scenario)
+        for model in models
+        for scenario in scenarios
+    }
+    cube_models = [m for m in models if any(groups[(m, s)] for s in scenarios)]
+    cube_scenarios = [s for s in scenarios if any(groups[(m, s)] for m in models)]
+    if not cube_models:
+        raise FileNotFoundError(f"No summary GeoTIFFs found for {climvar} in {src_dir}")
+
+    first_tif = next(fps[0] for fps in groups.values() if fps)
+    with rio.open(first_tif) as src:
+        raster_profile = src.profile.copy()
+
+    ds = make_cube(src_dir, climvar, cube_models, cube_scenarios, raster_profile)
+    out_path = cube_path(climvar, fmt)
+    write_cube(ds, out_path, fmt)
+    return out_path
+
+
+def open_cube(climvar, fmt="netcdf"):
+    """
+    Open the cube for a variable lazily, nodata is decoded to NaN.
+
+    Args:
+        climvar (str): name of the physical variable
+        fmt (str): "netcdf" or "zarr"
+
+    Returns:
+        xarray.Dataset
+    """
+    fp = cube_path(climvar, fmt)
+    if fmt == "netcdf":
+        return xr.open_dataset(fp, chunks={})
+    return xr.open_zarr(fp)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--vars",
+        nargs="+",
+        default=list(summary_di),
+        choices=list(summary_di),
+        help="variables to write cubes for (default: all)",
+    )
+    parser.add_argument(
+        "--src-dir",
+        type=Path,
+        default=reprojected_dir,
+        help="directory of the summary GeoTIFFs (default: the EPSG:3338 GeoTIFFs in reprojected_dir, use $OUTPUT_DIR for the WRF grid GeoTIFFs)",
+    )
+    parser.add_argument(
+        "--format", default="netcdf", choices=["netcdf", "zarr"], help="cube format"
+    )
+    args = parser.parse_args()
+
+    for climvar in args.vars:
+        print(f"{write_variable_cube(climvar, args.src_dir, args.format)} written")
@@ -0,0 +1,181 @@
+"""Extract raster values at many point locations from many GeoTIFFs at once.
+
+Point coordinates are transformed from WGS84 lat/lon to row/column once per grid (CRS, transform, and shape) rather than once per point and file. Each raster is opened once and the values of all points are read in a single pass, either as the window bounding the points or, for tiled rasters where that is smaller, as only the blocks that hold points, then gathered with fancy indexing. Files are processed concurrently on a thread pool (rasterio releases the GIL while reading).
+
+The result is a tidy table with one row per location and file.
+
+Example usage:
+    python point_query.py alaska_point_locations.csv /path/to/geotiffs --glob "*.tif" --out point_values.csv
+"""
+
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import rasterio as rio
+from rasterio.transform import rowcol
+from rasterio.windows import Window
+from pyproj import Transformer
+
+
+@lru_cache(maxsize=None)
+def get_transformer(crs_wkt):
+    """Get a cached lon/lat (WGS84) to projected coordinate transformer for a CRS."""
+    return Transformer.from_crs("EPSG:4326", crs_wkt, always_xy=True)
+
+
+def points_to_rowcol(lats, lons, crs_wkt, transform, shape):
+    """
+    Find the raster rows and columns of points with one vectorized coordinate transform.
+
+    Args:
+        lats (numpy.ndarray): latitudes of the points
+        lons (numpy.ndarray): longitudes of the points
+        crs_wkt (str): WKT of the raster CRS
+        transform (affine.Affine): raster transform
+        shape (tuple): raster (height, width)
+
+    Returns:
+        rows (numpy.ndarray): row of each point
+        cols (numpy.ndarray): column of each point
+        inside (numpy.ndarray): boolean mask of the points that fall on the raster
+    """
+    xs, ys = get_transformer(crs_wkt).transform(lons, lats)
+    rows, cols = rowcol(transform, xs, ys)
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    return rows, cols, inside
+
+
+def read_values(src, rows, cols, band=1):
+    """
+    Read the values of a raster band at some in-bounds rows and columns in one pass. The bounding window of the points is read unless the raster is tiled and the blocks holding points cover fewer pixels, in which case only those blocks are read.
+
+    Args:
+        src (rasterio.io.DatasetReader): open raster
+        rows (numpy.ndarray): rows of the points, all within the raster
+        cols (numpy.ndarray): columns of the points, all within the raster
+        band (int): band to read
+
+    Returns:
+        numpy.ndarray: value at each point
+    """
+    row_off, col_off = rows.min(), cols.min()
+    window_pixels = (rows.max() - row_off + 1) * (cols.max() - col_off + 1)
+
+    block_h, block_w = src.block_shapes[band - 1]
+    block_ids = np.unique(np.stack([rows // block_h, cols // block_w], axis=1), axis=0)
+    if src.is_tiled and len(block_ids) * block_h * block_w < window_pixels:
+        values = np.empty(len(rows), dtype=src.dtypes[band - 1])
+        for block_row, block_col in block_ids:
+            window = src.block_window(band, block_row, block_col)
+            block = src.read(band, window=window)
+            in_block = (rows // block_h == block_row) & (cols // block_w == block_col)
+            values[in_block] = block[
+                rows[in_block] - window.row_off, cols[in_block] - window.col_off
+            ]
+        return values
+
+    window = Window(
+        col_off, row_off, cols.max() - col_off + 1, rows.max() - row_off + 1
+    )
+    arr = src.read(band, window=window)
+    return arr[rows - row_off, cols - col_off]
+
+
+def query_file(fp, lats, lons, rowcol_cache, cache_lock):
+    """
+    Extract the values of all points from one raster. Points off the raster get NaN.
+
+    Args:
+        fp (pathlib.Path): raster file
+        lats (numpy.ndarray): latitudes of the points
+        lons (numpy.ndarray): longitudes of the points
+        rowcol_cache (dict): rows and columns of the points already computed, keyed by grid
+        cache_lock (threading.Lock): lock guarding `rowcol_cache`
+
+    Returns:
+        numpy.ndarray: float64 value at each point
+    """
+    with rio.open(fp) as src:
+        crs_wkt = src.crs.to_wkt()
+        grid_key = (crs_wkt, tuple(src.transform)[:6], src.height, src.width)
+        with cache_lock:
+            if grid_key not in rowcol_cache:
+                rowcol_cache[grid_key] = points_to_rowcol(
+                    lats, lons, crs_wkt, src.transform, (src.height, src.width)
+                )
+            rows, cols, inside = rowcol_cache[grid_key]
+
+        values = np.full(len(lats), np.nan)
+        if inside.any():
+            values[inside] = read_values(src, rows[inside], cols[inside])
+    return values
+
+
+def query_points(paths, points, max_workers=8, lat_col="latitude", lon_col="longitude"):
+    """
+    Extract the values of many points from many rasters.
+
+    Args:
+        paths (list): raster files to query
+        points (pandas.DataFrame): point locations, the index identifies each location
+        max_workers (int): number of files read concurrently
+        lat_col (str): name of the latitude column of `points`
+        lon_col (str): name of the longitude column of `points`
+
+    Returns:
+        pandas.DataFrame: tidy table with "location", "file" (file name), and "value" columns. Points off a raster have NaN values, nodata values are returned as stored.
+    """
+    lats = points[lat_col].to_numpy(dtype=np.float64)
+    lons = points[lon_col].to_numpy(dtype=np.float64)
+    rowcol_cache = {}
+    cache_lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            executor.map(
+                lambda fp: query_file(fp, lats, lons, rowcol_cache, cache_lock), paths
+            )
+        )
+
+    if not results:
+        return pd.DataFrame(columns=["location", "file", "value"])
+    return pd.DataFrame(
+        {
+            "location": np.tile(points.index.to_numpy(), len(paths)),
+            "file": np.repeat([Path(fp).name for fp in paths], len(points)),
+            "value": np.concatenate(results),
+        }
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "points",
+        type=Path,
+        help="CSV of point locations with id, latitude, and longitude columns",
+    )
+    parser.add_argument("raster_dir", type=Path, help="directory of the rasters to query")
+    parser.add_argument(
+        "--glob", default="*.tif", help="pattern of the rasters in raster_dir (default: *.tif)"
+    )
+    parser.add_argument(
+        "--out", type=Path, default=Path("point_values.csv"), help="output CSV (default: ./point_values.csv)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="number of files read concurrently (default: 8)"
+    )
+    args = parser.parse_args()
+
+    points = pd.read_csv(args.points).set_index("id")
+    paths = sorted(args.raster_dir.glob(args.glob))
+    values = query_points(paths, points, args.workers)
+    values.to_csv(args.out, index=False)
+    print(f"{len(values)} values from {len(paths)} files written to {args.out}")